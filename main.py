@@ -1,4 +1,3 @@
-import threading
 from dotenv import load_dotenv
 import os
 import time
@@ -13,19 +12,23 @@ from modules.logging_setup import setup_logging
 # Configure stdlib logging (controls 3rd party libs like httpx).
 setup_logging()
 
+from modules.cameras import load_cameras
 from modules.record_trigger import record_loop
 from modules.onvif_handler import onvif_event_listener
 from modules.commands_handler import run as commands_listener
 from modules.sender import send_loop
+from modules.storage import storage_loop
 from modules.telegram_utils import send_telegram_message
 
 
+import asyncio
 import signal
-import sys
+
+from modules import metrics, runtime
 
 _SENT_STOP = False
 
-def _notify_stop(reason: str | None = None):
+async def _notify_stop(reason: str | None = None):
     global _SENT_STOP
     if _SENT_STOP:
         return
@@ -34,26 +37,58 @@ def _notify_stop(reason: str | None = None):
         text = "🔴 Бот камеры остановлен"
         if reason:
             text += f": {reason}"
-        send_telegram_message(text)
+        await send_telegram_message(text)
     except Exception:
         pass
 
-def _signal_handler(signum, frame):
-    name = {signal.SIGINT: "SIGINT", signal.SIGTERM: "SIGTERM"}.get(signum, str(signum))
-    _notify_stop(name)
-    # немедленно завершаем процесс (демон-потоки завершатся автоматически)
-    sys.exit(0)
 
-# регистрируем обработчики сигналов
-signal.signal(signal.SIGINT, _signal_handler)
-signal.signal(signal.SIGTERM, _signal_handler)
-if __name__ == "__main__":
+async def _main():
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    stop_reason = []
+
+    def _on_signal(name: str):
+        stop_reason.append(name)
+        stop.set()
+
+    # SIGTERM приходит и от /reboot, /exit (os.kill самому себе)
+    for signum, name in ((signal.SIGINT, "SIGINT"), (signal.SIGTERM, "SIGTERM")):
+        loop.add_signal_handler(signum, _on_signal, name)
+
     # уведомление о старте
     try:
-        send_telegram_message("🟢 Бот камеры запущен")
+        await asyncio.wait_for(send_telegram_message("🟢 Бот камеры запущен"), 30)
+    except Exception:
+        pass
+    cameras = load_cameras()
+    multi = len(cameras) > 1
+    await metrics.start_server()
+    # Рекордер, ONVIF-слушатель и отправщик — на каждую камеру; Telegram-аплоадер и команды общие.
+    # Все циклы — корутины этого loop'а под присмотром runtime.supervise (modules/runtime.py).
+    tasks = []
+    for cam in cameras:
+        tasks.append(asyncio.create_task(runtime.supervise(f"record-{cam.name}", record_loop, cam)))
+        tasks.append(asyncio.create_task(runtime.supervise(f"onvif-{cam.name}", onvif_event_listener, cam, multi)))
+        tasks.append(asyncio.create_task(runtime.supervise(f"send-{cam.name}", send_loop, cam, multi)))
+    # квота общая на все камеры (обычно один том)
+    tasks.append(asyncio.create_task(runtime.supervise(
+        "storage",
+        storage_loop,
+        [c.video_dir for c in cameras],
+        [c.archive_dir for c in cameras if c.dual_stream],
+    )))
+    tasks.append(asyncio.create_task(runtime.supervise("commands", commands_listener, cameras)))
+
+    await stop.wait()
+    for task in tasks:
+        task.cancel()
+    # отмена доходит до ffmpeg записи: они получают SIGTERM и закрывают контейнер
+    await asyncio.wait(tasks, timeout=15)
+    try:
+        await asyncio.wait_for(_notify_stop(stop_reason[0]), 30)
     except Exception:
         pass
-    threading.Thread(target=record_loop, daemon=True).start()
-    threading.Thread(target=onvif_event_listener, daemon=True).start()
-    threading.Thread(target=commands_listener, daemon=True).start()
-    send_loop()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,147 @@
+"""Описание камер для работы нескольких камер в одном процессе.
+
+Список камер задаётся JSON-массивом в CAMERAS (или файлом CAMERAS_FILE).
+Ключи объекта — те же имена, что и переменные окружения (RTSP_URL, ONVIF_HOST, ...),
+регистр не важен; всё, что не задано для камеры, берётся из глобальных
+настроек modules/env_config.py. Без CAMERAS работает одна камера из глобальных настроек.
+
+Пример:
+    CAMERAS=[{"name": "gate", "RTSP_URL": "rtsp://...", "ONVIF_HOST": "10.0.0.2"},
+             {"name": "yard", "RTSP_URL": "rtsp://...", "RECORD_ON_ALERT_ONLY": false}]
+"""
+import os
+import re
+import json
+from dataclasses import dataclass, field, fields
+from asyncio import Event
+
+from modules import env_config
+from modules.logger import log
+
+# Имя камеры становится именем подпапки, меткой метрик и частью путей в списках ffmpeg
+_NAME_RE = re.compile(r"[A-Za-z0-9_-]+")
+
+
+@dataclass
+class Camera:
+    name: str
+    rtsp_url: str
+    video_dir: str
+    rtsp_sub_url: str
+    archive_dir: str
+    record_on_alert_only: bool
+    alert_record_seconds: int
+    alert_max_record_seconds: int
+    continuous_segment_seconds: int
+    continuous_segmenter: bool
+    preroll_seconds: float
+    preroll_chunk_seconds: float
+    preroll_dir: str
+    send_original_mkv: int
+    trim_start_seconds: float
+    video_preview_enabled: bool
+    onvif_enabled: bool
+    onvif_host: str
+    onvif_port: int
+    onvif_user: str
+    onvif_pass: str
+    snapshot_url: str
+    onvif_log_level: int
+    is_motion_enabled: bool
+    is_tamper_enabled: bool
+    alert_timeout: int
+    # Событие алёрта этой камеры (устанавливает ONVIF-слушатель, ждёт рекордер)
+    alert_event: Event = field(default_factory=Event, repr=False, compare=False)
+
+    @property
+    def staging_dir(self) -> str:
+        return os.path.join(self.video_dir, ".recording")
+
+    @property
+    def archive_staging_dir(self) -> str:
+        return os.path.join(self.archive_dir, ".recording")
+
+    @property
+    def dual_stream(self) -> bool:
+        """Есть sub-поток: в Telegram идёт он, основной поток — только в архив."""
+        return bool(self.rtsp_sub_url)
+
+    @property
+    def upload_url(self) -> str:
+        """Поток, который записывается для отправки в Telegram."""
+        return self.rtsp_sub_url or self.rtsp_url
+
+
+def _to_bool(v) -> bool:
+    if isinstance(v, bool):
+        return v
+    return str(v).strip().lower() in {"1", "true", "yes", "y", "on"}
+
+
+def _coerce(value, default):
+    # приводим значение из JSON к типу глобальной настройки
+    if isinstance(default, bool):
+        return _to_bool(value)
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return str(value)
+
+
+def _load_raw() -> list[dict]:
+    raw = os.getenv("CAMERAS", "").strip()
+    path = os.getenv("CAMERAS_FILE", "").strip()
+    if not raw and path:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = f.read()
+    if not raw:
+        return []
+    data = json.loads(raw)
+    if not isinstance(data, list):
+        raise ValueError("CAMERAS должен быть JSON-массивом объектов")
+    return data
+
+
+def _build(item: dict, index: int, multi: bool) -> Camera:
+    opts = {str(k).lower(): v for k, v in item.items()}
+    name = str(opts.pop("name", "") or (f"cam{index + 1}" if multi else os.getenv("CAMERA_NAME", "camera")))
+    if not _NAME_RE.fullmatch(name):
+        raise ValueError(f"Недопустимое имя камеры {name!r}: только латиница, цифры, '_' и '-'")
+
+    # в многокамерном режиме у каждой камеры своя подпапка, иначе файлы перемешаются
+    default_video_dir = os.path.join(env_config.VIDEO_DIR, name) if multi else env_config.VIDEO_DIR
+    video_dir = str(opts.pop("video_dir", default_video_dir))
+
+    values = {"name": name, "video_dir": video_dir}
+    for f in fields(Camera):
+        if f.name in values or f.name == "alert_event":
+            continue
+        if f.name == "preroll_dir":
+            default = os.path.join(video_dir, ".preroll") if multi else env_config.PREROLL_DIR
+        elif f.name == "archive_dir":
+            default = os.path.join(video_dir, "archive") if multi else env_config.ARCHIVE_DIR
+        else:
+            default = getattr(env_config, f.name.upper())
+        values[f.name] = _coerce(opts.pop(f.name), default) if f.name in opts else default
+
+    if opts:
+        log(f"⚠️ Камера {name}: неизвестные параметры {sorted(opts)} игнорируются")
+    return Camera(**values)
+
+
+def load_cameras() -> list[Camera]:
+    items = _load_raw()
+    multi = len(items) > 1
+    if not items:
+        items = [{}]
+    cams = [_build(item, i, multi) for i, item in enumerate(items)]
+
+    names = [c.name for c in cams]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Имена камер должны быть уникальны: {names}")
+    for cam in cams:
+        os.makedirs(cam.video_dir, exist_ok=True)
+        if cam.dual_stream:
+            os.makedirs(cam.archive_dir, exist_ok=True)
+    return cams
@@ -1,16 +1,26 @@
-import time
+import asyncio
 import os
 import httpx
 from modules.env_config import (
-    TG_TOKEN, TG_CHAT_ID, TG_SILENT_MODE,
+    TG_TOKEN, TG_CHAT_ID, TG_SILENT_MODE, TG_API_BASE_URL,
     IS_MOTION_ENABLED, IS_TAMPER_ENABLED, ALERT_TIMEOUT,
     ONVIF_ENABLED, SEND_ORIGINAL_MKV, TRIM_START_SECONDS
 )
 from modules.logger import log
+from modules import http_pool, upload_scheduler
 
-API_URL = f"https://api.telegram.org/bot{TG_TOKEN}"
+API_URL = f"{TG_API_BASE_URL}/bot{TG_TOKEN}"
 
-def handle_command(command, args):
+def _pick_camera(cameras, name):
+    """Камера по имени; без имени — первая из списка."""
+    if not name:
+        return cameras[0]
+    for cam in cameras:
+        if cam.name == name:
+            return cam
+    return None
+
+async def handle_command(command, args, cameras):
     from modules.env_config import (
         IS_MOTION_ENABLED, IS_TAMPER_ENABLED, ALERT_TIMEOUT,
         ONVIF_ENABLED, SEND_ORIGINAL_MKV, TG_SILENT_MODE,
@@ -18,35 +28,58 @@ def handle_command(command, args):
     )
     from modules.telegram_utils import send_snapshot, send_telegram_message
     from modules.record_trigger import trigger_record
+    from modules.storage import ALERT_CLIP_SUFFIX
     import sys, os
 
     if command == '/help':
         return (
             "🤖 Доступные команды:\n"
             "/help - показать эту справку\n"
-            "/photo - сделать и отправить снимок с камеры\n"
-            "/video [минуты] - записать видео (1-30 мин, по умолчанию 1 мин)\n"
+            "/photo [камера] - сделать и отправить снимок (без имени — со всех камер)\n"
+            "/video [минуты] [камера] - записать видео (1-30 мин, по умолчанию 1 мин)\n"
             "/env - показать текущие настройки окружения\n"
+            "/rec - статистика записи (fps, битрейт, потери, перезапуски)\n"
+            "/storage - занятое место по классам файлов и очередь на отправку\n"
+            "/net - соединения с Telegram и камерами, ожидание из-за лимитов Telegram\n"
+            "/trace [id] - задержка алёртов: от события до фото и до клипа (с id — по этапам)\n"
             "/reboot - перезагрузить контейнер (SIGTERM)\n"
             "/exit - остановить бота (SIGTERM)\n"
         )
     elif command == '/photo':
-        try:
-            return send_snapshot()
-        except:
-            return "❌ Ошибка при отправке снимка"
+        if args:
+            cam = _pick_camera(cameras, args[0])
+            if cam is None:
+                return f"❌ Нет камеры {args[0]}"
+            targets = [cam]
+        else:
+            targets = [c for c in cameras if c.snapshot_url]
+        failed = []
+        for cam in targets:
+            try:
+                await send_snapshot(cam.snapshot_url, caption=cam.name if len(cameras) > 1 else None)
+            except Exception:
+                failed.append(cam.name)
+        if failed:
+            return f"❌ Ошибка при отправке снимка: {', '.join(failed)}"
+        return None
     elif command == '/video':
         try:
             minutes = 1
-            if args and args[0].isdigit():
-                minutes = min(max(1, int(args[0])), 30)
-            send_telegram_message(f"🎥 Начинаю запись видео {minutes} мин...")
-            trigger_record(minutes * 60)
+            rest = list(args)
+            if rest and rest[0].isdigit():
+                minutes = min(max(1, int(rest.pop(0))), 30)
+            cam = _pick_camera(cameras, rest[0] if rest else None)
+            if cam is None:
+                return f"❌ Нет камеры {rest[0]}"
+            await send_telegram_message(f"🎥 Начинаю запись видео {minutes} мин ({cam.name})...")
+            # ручные клипы ценны так же, как клипы по алёрту — и удаляются при нехватке места последними
+            await trigger_record(cam, minutes * 60, suffix=ALERT_CLIP_SUFFIX)
             return "✅ Запись завершена"
         except:
             return "❌ Ошибка при записи"
     elif command == '/env':
         return (
+            f"CAMERAS = {', '.join(c.name for c in cameras)}\n"
             f"IS_MOTION_ENABLED = {IS_MOTION_ENABLED}\n"
             f"IS_TAMPER_ENABLED = {IS_TAMPER_ENABLED}\n"
             f"ONVIF_ENABLED = {ONVIF_ENABLED}\n"
@@ -60,6 +93,19 @@ def handle_command(command, args):
             f"TG_MAX_FILE_MB = {__import__('modules.env_config').env_config.TG_MAX_FILE_MB}\n"
             f"TG_SPLIT_SAFETY = {__import__('modules.env_config').env_config.TG_SPLIT_SAFETY}\n"
         )
+    elif command == '/rec':
+        from modules.ffmpeg_progress import format_recorder_stats
+        return format_recorder_stats()
+    elif command == '/storage':
+        from modules.storage import format_report
+        return format_report()
+    elif command == '/net':
+        from modules.http_pool import format_report
+        from modules.tg_ratelimit import format_report as format_limits
+        return format_report() + "\n\n" + format_limits()
+    elif command == '/trace':
+        from modules.tracing import format_report
+        return format_report(args[0] if args else None)
     elif command == '/toggle_motion':
         if not IS_MOTION_ENABLED:
             return "❌ Функция детекции движения отключена в конфиге"
@@ -93,19 +139,39 @@ def handle_command(command, args):
         return "\n".join(parts)
     elif command == '/reboot':
         from modules.telegram_utils import send_telegram_message
-        send_telegram_message("♻️ Перезагружаю контейнер...")
+        await send_telegram_message("♻️ Перезагружаю контейнер...")
         import os, signal; os.kill(os.getpid(), signal.SIGTERM)
     elif command == '/exit':
         from modules.telegram_utils import send_telegram_message
-        send_telegram_message("⏹ Останавливаю бота по команде /exit…")
+        await send_telegram_message("⏹ Останавливаю бота по команде /exit…")
         import os, signal; os.kill(os.getpid(), signal.SIGTERM)
     else:
         return "Неизвестная команда. Используй /help для списка."
 
-def run():
-    from modules.env_config import TG_TOKEN, TG_CHAT_ID
+async def _handle_and_reply(cmd, args, cameras, chat_id):
     from modules.telegram_utils import send_telegram_message
 
+    # снимок /photo и ответ идут раньше видео, но после фото по алёрту
+    with upload_scheduler.priority(upload_scheduler.COMMAND):
+        reply = await handle_command(cmd, args, cameras)
+        if reply is None:
+            return
+
+        try:
+            await send_telegram_message(reply, chat_id=chat_id)
+            log("Sent message")
+        except Exception as e:
+            log(f"⚠️ Ошибка отправки сообщения: {e}")
+
+
+async def run(cameras):
+    """Long-poll команд в event loop'е (modules/runtime.py).
+
+    Каждая команда — отдельная задача asyncio: /video на 30 минут больше не задерживает
+    /photo или /exit, присланные следом.
+    """
+    from modules.env_config import TG_TOKEN, TG_CHAT_ID, TG_CHAT_IDS
+
     if not TG_TOKEN or not TG_CHAT_ID:
         log("⚠️ TG_TOKEN/TG_CHAT_ID пусты. Обработчик команд Telegram отключен.")
         return
@@ -115,51 +181,56 @@ def run():
 
     timeout = httpx.Timeout(connect=5.0, read=40.0, write=40.0, pool=5.0)
 
-    with httpx.Client(timeout=timeout, http2=False) as client:
-        while True:
-            params = {
-                'timeout': 30,
-                'allowed_updates': ['message']
-            }
-            if offset:
-                params['offset'] = offset
+    # long-poll держит одно соединение общего пула Bot API
+    client = http_pool.telegram()
+    # ссылки на выполняющиеся команды: loop держит задачи только слабыми ссылками
+    running: set[asyncio.Task] = set()
+    while True:
+        params = {
+            'timeout': 30,
+            'allowed_updates': ['message']
+        }
+        if offset:
+            params['offset'] = offset
 
-            try:
-                log("⌛ Telegram: polling for updates")
-                resp = client.get(f"{API_URL}/getUpdates", params=params)
-                resp.raise_for_status()
-                data = resp.json()
-            except (httpx.RequestError, httpx.HTTPStatusError) as e:
-                log(f"❌ Polling error: {e}. retry in 5s")
-                time.sleep(5)
-                continue
-            except ValueError as e:
-                log(f"❌ JSON parse error: {e}. retry in 5s")
-                time.sleep(5)
+        try:
+            log("⌛ Telegram: polling for updates")
+            resp = await client.get(f"{API_URL}/getUpdates", params=params, timeout=timeout)
+            resp.raise_for_status()
+            data = resp.json()
+        except (httpx.RequestError, httpx.HTTPStatusError) as e:
+            log(f"❌ Polling error: {e}. retry in 5s")
+            await asyncio.sleep(5)
+            continue
+        except ValueError as e:
+            log(f"❌ JSON parse error: {e}. retry in 5s")
+            await asyncio.sleep(5)
+            continue
+
+        for update in data.get('result', []):
+            offset = update.get('update_id', 0) + 1
+            msg = update.get('message')
+            # команды принимаем из любого чата TG_CHAT_ID, отвечаем туда же
+            chat_id = str((msg or {}).get('chat', {}).get('id'))
+            if not msg or chat_id not in TG_CHAT_IDS:
                 continue
 
-            for update in data.get('result', []):
-                offset = update.get('update_id', 0) + 1
-                msg = update.get('message')
-                if not msg or str(msg.get('chat', {}).get('id')) != str(TG_CHAT_ID):
-                    continue
+            text = (msg.get('text') or '').strip()
+            if not text.startswith('/'):
+                continue
 
-                text = (msg.get('text') or '').strip()
-                if not text.startswith('/'):
-                    continue
+            parts = text.split()
+            cmd = parts[0].split('@')[0]
+            args = parts[1:]
 
-                parts = text.split()
-                cmd = parts[0].split('@')[0]
-                args = parts[1:]
+            task = asyncio.create_task(_handle_and_reply(cmd, args, cameras, chat_id), name=f"command-{cmd}")
+            running.add(task)
+            task.add_done_callback(running.discard)
+            task.add_done_callback(_log_command_error)
 
-                reply = handle_command(cmd, args)
-                if reply is None:
-                    continue
+        await asyncio.sleep(0.1)
 
-                try:
-                    send_telegram_message(reply)
-                    log("Sent message")
-                except Exception as e:
-                    log(f"⚠️ Ошибка отправки сообщения: {e}")
 
-            time.sleep(0.1)
+def _log_command_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        log(f"⚠️ Ошибка выполнения команды: {task.exception()!r}")
@@ -7,15 +7,34 @@ load_dotenv()
 # Telegram
 # -----------------------------
 TG_TOKEN = os.getenv("TG_TOKEN", "")
-TG_CHAT_ID = os.getenv("TG_CHAT_ID", "")
+# Один chat_id или несколько через запятую. Файл загружается в первый чат,
+# остальным рассылается по file_id — без повторной загрузки тех же байт.
+TG_CHAT_IDS = [c.strip() for c in os.getenv("TG_CHAT_ID", "").split(",") if c.strip()]
+TG_CHAT_ID = TG_CHAT_IDS[0] if TG_CHAT_IDS else ""
 # 0=без звука, 1=вибро, 2=с уведомлением
 TG_SILENT_MODE = int(os.getenv("TG_SILENT_MODE", "0"))
+# Адрес Bot API. Для собственного сервера (telegram-bot-api) — например http://telegram-bot-api:8081
+TG_API_BASE_URL = os.getenv("TG_API_BASE_URL", "https://api.telegram.org").rstrip("/")
+# true = сервер запущен с --local: файлы передаются путями file:// (общий том с VIDEO_DIR),
+# а не загружаются по HTTP, и лимит на файл — 2000 МБ вместо 50.
+TG_LOCAL_MODE = os.getenv("TG_LOCAL_MODE", "false").lower() == "true"
+# Части одной записи отправлять одним альбомом (sendMediaGroup, до 10 видео в сообщении).
+# Части заранее параллельно загружаются в служебный чат TG_ALBUM_STAGING_CHAT_ID (например,
+# закрытый канал), затем альбом рассылается по file_id. В TG_LOCAL_MODE служебный чат не нужен.
+TG_SEND_ALBUMS = os.getenv("TG_SEND_ALBUMS", "false").lower() == "true"
+TG_ALBUM_STAGING_CHAT_ID = os.getenv("TG_ALBUM_STAGING_CHAT_ID", "")
+# Сколько частей альбома загружается одновременно
+TG_ALBUM_UPLOAD_WORKERS = int(os.getenv("TG_ALBUM_UPLOAD_WORKERS", "3"))
 
 # -----------------------------
 # RTSP / Recording
 # -----------------------------
 RTSP_URL = os.getenv("RTSP_URL", "")
 VIDEO_DIR = os.getenv("VIDEO_DIR", "/videos")
+# Необязательный второй (низкого разрешения) поток камеры. Если задан — пишутся оба потока
+# параллельно (stream copy): файл sub-потока уходит в Telegram, файл основного остаётся в ARCHIVE_DIR.
+RTSP_SUB_URL = os.getenv("RTSP_SUB_URL", "")
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(VIDEO_DIR, "archive"))
 FFMPEG_LOGLEVEL = os.getenv("FFMPEG_LOGLEVEL", "error")
 
 # Управление режимами записи
@@ -25,8 +44,27 @@ RECORD_ON_ALERT_ONLY = os.getenv("RECORD_ON_ALERT_ONLY", "false").lower() == "tr
 # Длительности (секунды)
 # Сколько секунд писать после алёрта (одним файлом)
 ALERT_RECORD_SECONDS = int(os.getenv("ALERT_RECORD_SECONDS", "120"))
+# Новые алёрты во время записи продлевают клип (конец = последний алёрт + ALERT_RECORD_SECONDS),
+# но не дольше этого потолка от начала клипа. 0 = не продлевать.
+ALERT_MAX_RECORD_SECONDS = int(os.getenv("ALERT_MAX_RECORD_SECONDS", "600"))
 # Длина одного сегмента при непрерывной записи (выравнивается по сетке)
 CONTINUOUS_SEGMENT_SECONDS = int(os.getenv("CONTINUOUS_SEGMENT_SECONDS", "300"))
+# true  = один долгоживущий ffmpeg (segment-муксер) на всю непрерывную запись
+# false = старый режим: новый ffmpeg и новое RTSP-подключение на каждый сегмент
+CONTINUOUS_SEGMENTER = os.getenv("CONTINUOUS_SEGMENTER", "true").lower() == "true"
+
+# Сторож записи: если ffmpeg не пишет новых кадров столько секунд — поток считается
+# зависшим, записанное сохраняется, ffmpeg перезапускается.
+RECORD_STALL_SECONDS = float(os.getenv("RECORD_STALL_SECONDS", "15"))
+
+# Pre-roll для записи по алёрту: сколько секунд ДО события попадёт в клип
+# (поток постоянно режется на короткие чанки по PREROLL_CHUNK_SECONDS).
+PREROLL_SECONDS = float(os.getenv("PREROLL_SECONDS", "10"))
+PREROLL_CHUNK_SECONDS = float(os.getenv("PREROLL_CHUNK_SECONDS", "2"))
+# Куда писать чанки. Для tmpfs можно указать /dev/shm/... (учтите shm_size контейнера).
+PREROLL_DIR = os.getenv("PREROLL_DIR", os.path.join(VIDEO_DIR, ".preroll"))
+# Путь, под которым VIDEO_DIR виден серверу Bot API в TG_LOCAL_MODE (если том смонтирован иначе)
+TG_LOCAL_VIDEO_DIR = os.getenv("TG_LOCAL_VIDEO_DIR", VIDEO_DIR)
 
 # -----------------------------
 # Encoding / отправка
@@ -35,14 +73,77 @@ CONTINUOUS_SEGMENT_SECONDS = int(os.getenv("CONTINUOUS_SEGMENT_SECONDS", "300"))
 # 1=отправлять оригинал MKV
 # 2=конвертировать в H.264/AAC MP4
 # 3=конвертировать и ОПЦИОНАЛЬНО обрезать старт на TRIM_START_SECONDS
+# 4=перекодировать H.264 под размер: битрейт из длительности и TG_MAX_FILE_MB × TG_SPLIT_SAFETY
 SEND_ORIGINAL_MKV = int(os.getenv("SEND_ORIGINAL_MKV", "3"))
 # Сколько секунд срезать с начала (для быстрого появления изображения в плеере)
 TRIM_START_SECONDS = float(os.getenv("TRIM_START_SECONDS", "0"))
 
 # Параметры нарезки перед отправкой в TG (чтобы уложиться в лимиты)
-TG_MAX_FILE_MB = float(os.getenv("TG_MAX_FILE_MB", "50"))
+TG_MAX_FILE_MB = float(os.getenv("TG_MAX_FILE_MB", "2000" if TG_LOCAL_MODE else "50"))
 TG_SPLIT_SAFETY = float(os.getenv("TG_SPLIT_SAFETY", "0.80"))  # 0..1
 
+# Режим 4: CRF с потолком битрейта (maxrate/bufsize), потолок рассчитан так, чтобы клип
+# (или каждая его часть) гарантированно уложился в лимит. Статичные сцены выходят меньше потолка.
+TRANSCODE_PRESET = os.getenv("TRANSCODE_PRESET", "veryfast")
+TRANSCODE_CRF = int(os.getenv("TRANSCODE_CRF", "28"))
+# Если на весь клип выходит меньше — клип режется на части по времени
+TRANSCODE_MIN_KBPS = int(os.getenv("TRANSCODE_MIN_KBPS", "400"))
+# Выше этого битрейт не поднимаем, даже если лимит позволяет
+TRANSCODE_MAX_KBPS = int(os.getenv("TRANSCODE_MAX_KBPS", "4000"))
+TRANSCODE_AUDIO_KBPS = int(os.getenv("TRANSCODE_AUDIO_KBPS", "64"))
+# Не выше этой высоты кадра (0 = без ограничения)
+TRANSCODE_MAX_HEIGHT = int(os.getenv("TRANSCODE_MAX_HEIGHT", "0"))
+# true = при низком битрейте дополнительно уменьшать кадр (720p/480p/360p)
+TRANSCODE_AUTO_SCALE = os.getenv("TRANSCODE_AUTO_SCALE", "true").lower() == "true"
+
+# Конвейер отправки: подготовка (превью/конвертация/нарезка) и upload идут параллельно.
+# Сколько записей одновременно готовится ffmpeg'ом (на процесс и на камеру).
+SENDER_PREPARE_WORKERS = int(os.getenv("SENDER_PREPARE_WORKERS", "1"))
+# Сколько upload'ов в Telegram одновременно (на процесс; внутри камеры порядок всегда строгий).
+SENDER_UPLOAD_WORKERS = int(os.getenv("SENDER_UPLOAD_WORKERS", "1"))
+# Лимиты частоты отправки в Telegram (modules/tg_ratelimit.py): сообщений в секунду на бота,
+# в секунду на чат и в минуту на группу/канал. На 429 отправка ждёт retry_after, но не дольше
+# TG_FLOOD_MAX_WAIT_SEC в сумме — дальше ответ считается ошибкой.
+TG_RATE_GLOBAL_PER_SEC = float(os.getenv("TG_RATE_GLOBAL_PER_SEC", "30"))
+TG_RATE_CHAT_PER_SEC = float(os.getenv("TG_RATE_CHAT_PER_SEC", "1"))
+TG_RATE_GROUP_PER_MIN = float(os.getenv("TG_RATE_GROUP_PER_MIN", "20"))
+TG_FLOOD_MAX_WAIT_SEC = float(os.getenv("TG_FLOOD_MAX_WAIT_SEC", "600"))
+# Общие HTTP-клиенты (modules/http_pool.py): сколько держать простаивающее соединение, сек,
+# предел соединений на клиент и HTTP/2 к Bot API (нужен пакет h2).
+HTTP_KEEPALIVE_SEC = float(os.getenv("HTTP_KEEPALIVE_SEC", "60"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+TG_HTTP2 = os.getenv("TG_HTTP2", "false").lower() == "true"
+# Общий лимит скорости загрузки видео в Telegram, кбит/с (0 — без лимита).
+TG_UPLOAD_MAX_KBPS = float(os.getenv("TG_UPLOAD_MAX_KBPS", "0"))
+# Сколько секунд подряд большая загрузка может простаивать, уступая канал алёрту/ответу на команду.
+TG_UPLOAD_YIELD_MAX_SEC = float(os.getenv("TG_UPLOAD_YIELD_MAX_SEC", "20"))
+# На сколько записей подготовка может опережать отправку (ограничивает место под готовые mp4).
+SENDER_QUEUE_SIZE = int(os.getenv("SENDER_QUEUE_SIZE", "2"))
+# Журнал записей (SQLite): что записано, подготовлено и какие части уже отправлены.
+MANIFEST_PATH = os.getenv("MANIFEST_PATH", os.path.join(VIDEO_DIR, ".manifest.sqlite3"))
+# Как часто (сек) дополнительно обходить VIDEO_DIR в поисках файлов, которых нет в журнале.
+SENDER_RESCAN_SEC = float(os.getenv("SENDER_RESCAN_SEC", "300"))
+# Повтор записи после ошибки подготовки/отправки: пауза MANIFEST_RETRY_BASE_SEC, удваивается с
+# каждой неудачей до MANIFEST_RETRY_MAX_SEC; после MANIFEST_MAX_ATTEMPTS неудач (0 — без предела)
+# запись снимается с отправки (state=failed), файлы остаются на диске.
+MANIFEST_RETRY_BASE_SEC = float(os.getenv("MANIFEST_RETRY_BASE_SEC", "30"))
+MANIFEST_RETRY_MAX_SEC = float(os.getenv("MANIFEST_RETRY_MAX_SEC", "3600"))
+MANIFEST_MAX_ATTEMPTS = int(os.getenv("MANIFEST_MAX_ATTEMPTS", "20"))
+
+# -----------------------------
+# Место на диске (VIDEO_DIR)
+# -----------------------------
+# Квота на все записи, МБ. 0 = ориентироваться на заполнение файловой системы VIDEO_DIR.
+STORAGE_QUOTA_MB = float(os.getenv("STORAGE_QUOTA_MB", "0"))
+# Доли квоты: выше HIGH начинаем удалять старые записи, пока не опустимся до LOW
+STORAGE_HIGH_WATERMARK = float(os.getenv("STORAGE_HIGH_WATERMARK", "0.90"))
+STORAGE_LOW_WATERMARK = float(os.getenv("STORAGE_LOW_WATERMARK", "0.80"))
+# Порядок вытеснения классов записей (внутри класса — старые первыми)
+STORAGE_EVICT_ORDER = [
+    c.strip() for c in os.getenv("STORAGE_EVICT_ORDER", "archive,continuous,alert").split(",") if c.strip()
+]
+STORAGE_CHECK_INTERVAL_SEC = float(os.getenv("STORAGE_CHECK_INTERVAL_SEC", "60"))
+
 # -----------------------------
 # Preview (кадр перед видео)
 # -----------------------------
@@ -74,6 +175,16 @@ ALERT_TIMEOUT = int(os.getenv("ALERT_TIMEOUT", "30"))
 # DEBUG=1 включает более подробные логи (включая потенциально чувствительные данные).
 DEBUG = os.getenv("DEBUG", "0").strip().lower() in {"1", "true", "yes", "y", "on"}
 
+# Метрики Prometheus: порт HTTP-сервера с /metrics (0 — выключено) и адрес, на котором он слушает.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_BIND = os.getenv("METRICS_BIND", "0.0.0.0")
+
+# Трассировка алёртов (/trace): журнал спанов в JSONL (пусто — только в памяти)
+# и целевые задержки от ONVIF-события до фото и до отправки клипа.
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join(VIDEO_DIR, ".traces.jsonl"))
+TRACE_PHOTO_TARGET_SEC = float(os.getenv("TRACE_PHOTO_TARGET_SEC", "2"))
+TRACE_CLIP_TARGET_SEC = float(os.getenv("TRACE_CLIP_TARGET_SEC", "60"))
+
 # Уровни логирования (stdlib logging). Влияет на сторонние библиотеки (httpx/httpcore) и их вывод.
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 HTTPX_LOG_LEVEL = os.getenv("HTTPX_LOG_LEVEL", "WARNING")
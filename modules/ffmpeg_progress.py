@@ -0,0 +1,206 @@
+"""Надзор за ffmpeg записи через машиночитаемый поток прогресса (-progress pipe:N).
+
+ffmpeg каждые ~0.5 с пишет блок key=value (frame, fps, bitrate, out_time_us,
+drop_frames, ..., progress=continue|end). Если frame/out_time перестали расти
+дольше RECORD_STALL_SECONDS — поток камеры «замёрз»: процесс мягко гасим
+(SIGTERM -> ffmpeg дописывает контейнер), уже записанное сохраняем.
+"""
+import os
+import time
+import signal
+import asyncio
+import threading
+
+from modules.logger import log
+
+# Последние показатели по каждому рекордеру (ключ — имя рекордера/камеры)
+RECORDER_STATS: dict[str, dict] = {}
+_STATS_LOCK = threading.Lock()
+
+
+def _parse_bitrate_kbps(v: str) -> float | None:
+    # "2048.3kbits/s" | "N/A"
+    v = (v or "").strip()
+    if v.endswith("kbits/s"):
+        try:
+            return float(v[:-7])
+        except ValueError:
+            return None
+    return None
+
+
+def _update_stats(name: str, **kv):
+    with _STATS_LOCK:
+        st = RECORDER_STATS.setdefault(name, {"restarts": 0, "stalls": 0})
+        st.update(kv)
+
+
+def bump_stat(name: str, key: str, n: int = 1):
+    with _STATS_LOCK:
+        st = RECORDER_STATS.setdefault(name, {"restarts": 0, "stalls": 0})
+        st[key] = st.get(key, 0) + n
+
+
+def get_recorder_stats() -> dict[str, dict]:
+    with _STATS_LOCK:
+        return {k: dict(v) for k, v in RECORDER_STATS.items()}
+
+
+def format_recorder_stats() -> str:
+    stats = get_recorder_stats()
+    if not stats:
+        return "Рекордеры ещё не запускались"
+    lines = []
+    for name, st in sorted(stats.items()):
+        fps = st.get("fps")
+        kbps = st.get("bitrate_kbps")
+        age = time.time() - st["updated"] if st.get("updated") else None
+        lines.append(
+            f"{name}: fps={fps if fps is not None else '?'} "
+            f"bitrate={f'{kbps:.0f}kbps' if kbps is not None else '?'} "
+            f"drop={st.get('drop_frames', 0)} dup={st.get('dup_frames', 0)} "
+            f"restarts={st.get('restarts', 0)} stalls={st.get('stalls', 0)}"
+            + (f" (обновлено {age:.0f}s назад)" if age is not None else "")
+        )
+    return "\n".join(lines)
+
+
+class SupervisedFFmpeg:
+    """ffmpeg под asyncio: прогресс — в отдельный pipe, сторож ловит зависание.
+
+    Создаётся через `await SupervisedFFmpeg.start(...)`; остальные именованные аргументы
+    уходят в asyncio.create_subprocess_exec (stdout=PIPE и т.п.).
+    """
+
+    def __init__(self, name: str, *, stall_seconds: float, max_seconds: float | None = None):
+        self.name = name
+        self.stall_seconds = max(1.0, float(stall_seconds))
+        self.max_seconds = max_seconds
+        self.stalled = False
+        self.timed_out = False
+        self.proc: asyncio.subprocess.Process | None = None
+        self._last_frame = -1
+        self._last_out_us = -1
+        self._last_advance = time.time()
+        self._tasks: list[asyncio.Task] = []
+
+    @classmethod
+    async def start(cls, name: str, cmd: list[str], *, stall_seconds: float, max_seconds: float | None = None, **proc_kw):
+        self = cls(name, stall_seconds=stall_seconds, max_seconds=max_seconds)
+        r, w = os.pipe()
+        # -progress/-stats_period — глобальные опции, ставим сразу после "ffmpeg"
+        full_cmd = cmd[:1] + ["-progress", f"pipe:{w}", "-stats_period", "1"] + cmd[1:]
+        progress = os.fdopen(r, "rb", buffering=0)
+        try:
+            self.proc = await asyncio.create_subprocess_exec(*full_cmd, pass_fds=(w,), **proc_kw)
+        except BaseException:
+            progress.close()
+            raise
+        finally:
+            os.close(w)
+        self._tasks = [
+            asyncio.create_task(self._read_progress(progress)),
+            asyncio.create_task(self._watch()),
+        ]
+        return self
+
+    async def _read_progress(self, pipe):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        block: dict[str, str] = {}
+        try:
+            async for raw in reader:
+                key, sep, value = raw.decode("utf-8", "replace").strip().partition("=")
+                if not sep:
+                    continue
+                if key != "progress":
+                    block[key] = value
+                    continue
+                self._on_block(block)
+                block = {}
+        finally:
+            transport.close()
+
+    def _on_block(self, block: dict[str, str]):
+        try:
+            frame = int(block.get("frame", "0") or 0)
+        except ValueError:
+            frame = 0
+        try:
+            out_us = int(block.get("out_time_us", block.get("out_time_ms", "0")) or 0)
+        except ValueError:
+            out_us = 0
+
+        now = time.time()
+        if frame > self._last_frame or out_us > self._last_out_us:
+            self._last_advance = now
+        self._last_frame = max(self._last_frame, frame)
+        self._last_out_us = max(self._last_out_us, out_us)
+
+        def _f(k):
+            try:
+                return float(block.get(k, ""))
+            except ValueError:
+                return None
+
+        def _i(k):
+            try:
+                return int(block.get(k, "0") or 0)
+            except ValueError:
+                return 0
+
+        _update_stats(
+            self.name,
+            fps=_f("fps"),
+            bitrate_kbps=_parse_bitrate_kbps(block.get("bitrate", "")),
+            frame=frame,
+            out_time_s=out_us / 1_000_000,
+            drop_frames=_i("drop_frames"),
+            dup_frames=_i("dup_frames"),
+            speed=block.get("speed", "").strip(),
+            updated=now,
+        )
+
+    async def _watch(self):
+        t0 = time.time()
+        while self.proc.returncode is None:
+            await asyncio.sleep(1.0)
+            if self.proc.returncode is not None:
+                return
+            now = time.time()
+            if now - self._last_advance > self.stall_seconds:
+                self.stalled = True
+                bump_stat(self.name, "stalls")
+                log(f"⚠️ [{self.name}] ffmpeg не двигается {now - self._last_advance:.0f}s — перезапуск")
+                await self.stop()
+                return
+            if self.max_seconds and now - t0 > self.max_seconds:
+                self.timed_out = True
+                log(f"⚠️ [{self.name}] ffmpeg превысил {self.max_seconds:.0f}s — останавливаю")
+                await self.stop()
+                return
+
+    async def stop(self, grace: float = 5.0):
+        """SIGTERM (ffmpeg корректно закрывает контейнер), затем SIGKILL."""
+        if self.proc.returncode is not None:
+            return
+        try:
+            self.proc.send_signal(signal.SIGTERM)
+            await asyncio.wait_for(self.proc.wait(), grace)
+        except asyncio.TimeoutError:
+            self.proc.kill()
+        except ProcessLookupError:
+            pass
+
+    async def wait(self) -> int:
+        try:
+            rc = await self.proc.wait()
+        except asyncio.CancelledError:
+            # цикл записи отменён (рестарт/остановка) — ffmpeg не должен пережить его
+            await asyncio.shield(self.stop())
+            raise
+        finally:
+            for task in self._tasks:
+                task.cancel()
+        return rc
@@ -0,0 +1,114 @@
+"""Ожидание новых файлов в каталоге через inotify (Linux, через ctypes — без зависимостей).
+
+send_loop раньше просыпался раз в 10 с по таймеру: готовый клип ждал до 10 с, а простаивающая
+система всё равно регулярно обходила каталог. Теперь sender ждёт готовности дескриптора
+inotify в event loop'е (add_reader) и просыпается сразу, как только в каталоге появляется завершённый файл:
+IN_MOVED_TO (публикация .mkv.part -> .mkv, перенос из staging) или IN_CLOSE_WRITE (ffmpeg дописал .mp4).
+"""
+import os
+import errno
+import asyncio
+import ctypes
+import ctypes.util
+import struct
+
+from modules.logger import log
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+_EVENT = struct.Struct("iIII")
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        _libc.inotify_init1.argtypes = [ctypes.c_int]
+        _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return _libc
+
+
+class DirWatcher:
+    """Наблюдение за появлением файлов с нужными расширениями в нескольких каталогах."""
+
+    def __init__(self, dirs: list[str], suffixes: tuple[str, ...] = (".mkv", ".mp4")):
+        libc = _load_libc()
+        self.suffixes = suffixes
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1: {os.strerror(err)}")
+        self._dirs: dict[int, str] = {}
+        for d in dirs:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(d), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                err = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(err, f"inotify_add_watch {d}: {os.strerror(err)}")
+            self._dirs[wd] = d
+
+    async def wait(self, timeout: float) -> list[str] | None:
+        """Ждать событий до timeout секунд.
+
+        Возвращает пути новых файлов ([] — таймаут или события не про нас);
+        None — очередь событий ядра переполнилась, нужен полный обход каталогов.
+        """
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        loop.add_reader(self.fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await asyncio.wait_for(ready, timeout)
+        except asyncio.TimeoutError:
+            return []
+        finally:
+            loop.remove_reader(self.fd)
+
+        data = b""
+        while True:
+            try:
+                chunk = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if not chunk:
+                break
+            data += chunk
+
+        paths: list[str] = []
+        overflow = False
+        off = 0
+        while off + _EVENT.size <= len(data):
+            wd, mask, _cookie, length = _EVENT.unpack_from(data, off)
+            name = data[off + _EVENT.size: off + _EVENT.size + length].rstrip(b"\0")
+            off += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            d = self._dirs.get(wd)
+            fname = os.fsdecode(name)
+            if d and fname and not fname.startswith(".") and fname.endswith(self.suffixes):
+                paths.append(os.path.join(d, fname))
+        return None if overflow else paths
+
+    def close(self):
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+
+def open_watcher(dirs: list[str], suffixes: tuple[str, ...] = (".mkv", ".mp4")) -> DirWatcher | None:
+    """DirWatcher или None, если inotify недоступен (не Linux, исчерпан лимит watch'ей и т.п.)."""
+    try:
+        return DirWatcher(dirs, suffixes)
+    except (OSError, AttributeError) as e:
+        log(f"⚠️ inotify недоступен ({type(e).__name__}: {e}), работаю по таймеру")
+        return None
@@ -0,0 +1,133 @@
+"""Общие на процесс HTTP-клиенты с keep-alive пулами соединений.
+
+Раньше каждый запрос к Telegram (и каждая повторная попытка) и каждый снимок с камеры
+создавали новый httpx.Client — то есть новое TCP-соединение и TLS-рукопожатие. Здесь два
+долгоживущих httpx.AsyncClient на event loop процесса (modules/runtime.py): telegram() для
+Bot API и camera() для снимков. httpx держит пул соединений на каждый хост внутри клиента.
+Таймауты задаются на каждый запрос, поэтому один клиент обслуживает и upload, и long-poll.
+
+- HTTP_KEEPALIVE_SEC — сколько держать простаивающее соединение.
+- TG_HTTP2 — HTTP/2 к Bot API (только если установлен пакет h2, иначе HTTP/1.1).
+- prewarm() — заранее открыть соединение (при алёрте, пока снимается кадр).
+- format_report() — доля запросов, ушедших по уже открытому соединению (/net).
+"""
+import time
+import asyncio
+import threading
+from urllib.parse import urlsplit
+
+import httpx
+
+from modules.env_config import HTTP_KEEPALIVE_SEC, HTTP_MAX_CONNECTIONS, TG_HTTP2
+from modules.logger import log
+
+
+class _Stats:
+    def __init__(self):
+        self.requests = 0
+        self.connects = 0
+        self.lock = threading.Lock()
+
+
+class _Pool:
+    def __init__(self, name: str, *, http2: bool = False):
+        self.name = name
+        self.http2 = http2
+        self.stats = _Stats()
+        self._client: httpx.AsyncClient | None = None
+        self._client_loop = None
+        self._prewarms: set[asyncio.Task] = set()
+        # время последнего запроса по origin — чтобы prewarm не трогал живое соединение
+        self._last_used: dict[str, float] = {}
+
+    def _trace(self, event: str, info: dict):
+        if event == "connection.connect_tcp.complete":
+            with self.stats.lock:
+                self.stats.connects += 1
+
+    async def _atrace(self, event: str, info: dict):
+        self._trace(event, info)
+
+    async def _on_request(self, request: httpx.Request):
+        with self.stats.lock:
+            self.stats.requests += 1
+        self._last_used[f"{request.url.scheme}://{request.url.netloc.decode()}"] = time.monotonic()
+        request.extensions["trace"] = self._atrace
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_SEC,
+        )
+
+    def _http2(self) -> bool:
+        if not self.http2:
+            return False
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            log(f"⚠️ HTTP/2 для {self.name} недоступен (нет пакета h2), использую HTTP/1.1")
+            self.http2 = False
+        return self.http2
+
+    def client(self) -> httpx.AsyncClient:
+        """Клиент текущего event loop'а (соединения пула привязаны к loop'у, в котором открыты)."""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                http2=self._http2(),
+                limits=self._limits(),
+                event_hooks={"request": [self._on_request]},
+            )
+            self._client_loop = loop
+        return self._client
+
+    def prewarm(self, url: str):
+        """Открыть соединение с хостом url в фоне, если недавно запросов к нему не было."""
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        if time.monotonic() - self._last_used.get(origin, 0.0) < HTTP_KEEPALIVE_SEC / 2:
+            return
+
+        async def run():
+            try:
+                # ответ не важен — нужно только установленное соединение в пуле
+                await self.client().head(origin + "/", timeout=httpx.Timeout(5.0))
+            except Exception as e:
+                log(f"⚠️ prewarm {self.name}: {type(e).__name__}: {e!r}")
+
+        task = asyncio.get_running_loop().create_task(run(), name=f"prewarm-{self.name}")
+        self._prewarms.add(task)
+        task.add_done_callback(self._prewarms.discard)
+
+
+_TELEGRAM = _Pool("telegram", http2=TG_HTTP2)
+_CAMERA = _Pool("camera")
+
+
+def telegram() -> httpx.AsyncClient:
+    """Общий клиент для Bot API (отправка, getUpdates)."""
+    return _TELEGRAM.client()
+
+
+def camera() -> httpx.AsyncClient:
+    """Общий клиент для запросов к камерам (снимки)."""
+    return _CAMERA.client()
+
+
+def prewarm(tg_url: str | None = None, camera_url: str | None = None):
+    if tg_url:
+        _TELEGRAM.prewarm(tg_url)
+    if camera_url:
+        _CAMERA.prewarm(camera_url)
+
+
+def format_report() -> str:
+    lines = ["🌐 HTTP-соединения:"]
+    for pool in (_TELEGRAM, _CAMERA):
+        with pool.stats.lock:
+            req, conn = pool.stats.requests, pool.stats.connects
+        hit = (req - conn) / req * 100 if req else 0.0
+        lines.append(f"{pool.name}: запросов {req}, новых соединений {conn}, повторное использование {hit:.0f}%")
+    return "\n".join(lines)
@@ -0,0 +1,281 @@
+"""Журнал записей (SQLite, WAL): жизненный цикл каждой записи и каждой отправленной части.
+
+Раньше единственным состоянием были имена файлов и переименования в .sent: падение между
+успешным sendVideo и os.rename давало повторную отправку, а каждый проход send_loop
+сканировал весь VIDEO_DIR. Теперь:
+
+    recordings: recorded -> converted | split -> uploaded -> cleaned   (или evicted, failed)
+    parts:      pending -> uploading -> uploaded (+ message_id Telegram)
+
+Рекордер регистрирует запись сразу после публикации файла, sender берёт из журнала только
+незавершённые записи (O(pending)), а после рестарта продолжает с той части, на которой
+остановился.
+
+Доставка — at-least-once. Отметка uploaded с message_id коммитится сразу после ответа
+Telegram, но message_id до ответа неизвестен, а проверить по Bot API, дошло ли сообщение,
+нельзя. Окно «отправили, но не записали» сжато до одного коммита; часть, застрявшая в
+uploading после падения, отправляется повторно (и это пишется в лог) — дубликат возможен,
+потеря — нет.
+
+Неудачная подготовка или отправка (note_failure) откладывает запись: pending() не отдаёт ни её,
+ни следующие записи камеры, пока не пройдёт retry_delay(attempts); после MANIFEST_MAX_ATTEMPTS
+неудач запись — failed, и очередь идёт дальше.
+"""
+import os
+import time
+import sqlite3
+import threading
+
+from modules.env_config import (
+    MANIFEST_PATH,
+    MANIFEST_RETRY_BASE_SEC,
+    MANIFEST_RETRY_MAX_SEC,
+    MANIFEST_MAX_ATTEMPTS,
+)
+from modules.logger import log
+from modules.storage import group_key
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    key         TEXT PRIMARY KEY,   -- путь без расширения и _partNNN
+    camera      TEXT NOT NULL,
+    path        TEXT NOT NULL,      -- исходный файл (.mkv / .mp4) или префикс частей
+    kind        TEXT NOT NULL,      -- mkv | mp4 | parts
+    state       TEXT NOT NULL,      -- recorded | converted | split | uploaded | cleaned | evicted
+    preview_message_id INTEGER,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    error       TEXT,
+    created     REAL NOT NULL,
+    updated     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recordings_pending ON recordings (camera, state, key);
+
+CREATE TABLE IF NOT EXISTS parts (
+    key         TEXT NOT NULL,
+    path        TEXT NOT NULL,
+    idx         INTEGER NOT NULL,
+    size        INTEGER,
+    state       TEXT NOT NULL,      -- pending | uploading | uploaded
+    message_id  INTEGER,
+    uploaded_at REAL,
+    file_id     TEXT,               -- "тип:file_id" части, загруженной заранее для альбома
+    PRIMARY KEY (key, path)
+);
+"""
+
+# Колонки, добавленные после первой версии схемы: (таблица, колонка, тип)
+_MIGRATIONS = [
+    ("parts", "file_id", "TEXT"),
+]
+
+# Состояния, после которых запись больше не обрабатывается
+DONE_STATES = ("cleaned", "evicted", "failed")
+# Из них — те, где файлов записи уже нет: только такие строки purge() удаляет из журнала
+# (failed-запись, забытая журналом, вернулась бы в отправку при обходе VIDEO_DIR)
+GONE_STATES = ("cleaned", "evicted")
+
+_lock = threading.Lock()
+_conn: sqlite3.Connection | None = None
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(MANIFEST_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(MANIFEST_PATH, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        for table, column, ctype in _MIGRATIONS:
+            if column not in {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ctype}")
+        _conn = conn
+    return _conn
+
+
+def _exec(sql: str, args=()):
+    with _lock:
+        return _db().execute(sql, args)
+
+
+def _query(sql: str, args=()) -> list[sqlite3.Row]:
+    with _lock:
+        return _db().execute(sql, args).fetchall()
+
+
+# ---------- записи ----------
+
+def add_recording(camera: str, path: str, kind: str = "mkv") -> bool:
+    """Зарегистрировать новую запись. False — уже известна."""
+    now = time.time()
+    cur = _exec(
+        "INSERT OR IGNORE INTO recordings (key, camera, path, kind, state, created, updated) "
+        "VALUES (?, ?, ?, ?, 'recorded', ?, ?)",
+        (group_key(path), camera, path, kind, now, now),
+    )
+    return cur.rowcount > 0
+
+
+def known(path: str) -> bool:
+    return bool(_query("SELECT 1 FROM recordings WHERE key = ?", (group_key(path),)))
+
+
+def get(key: str) -> sqlite3.Row | None:
+    rows = _query("SELECT * FROM recordings WHERE key = ?", (key,))
+    return rows[0] if rows else None
+
+
+def retry_delay(attempts: int) -> float:
+    """Пауза перед повтором после attempts неудач: экспоненциально, не больше MANIFEST_RETRY_MAX_SEC."""
+    if attempts <= 0:
+        return 0.0
+    return min(MANIFEST_RETRY_BASE_SEC * 2 ** min(attempts - 1, 30), MANIFEST_RETRY_MAX_SEC)
+
+
+def pending(camera: str, due_only: bool = True) -> list[sqlite3.Row]:
+    """Незавершённые записи камеры в порядке отправки (по имени = по времени записи).
+
+    due_only — список обрывается на первой записи, у которой после неудачи ещё не прошла
+    пауза retry_delay: следующие за ней не должны уйти раньше неё.
+    """
+    now = time.time()
+    rows = _query(
+        f"SELECT * FROM recordings WHERE camera = ? AND state NOT IN ({','.join('?' * len(DONE_STATES))}) ORDER BY key",
+        (camera, *DONE_STATES),
+    )
+    for i, r in enumerate(rows):
+        if due_only and r["updated"] + retry_delay(r["attempts"]) > now:
+            return rows[:i]
+    return rows
+
+
+def set_state(key: str, state: str, error: str | None = None):
+    _exec(
+        "UPDATE recordings SET state = ?, error = ?, updated = ? WHERE key = ?",
+        (state, error, time.time(), key),
+    )
+
+
+def note_failure(key: str, error: str) -> int:
+    """Учесть неудачную попытку; возвращает число неудач (0 — запись снята с отправки)."""
+    _exec(
+        "UPDATE recordings SET attempts = attempts + 1, error = ?, updated = ? WHERE key = ?",
+        (error[:500], time.time(), key),
+    )
+    rec = get(key)
+    if rec is None:
+        return 0
+    if MANIFEST_MAX_ATTEMPTS > 0 and rec["attempts"] >= MANIFEST_MAX_ATTEMPTS:
+        log(f"❌ manifest: {os.path.basename(key)} — {rec['attempts']} неудач, снимаю с отправки: {error}")
+        _exec("UPDATE recordings SET state = 'failed' WHERE key = ?", (key,))
+        return 0
+    return rec["attempts"]
+
+
+def set_preview_sent(key: str, message_id: int | None):
+    _exec("UPDATE recordings SET preview_message_id = ? WHERE key = ?", (message_id or 0, key))
+
+
+def evicted(key: str):
+    """Файлы записи удалены менеджером места — отправлять больше нечего."""
+    _exec(
+        "UPDATE recordings SET state = 'evicted', updated = ? WHERE key = ? AND state NOT IN (?, ?)",
+        (time.time(), key, *GONE_STATES),
+    )
+
+
+# ---------- части ----------
+
+def set_parts(key: str, paths: list[str]):
+    """Запомнить набор частей записи. Уже отправленные части сохраняют своё состояние."""
+    with _lock:
+        db = _db()
+        db.execute("BEGIN")
+        try:
+            for idx, p in enumerate(paths):
+                # .sent — отметка старого формата (до журнала): такая часть уже отправлена
+                state = "uploaded" if os.path.exists(p + ".sent") else "pending"
+                size = os.path.getsize(p) if os.path.exists(p) else None
+                db.execute(
+                    "INSERT INTO parts (key, path, idx, size, state) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (key, path) DO UPDATE SET idx = excluded.idx, size = excluded.size",
+                    (key, p, idx, size, state),
+                )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+
+def parts(key: str) -> list[sqlite3.Row]:
+    return _query("SELECT * FROM parts WHERE key = ? ORDER BY idx", (key,))
+
+
+def part_uploaded(key: str, path: str) -> bool:
+    rows = _query("SELECT state FROM parts WHERE key = ? AND path = ?", (key, path))
+    return bool(rows) and rows[0]["state"] == "uploaded"
+
+
+def part_uploading(key: str, path: str):
+    """Часть уходит в Telegram. Если она уже была в uploading (падение до part_done), то,
+    возможно, уже доставлена: повторная отправка может дать дубликат (at-least-once)."""
+    rows = _query("SELECT state FROM parts WHERE key = ? AND path = ?", (key, path))
+    if rows and rows[0]["state"] == "uploading":
+        log(f"⚠️ manifest: часть {os.path.basename(path)} была в отправке при падении — отправляю повторно")
+    _exec("UPDATE parts SET state = 'uploading' WHERE key = ? AND path = ?", (key, path))
+
+
+def part_done(key: str, path: str, message_id: int | None):
+    _exec(
+        "UPDATE parts SET state = 'uploaded', message_id = ?, uploaded_at = ? WHERE key = ? AND path = ?",
+        (message_id, time.time(), key, path),
+    )
+
+
+def part_staged(key: str, path: str, kind: str, file_id: str):
+    """Часть загружена в служебный чат (для альбома): запомнить ссылку на неё."""
+    _exec("UPDATE parts SET file_id = ? WHERE key = ? AND path = ?", (f"{kind}:{file_id}", key, path))
+
+
+def staged_ref(key: str, path: str) -> tuple[str, str] | None:
+    """(тип, file_id) ранее загруженной части или None."""
+    rows = _query("SELECT file_id FROM parts WHERE key = ? AND path = ?", (key, path))
+    if not rows or not rows[0]["file_id"]:
+        return None
+    kind, _, file_id = rows[0]["file_id"].partition(":")
+    return kind, file_id
+
+
+def parts_done(key: str, done: list[tuple[str, int | None]]):
+    """Отметить несколько частей отправленными одной транзакцией (альбом)."""
+    now = time.time()
+    with _lock:
+        db = _db()
+        db.execute("BEGIN")
+        try:
+            for path, message_id in done:
+                db.execute(
+                    "UPDATE parts SET state = 'uploaded', message_id = ?, uploaded_at = ? WHERE key = ? AND path = ?",
+                    (message_id, now, key, path),
+                )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+
+def purge(older_than_sec: float = 7 * 86400):
+    """Удалить из журнала давно завершённые записи."""
+    cutoff = time.time() - older_than_sec
+    with _lock:
+        db = _db()
+        db.execute(
+            f"DELETE FROM parts WHERE key IN (SELECT key FROM recordings "
+            f"WHERE state IN ({','.join('?' * len(GONE_STATES))}) AND updated < ?)",
+            (*GONE_STATES, cutoff),
+        )
+        db.execute(
+            f"DELETE FROM recordings WHERE state IN ({','.join('?' * len(GONE_STATES))}) AND updated < ?",
+            (*GONE_STATES, cutoff),
+        )
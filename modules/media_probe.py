@@ -0,0 +1,143 @@
+"""Кэш ffprobe для sender'а: один проход на файл, повторно — только если файл изменился.
+
+Раньше один и тот же файл пробовался несколько раз (длительность для нарезки, индекс пакетов
+для плана, снова длительность при повторной попытке), а пока Telegram недоступен — заново
+на каждом проходе send_loop. Здесь один вызов ffprobe собирает всё сразу: кодек, длительность,
+разрешение, битрейт и сводку индекса пакетов по GOP (из неё же — число ключевых кадров).
+Ключ кэша — (устройство, inode, размер, mtime_ns): неизменённый файл не пробуется повторно,
+в том числе если ffprobe на нём упал.
+
+ffprobe запускается асинхронно; разбор индекса (сотни тысяч пакетов на часовом сегменте)
+периодически отдаёт управление event loop'у, чтобы не задерживать фото алёрта и отправку.
+"""
+import os
+import json
+import asyncio
+import subprocess
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from modules.logger import log
+
+_CACHE_SIZE = 128
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    codec: str | None
+    duration: float | None
+    width: int | None
+    height: int | None
+    bit_rate: int | None
+    keyframes: int
+    # время первого пакета и конец последнего, секунды
+    start_time: float
+    end_time: float
+    # Сводка индекса пакетов: (время ключевого кадра, байт видео, байт прочих потоков, пакетов).
+    # Первая группа начинается с первого пакета файла, даже если он не ключевой.
+    gops: tuple[tuple[float, int, int, int], ...]
+
+
+_cache: "OrderedDict[tuple, MediaInfo | None]" = OrderedDict()
+# сколько пакетов разбирать, не отдавая управление event loop'у
+_YIELD_EVERY = 5000
+
+
+def _key(path: str) -> tuple:
+    st = os.stat(path)
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _num(v, cast):
+    try:
+        return cast(v)
+    except (TypeError, ValueError):
+        return None
+
+
+async def _run_ffprobe(path: str) -> MediaInfo:
+    proc = await asyncio.create_subprocess_exec(
+        *[
+            "ffprobe", "-v", "error",
+            "-show_entries",
+            "format=duration,bit_rate"
+            ":stream=codec_type,codec_name,width,height"
+            ":packet=codec_type,pts_time,dts_time,size,flags",
+            "-of", "json",
+            path,
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    out, _ = await proc.communicate()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, "ffprobe")
+    data = json.loads(out or b"{}")
+    fmt = data.get("format") or {}
+    video = next((s for s in data.get("streams") or [] if s.get("codec_type") == "video"), {})
+
+    packets = []
+    for i, p in enumerate(data.get("packets") or []):
+        if i % _YIELD_EVERY == _YIELD_EVERY - 1:
+            await asyncio.sleep(0)
+        ts = _num(p.get("pts_time"), float)
+        if ts is None:
+            ts = _num(p.get("dts_time"), float)
+        size = _num(p.get("size"), int)
+        if ts is None or size is None:
+            # у пакета нет времени (бывает у первых B-кадров) — для плана он бесполезен
+            continue
+        is_video = p.get("codec_type") == "video"
+        packets.append((ts, size, is_video, is_video and "K" in (p.get("flags") or "")))
+    packets.sort(key=lambda p: p[0])
+
+    gops: list[list] = []
+    keyframes = 0
+    for ts, size, is_video, key in packets:
+        if key:
+            keyframes += 1
+        if not gops or (key and ts > gops[-1][0]):
+            gops.append([ts, 0, 0, 0])
+        gops[-1][1 if is_video else 2] += size
+        gops[-1][3] += 1
+
+    return MediaInfo(
+        codec=video.get("codec_name"),
+        duration=_num(fmt.get("duration"), float),
+        width=_num(video.get("width"), int),
+        height=_num(video.get("height"), int),
+        bit_rate=_num(fmt.get("bit_rate"), int),
+        keyframes=keyframes,
+        start_time=packets[0][0] if packets else 0.0,
+        end_time=packets[-1][0] if packets else 0.0,
+        gops=tuple(tuple(g) for g in gops),
+    )
+
+
+async def probe(path: str) -> MediaInfo | None:
+    """Сведения о файле (из кэша, если файл не менялся). None — файла нет или ffprobe не справился."""
+    try:
+        key = _key(path)
+    except FileNotFoundError:
+        return None
+
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    try:
+        info = await _run_ffprobe(path)
+    except Exception as e:
+        log(f"⚠️ ffprobe failed for {path}: {type(e).__name__}: {e!r}")
+        info = None
+
+    _cache[key] = info
+    _cache.move_to_end(key)
+    while len(_cache) > _CACHE_SIZE:
+        _cache.popitem(last=False)
+    return info
+
+
+async def duration(path: str) -> float | None:
+    info = await probe(path)
+    return info.duration if info else None
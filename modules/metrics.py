@@ -0,0 +1,205 @@
+"""Метрики конвейера в формате Prometheus (text exposition 0.0.4), без внешних зависимостей.
+
+Счётчики и гистограммы обновляются там, где происходит событие (запись сегмента, ONVIF,
+подготовка, upload); значения «на сейчас» (очередь отправки, место по классам файлов)
+заполняются колбэками on_scrape() в момент запроса. start_server() поднимает в event loop'е
+HTTP-сервер на METRICS_PORT (0 — выключено) и отдаёт GET /metrics.
+"""
+import abc
+import math
+import asyncio
+import threading
+
+from modules.env_config import METRICS_PORT, METRICS_BIND
+from modules.logger import log
+
+# Секунды: от долей секунды (pull ONVIF, фото) до десятков минут (транскодирование, upload)
+TIME_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# Байт/с: от мобильного канала до локальной сети
+RATE_BUCKETS = (64e3, 256e3, 1e6, 2.5e6, 5e6, 10e6, 25e6, 50e6, 100e6)
+
+_REGISTRY: list["_Metric"] = []
+_SCRAPE_HOOKS: list = []
+
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    items = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        items.append(extra)
+    return "{" + ",".join(items) + "}" if items else ""
+
+
+def _num(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.label_names)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    @abc.abstractmethod
+    def _samples(self) -> list[str]:
+        """Строки с отсчётами метрики (без HELP/TYPE)."""
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, n: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + n
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, k)} {_num(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, v: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = float(v)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, k)} {_num(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = (), buckets=TIME_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, v: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            st = self._values.get(key)
+            if st is None:
+                st = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if v <= b:
+                    st[0][i] += 1
+            st[1] += v
+            st[2] += 1
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = [(k, (list(c), s, n)) for k, (c, s, n) in self._values.items()]
+        out = []
+        for key, (counts, total, count) in items:
+            for b, c in zip(self.buckets, counts):
+                le = _labels(self.label_names, key, 'le="%s"' % _num(b))
+                out.append(f"{self.name}_bucket{le} {c}")
+            le = _labels(self.label_names, key, 'le="+Inf"')
+            out.append(f"{self.name}_bucket{le} {count}")
+            out.append(f"{self.name}_sum{_labels(self.label_names, key)} {_num(total)}")
+            out.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return out
+
+
+def on_scrape(fn):
+    """Колбэк, обновляющий gauge'и перед каждым запросом /metrics."""
+    _SCRAPE_HOOKS.append(fn)
+    return fn
+
+
+def render() -> str:
+    for fn in _SCRAPE_HOOKS:
+        try:
+            fn()
+        except Exception as e:
+            log(f"⚠️ metrics: колбэк {getattr(fn, '__name__', fn)}: {type(e).__name__}: {e!r}")
+    lines = []
+    for m in _REGISTRY:
+        lines += m.render()
+    return "\n".join(lines) + "\n"
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Минимальный HTTP/1.0: одна строка запроса, заголовки пропускаются, ответ и закрытие соединения."""
+    try:
+        request = await asyncio.wait_for(reader.readline(), 10)
+        while (await asyncio.wait_for(reader.readline(), 10)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, ctype, body = "200 OK", "text/plain; version=0.0.4; charset=utf-8", render().encode("utf-8")
+        else:
+            status, ctype, body = "404 Not Found", "text/plain; charset=utf-8", b"not found\n"
+        writer.write(
+            f"HTTP/1.0 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1")
+            + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server():
+    if not METRICS_PORT:
+        return
+    try:
+        await asyncio.start_server(_handle, METRICS_BIND, METRICS_PORT)
+    except OSError as e:
+        log(f"⚠️ metrics: не удалось открыть {METRICS_BIND}:{METRICS_PORT}: {e}")
+        return
+    log(f"📈 metrics: http://{METRICS_BIND}:{METRICS_PORT}/metrics")
+
+
+# --- Метрики конвейера (имена — camtg_*) ---
+
+SEGMENT_DURATION = Histogram("camtg_segment_duration_seconds", "Длительность записанного сегмента/клипа", ("camera",))
+SEGMENT_GAP = Histogram(
+    "camtg_segment_gap_seconds", "Разрыв между концом сегмента и началом следующего", ("camera",),
+    buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 300),
+)
+ONVIF_PULL = Histogram("camtg_onvif_pull_seconds", "Длительность PullMessages", ("camera",))
+ONVIF_EVENTS = Counter("camtg_onvif_events_total", "ONVIF-события по типу", ("camera", "kind"))
+ALERT_PHOTO_LATENCY = Histogram("camtg_alert_photo_latency_seconds", "От события ONVIF до отправленного фото", ("camera",))
+ALERT_CLIP_LATENCY = Histogram(
+    "camtg_alert_clip_latency_seconds", "От события ONVIF до отправки последней части клипа", ("camera",)
+)
+PREPARE_SECONDS = Histogram("camtg_prepare_seconds", "Время ffmpeg-стадии подготовки (wall)", ("stage",))
+PREPARE_CPU = Counter("camtg_prepare_cpu_seconds_total", "CPU ffmpeg-стадий подготовки (user+sys)", ("stage",))
+PREPARE_FAILURES = Counter("camtg_prepare_failures_total", "Неудачные запуски ffmpeg подготовки", ("stage",))
+UPLOAD_BYTES = Counter("camtg_upload_bytes_total", "Байт отправлено в Telegram потоковой загрузкой", ("method",))
+UPLOAD_SECONDS = Histogram("camtg_upload_seconds", "Длительность потоковой загрузки", ("method",))
+UPLOAD_THROUGHPUT = Histogram(
+    "camtg_upload_throughput_bytes_per_second", "Скорость потоковой загрузки", ("method",), buckets=RATE_BUCKETS
+)
+UPLOAD_RETRIES = Counter("camtg_upload_retries_total", "Повторы запросов к Bot API", ("reason",))
+SEND_QUEUE = Gauge("camtg_send_queue_depth", "Записей в очередях конвейера отправки", ("camera", "stage"))
+SEND_BACKLOG = Gauge("camtg_send_backlog_recordings", "Записей в журнале, ещё не отправленных", ("camera",))
+STORAGE_BYTES = Gauge("camtg_storage_bytes", "Байт в VIDEO_DIR/ARCHIVE_DIR по классам файлов", ("class",))
+STORAGE_LIMIT = Gauge("camtg_storage_limit_bytes", "Квота места под записи")
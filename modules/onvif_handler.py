@@ -1,29 +1,15 @@
 import time
-import httpx
+import asyncio
 from zeep import exceptions as zeep_exceptions
 from zeep.helpers import serialize_object
 from onvif import ONVIFCamera
 from lxml import etree
 
-from modules.env_config import (
-    ONVIF_ENABLED,
-    ONVIF_HOST,
-    ONVIF_PORT,
-    ONVIF_USER,
-    ONVIF_PASS,
-    SNAPSHOT_URL,
-    ONVIF_LOG_LEVEL,
-    IS_MOTION_ENABLED,
-    IS_TAMPER_ENABLED,
-    ALERT_TIMEOUT,
-    TG_TOKEN,
-    TG_CHAT_ID,
-    TG_SILENT_MODE,
-)
+from modules.cameras import Camera
 from modules.logger import log
-from modules.record_trigger import alert_event
-
-API_URL = f"https://api.telegram.org/bot{TG_TOKEN}"
+from modules.telegram_utils import send_snapshot
+from modules import http_pool, metrics, runtime, tracing, upload_scheduler
+from modules.env_config import TG_API_BASE_URL
 
 
 def _get_message_element(notification_message):
@@ -61,7 +47,7 @@ def _is_truthy(val: str) -> bool:
     return (val or "").strip().lower() == "true"
 
 
-def _classify_event(el):
+def _classify_event(cam: Camera, el):
     """
     Универсальная классификация события:
     - motion_alert: любые Motion / LogicalState цифрового входа
@@ -83,13 +69,13 @@ def _classify_event(el):
     # 1) Motion / Tamper по имени
     for name, value in items:
         lname = name.lower()
-        if IS_MOTION_ENABLED and "motion" in lname and _is_truthy(value):
+        if cam.is_motion_enabled and "motion" in lname and _is_truthy(value):
             motion_alert = True
-        if IS_TAMPER_ENABLED and "tamper" in lname and _is_truthy(value):
+        if cam.is_tamper_enabled and "tamper" in lname and _is_truthy(value):
             tamper_alert = True
 
     # 2) Цифровой вход: InputToken / DIGIT_INPUT + LogicalState=true
-    if IS_MOTION_ENABLED and not motion_alert:
+    if cam.is_motion_enabled and not motion_alert:
         has_input = any(
             n.lower() in ("inputtoken", "input_token") or "digit_input" in v.lower()
             for n, v in items
@@ -104,39 +90,54 @@ def _classify_event(el):
     return motion_alert, tamper_alert
 
 
-def create_onvif_connection():
-    cam = ONVIFCamera(ONVIF_HOST, ONVIF_PORT, ONVIF_USER, ONVIF_PASS)
-    events_service = cam.create_events_service()
+def create_onvif_connection(cam: Camera):
+    onvif_cam = ONVIFCamera(cam.onvif_host, cam.onvif_port, cam.onvif_user, cam.onvif_pass)
+    events_service = onvif_cam.create_events_service()
     # простая подписка без фильтра — чтобы ловить всё (включая Motion)
     events_service.CreatePullPointSubscription()
-    pullpoint = cam.create_pullpoint_service()
-    log("📡 ONVIF подписка активна")
+    pullpoint = onvif_cam.create_pullpoint_service()
+    log(f"📡 [{cam.name}] ONVIF подписка активна")
     return pullpoint
 
 
-def onvif_event_listener():
-    if not ONVIF_ENABLED:
-        log("ONVIF выключен (ONVIF_ENABLED=0), слушатель не запускается")
+async def onvif_event_listener(cam: Camera, multi: bool = False):
+    """Слушатель ONVIF-событий одной камеры. multi=True — подписывать алёрты именем камеры.
+
+    Корутина; синхронные вызовы onvif-zeep (подписка и PullMessages) идут в одном потоке камеры
+    (runtime.Worker) на всё время работы слушателя, снимок и отправка фото — в event loop'е.
+    """
+    if not cam.onvif_enabled:
+        log(f"[{cam.name}] ONVIF выключен (ONVIF_ENABLED=0), слушатель не запускается")
         return
 
+    worker = runtime.Worker(f"onvif-{cam.name}")
+    try:
+        await _listen(cam, multi, worker)
+    finally:
+        worker.close()
+
+
+async def _listen(cam: Camera, multi: bool, worker: runtime.Worker):
     pullpoint = None
     last_alert = 0.0
 
     while True:
         if pullpoint is None:
             try:
-                pullpoint = create_onvif_connection()
+                pullpoint = await worker.call(create_onvif_connection, cam)
             except Exception as e:
-                log(f"Ошибка инициализации ONVIF: {e}. Повтор через 10 сек.")
-                time.sleep(10)
+                log(f"[{cam.name}] Ошибка инициализации ONVIF: {e}. Повтор через 10 сек.")
+                await asyncio.sleep(10)
                 continue
 
         try:
             # Timeout в миллисекундах
-            messages = pullpoint.PullMessages({"Timeout": 2000, "MessageLimit": 5})
+            t_pull = time.monotonic()
+            messages = await worker.call(pullpoint.PullMessages, {"Timeout": 2000, "MessageLimit": 5})
+            metrics.ONVIF_PULL.observe(time.monotonic() - t_pull, camera=cam.name)
 
             # Уровень логирования ONVIF (debug)
-            if ONVIF_LOG_LEVEL == 1:
+            if cam.onvif_log_level == 1:
                 try:
                     msg_dict = serialize_object(messages)
                     log(f"ONVIF JSON: {msg_dict}")
@@ -158,26 +159,23 @@ def onvif_event_listener():
                 if el is None:
                     continue
 
-                motion_alert, tamper_alert = _classify_event(el)
+                motion_alert, tamper_alert = _classify_event(cam, el)
+                kind = "motion" if motion_alert else "tamper" if tamper_alert else "other"
+                metrics.ONVIF_EVENTS.inc(camera=cam.name, kind=kind)
 
                 if motion_alert or tamper_alert:
+                    # антифлуд по ALERT_TIMEOUT; трасса заводится до alert_event.set(),
+                    # чтобы её забрала запись, которую это событие запускает или продлевает
+                    photo_due = now - last_alert >= cam.alert_timeout
+                    trace_id = tracing.start(cam.name, kind, ts=now) if photo_due else None
+
                     # триггерим запись
-                    alert_event.set()
+                    cam.alert_event.set()
 
-                    # антифлуд по ALERT_TIMEOUT
-                    if now - last_alert >= ALERT_TIMEOUT:
+                    if photo_due:
+                        # соединение с Bot API открывается, пока камера отдаёт кадр
+                        http_pool.prewarm(tg_url=TG_API_BASE_URL)
                         try:
-                            with httpx.Client(
-                                timeout=httpx.Timeout(connect=10.0, read=10.0, write=10.0, pool=10.0),
-                                http2=False,
-                            ) as c:
-                                snap = c.get(SNAPSHOT_URL)
-                                snap.raise_for_status()
-
-                            files = {
-                                'photo': ('alert.jpg', snap.content, 'image/jpeg'),
-                            }
-
                             caption_parts = []
                             if motion_alert:
                                 caption_parts.append('Motion')
@@ -185,33 +183,28 @@ def onvif_event_listener():
                                 caption_parts.append('Tamper')
 
                             caption = f"🚨 ONVIF Alert: {', '.join(caption_parts)}"
+                            if multi:
+                                caption += f" [{cam.name}]"
 
-                            data = {
-                                'chat_id': TG_CHAT_ID,
-                                'caption': caption,
-                                'disable_notification': 'true' if (TG_SILENT_MODE == 0) else 'false',
-                            }
-
-                            with httpx.Client(
-                                timeout=httpx.Timeout(connect=10.0, read=30.0, write=30.0, pool=10.0),
-                                http2=False,
-                            ) as c:
-                                tg = c.post(f"{API_URL}/sendPhoto", data=data, files=files)
-                                tg.raise_for_status()
+                            # фото загружается один раз, остальным чатам — по file_id
+                            with tracing.bind(trace_id), upload_scheduler.priority(upload_scheduler.ALERT_PHOTO):
+                                await send_snapshot(cam.snapshot_url, caption=caption)
+                                tracing.mark("photo_sent")
+                            metrics.ALERT_PHOTO_LATENCY.observe(time.time() - now, camera=cam.name)
 
-                            log(f"Sent ONVIF alert photo: {caption}")
+                            log(f"[{cam.name}] Sent ONVIF alert photo: {caption}")
                         except Exception as e:
-                            log(f"Ошибка отправки alert-photo: {e}")
+                            log(f"[{cam.name}] Ошибка отправки alert-photo: {e}")
                         last_alert = now
 
         except zeep_exceptions.Fault as fault:
-            log(f"ONVIF Fault: {fault}")
+            log(f"[{cam.name}] ONVIF Fault: {fault}")
         except Exception as e:
             log(
-                f"Ошибка при получении событий ONVIF: {e}. Пересоздание соединения через 10 сек."
+                f"[{cam.name}] Ошибка при получении событий ONVIF: {e}. Пересоздание соединения через 10 сек."
             )
             pullpoint = None
-            time.sleep(10)
+            await asyncio.sleep(10)
             continue
 
-        time.sleep(0.1)
+        await asyncio.sleep(0.1)
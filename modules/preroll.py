@@ -0,0 +1,217 @@
+"""Кольцевой буфер pre-roll для записи по алёрту.
+
+Постоянно работающий Segmenter режет RTSP-поток на короткие чанки (stream copy).
+Последние PREROLL_SECONDS чанков держим в кольце; при алёрте клип собирается из
+них и из следующих («живой хвост») чанков того же ffmpeg и склеивается concat-демуксером
+без перекодирования. Так в клип попадают секунды ДО события, а RTSP-подключение одно.
+"""
+import os
+import time
+import shutil
+import asyncio
+import subprocess
+from collections import deque
+from datetime import datetime
+
+from modules.env_config import FFMPEG_LOGLEVEL
+from modules.logger import log
+from modules.segmenter import Segmenter
+from modules.storage import ALERT_CLIP_SUFFIX
+
+
+class _Chunk:
+    __slots__ = ("path", "end_ts", "duration", "refs", "in_ring")
+
+    def __init__(self, path: str, end_ts: float, duration: float):
+        self.path = path
+        self.end_ts = end_ts
+        self.duration = duration
+        self.refs = 0
+        self.in_ring = True
+
+    @property
+    def start_ts(self) -> float:
+        return self.end_ts - self.duration
+
+
+class _Clip:
+    def __init__(self, started: float, deadline: float):
+        self.started = started
+        self.deadline = deadline
+        self.chunks: list[_Chunk] = []
+
+
+class PrerollBuffer:
+    def __init__(self, name: str, url: str, buffer_dir: str, preroll_seconds: float, chunk_seconds: float):
+        self.name = name
+        self.preroll_seconds = max(0.0, float(preroll_seconds))
+        self.chunk_seconds = max(1.0, float(chunk_seconds))
+        self.live_dir = os.path.join(buffer_dir, "live")
+        self.ring_dir = os.path.join(buffer_dir, "ring")
+        self.buffer_dir = buffer_dir
+
+        # чанки прошлого запуска уже бесполезны как pre-roll
+        shutil.rmtree(self.ring_dir, ignore_errors=True)
+        shutil.rmtree(self.live_dir, ignore_errors=True)
+        os.makedirs(self.ring_dir, exist_ok=True)
+
+        # «поколение» чанков: новый чанк будит всех, кто ждёт в record_clip
+        self._tick = asyncio.Event()
+        self._ring: deque[_Chunk] = deque()
+        self._clips: list[_Clip] = []
+        self._seq = 0
+
+        self.segmenter = Segmenter(
+            f"{name}/preroll",
+            url,
+            self.live_dir,
+            self.chunk_seconds,
+            self._on_chunk,
+            clock_aligned=False,
+            filename_pattern="chunk_%06d.mkv",
+            strftime=False,
+        )
+
+    async def run(self):
+        """Держать сегментатор кольца (запускается задачей рядом с циклом записи клипов)."""
+        await self.segmenter.run()
+
+    # ---------- кольцо ----------
+
+    def _release(self, chunk: _Chunk):
+        if chunk.refs == 0 and not chunk.in_ring:
+            try:
+                os.remove(chunk.path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                log(f"⚠️ [{self.name}] Не удалось удалить чанк {chunk.path}: {e}")
+
+    def _prune(self, now: float):
+        horizon = now - self.preroll_seconds - self.chunk_seconds
+        while self._ring and self._ring[0].end_ts < horizon:
+            chunk = self._ring.popleft()
+            chunk.in_ring = False
+            self._release(chunk)
+
+    def _on_chunk(self, path: str, start, end):
+        now = time.time()
+        duration = (end - start) if (start is not None and end is not None and end > start) else self.chunk_seconds
+        self._seq += 1
+        ring_path = os.path.join(self.ring_dir, f"{self._seq:08d}.mkv")
+        # live -> ring: имена ffmpeg (chunk_%06d) повторяются после его рестарта
+        os.rename(path, ring_path)
+
+        chunk = _Chunk(ring_path, now, duration)
+        self._ring.append(chunk)
+        for clip in self._clips:
+            clip.chunks.append(chunk)
+            chunk.refs += 1
+        self._prune(now)
+        self._tick.set()
+        self._tick = asyncio.Event()
+
+    # ---------- клипы ----------
+
+    async def record_clip(self, duration: float, out_dir: str, *, retrigger=None, max_duration: float = 0) -> str | None:
+        """Записать клип: pre-roll из кольца + живой хвост до now+duration. Возвращается, когда клип готов.
+
+        retrigger    — asyncio.Event: каждый новый алёрт во время записи отодвигает конец
+                       клипа на duration от текущего момента (retriggerable timer).
+        max_duration — потолок длины клипа от момента первого алёрта (0 = без продления).
+        """
+        now = time.time()
+        clip = _Clip(started=now, deadline=now + float(duration))
+        cap = clip.started + max(float(duration), float(max_duration or 0))
+        # если поток замолчал — не ждём вечно, склеиваем то, что есть
+        stall_grace = self.chunk_seconds * 3 + 15
+
+        for chunk in self._ring:
+            if chunk.end_ts > now - self.preroll_seconds:
+                clip.chunks.append(chunk)
+                chunk.refs += 1
+        self._clips.append(clip)
+
+        try:
+            while True:
+                if retrigger is not None and retrigger.is_set():
+                    retrigger.clear()
+                    new_deadline = min(cap, time.time() + float(duration))
+                    if new_deadline > clip.deadline:
+                        clip.deadline = new_deadline
+                        log(
+                            f"⏩ [{self.name}] Новый алёрт: запись продлена до "
+                            f"+{clip.deadline - clip.started:.0f}s"
+                        )
+                last_end = clip.chunks[-1].end_ts if clip.chunks else 0.0
+                if last_end >= clip.deadline:
+                    break
+                if time.time() > max(clip.deadline, last_end) + stall_grace:
+                    log(f"⚠️ [{self.name}] Нет новых чанков, клип завершается досрочно")
+                    break
+                try:
+                    await asyncio.wait_for(self._tick.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
+            self._clips.remove(clip)
+            return await self._concat(list(clip.chunks), out_dir)
+        finally:
+            # в том числе при отмене задачи записи: чанки, на которые ссылался клип, освобождаются
+            if clip in self._clips:
+                self._clips.remove(clip)
+            for chunk in clip.chunks:
+                chunk.refs -= 1
+                self._release(chunk)
+
+    async def _concat(self, chunks: list[_Chunk], out_dir: str) -> str | None:
+        if not chunks:
+            log(f"⚠️ [{self.name}] Клип пуст: нет ни одного чанка (RTSP недоступен?)")
+            return None
+
+        timestamp = datetime.fromtimestamp(chunks[0].start_ts).strftime('%Y.%m.%d_%H.%M.%S')
+        part_path = os.path.join(out_dir, f"{timestamp}{ALERT_CLIP_SUFFIX}.mkv.part")
+        final_path = part_path[:-5]
+        list_path = os.path.join(self.buffer_dir, f"concat_{timestamp}.txt")
+
+        with open(list_path, "w") as f:
+            for chunk in chunks:
+                # кавычка в пути (например, в VIDEO_DIR) закрыла бы строку списка concat
+                escaped = chunk.path.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+
+        cmd = [
+            "ffmpeg", "-nostdin", "-y", "-loglevel", FFMPEG_LOGLEVEL,
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-map", "0", "-c", "copy",
+            "-f", "matroska",
+            part_path,
+        ]
+        try:
+            proc = await asyncio.create_subprocess_exec(*cmd, stdin=subprocess.DEVNULL)
+            try:
+                rc = await asyncio.wait_for(proc.wait(), timeout=300)
+            except BaseException:
+                proc.kill()
+                await asyncio.shield(proc.wait())
+                raise
+            if rc != 0:
+                raise subprocess.CalledProcessError(rc, cmd)
+            os.rename(part_path, final_path)
+            log(
+                f"Triggered recording saved: {final_path} "
+                f"({len(chunks)} чанков, ~{chunks[-1].end_ts - chunks[0].start_ts:.0f}s)"
+            )
+            return final_path
+        except Exception as e:
+            log(f"⚠️ [{self.name}] Ошибка склейки клипа: {type(e).__name__}: {e!r}")
+            try:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+            except Exception:
+                pass
+            return None
+        finally:
+            try:
+                os.remove(list_path)
+            except Exception:
+                pass
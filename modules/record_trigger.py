@@ -1,57 +1,106 @@
 import os
 import time
+import asyncio
 import subprocess
-from datetime import datetime, timezone
-from threading import Event
+from datetime import datetime
 
-from modules.env_config import (
-    VIDEO_DIR, RTSP_URL, FFMPEG_LOGLEVEL,
-    RECORD_ON_ALERT_ONLY, ALERT_RECORD_SECONDS, CONTINUOUS_SEGMENT_SECONDS
-)
+from modules.env_config import FFMPEG_LOGLEVEL, RECORD_STALL_SECONDS
+from modules import manifest, metrics, tracing
+from modules.cameras import Camera
 from modules.logger import log
+from modules.segmenter import Segmenter
+from modules.ffmpeg_progress import SupervisedFFmpeg
+from modules.preroll import PrerollBuffer
+from modules.storage import group_key
 
-# Глобальное событие алёрта (устанавливается onvif_handler)
-alert_event = Event()
 
-os.makedirs(VIDEO_DIR, exist_ok=True)
+def publish_segment(cam: Camera, out_dir: str, path: str, start=None, end=None):
+    """Атомарно перенести готовый сегмент из staging в out_dir (одна ФС -> rename атомарен).
 
-def clean_leftovers():
+    Недописанные файлы сегментатор держит в staging (cam.staging_dir); в журнал отправки
+    (modules/manifest.py) сегмент попадает только после публикации, то есть завершённым.
+    """
+    final_path = os.path.join(out_dir, os.path.basename(path))
+    os.rename(path, final_path)
+    log(f"[{cam.name}] Segment saved: {final_path}")
+    duration = end - start if start is not None and end is not None else None
+    _observe_segment(cam, out_dir, duration)
+    _register(cam, final_path, time.time() - duration if duration is not None else None)
+
+
+# (камера, каталог) -> время окончания предыдущего сегмента, для метрики разрывов записи
+_last_segment_end: dict[tuple[str, str], float] = {}
+
+
+def _observe_segment(cam: Camera, out_dir: str, duration: float | None, finished: float | None = None):
+    """Метрики записи: длительность сегмента и разрыв (по часам) после предыдущего сегмента того же потока."""
+    finished = time.time() if finished is None else finished
+    label = cam.name if os.path.normpath(out_dir) == os.path.normpath(cam.video_dir) else f"{cam.name}/archive"
+    key = (cam.name, os.path.normpath(out_dir))
+    prev = _last_segment_end.get(key)
+    _last_segment_end[key] = finished
+    if duration is None:
+        return
+    metrics.SEGMENT_DURATION.observe(duration, camera=label)
+    if prev is not None:
+        metrics.SEGMENT_GAP.observe(max(0.0, finished - duration - prev), camera=label)
+
+
+def _register(cam: Camera, path: str | None, started: float | None = None):
+    """Поставить опубликованную запись в журнал отправки (архив основного потока не отправляется).
+
+    started — время начала записи по часам: для спана record в трассах алёртов,
+    которые эта запись забирает (modules/tracing.py).
+    """
+    if not path or os.path.normpath(os.path.dirname(path)) != os.path.normpath(cam.video_dir):
+        return
+    tracing.claim(cam.name, group_key(path), started)
+    try:
+        manifest.add_recording(cam.name, path)
+    except Exception as e:
+        # не страшно: файл подберёт обход VIDEO_DIR в send_loop
+        log(f"⚠️ [{cam.name}] Не удалось записать {os.path.basename(path)} в журнал: {e}")
+
+def clean_leftovers(cam: Camera):
     """Переименовать хвосты .mkv.part в .mkv после падения/рестарта."""
-    for fname in os.listdir(VIDEO_DIR):
+    for fname in os.listdir(cam.video_dir):
         if fname.endswith('.mkv.part'):
-            part_path = os.path.join(VIDEO_DIR, fname)
+            part_path = os.path.join(cam.video_dir, fname)
             final_path = part_path[:-5]
             try:
                 os.rename(part_path, final_path)
                 log(f"Renamed leftover part {fname} -> {os.path.basename(final_path)}")
+                _register(cam, final_path)
             except Exception as e:
                 log(f"Error renaming {fname}: {e}")
 
-_last_rtsp_warn = 0
+_last_rtsp_warn: dict[str, float] = {}
 
-def _rtsp_ready() -> bool:
+def _rtsp_ready(cam: Camera) -> bool:
     # пустой RTSP_URL -> предупреждаем раз в 60 сек
-    global _last_rtsp_warn
-    if not RTSP_URL:
+    if not cam.rtsp_url:
         now = time.time()
-        if now - _last_rtsp_warn > 60:
-            log("⚠️ RTSP_URL пуст. Запись не запускается. Укажите RTSP_URL в .env")
-            _last_rtsp_warn = now
+        if now - _last_rtsp_warn.get(cam.name, 0) > 60:
+            log(f"⚠️ [{cam.name}] RTSP_URL пуст. Запись не запускается. Укажите RTSP_URL в .env")
+            _last_rtsp_warn[cam.name] = now
         return False
     return True
 
-def trigger_record(duration: int = ALERT_RECORD_SECONDS):
-    if not _rtsp_ready():
-        time.sleep(5)
+async def trigger_record(cam: Camera, duration: int | None = None, suffix: str = ""):
+    """Записать один файл длиной duration. suffix — метка в имени (например, ALERT_CLIP_SUFFIX)."""
+    if duration is None:
+        duration = cam.alert_record_seconds
+    if not _rtsp_ready(cam):
+        await asyncio.sleep(5)
         return
 
     timestamp = datetime.now().strftime('%Y.%m.%d_%H.%M.%S')
-    part_path = os.path.join(VIDEO_DIR, f"{timestamp}.mkv.part")
+    part_path = os.path.join(cam.video_dir, f"{timestamp}{suffix}.mkv.part")
     final_path = part_path[:-5]
 
     cmd = [
         'ffmpeg', '-y', '-loglevel', FFMPEG_LOGLEVEL,
-        '-rtsp_transport', 'tcp', '-i', RTSP_URL,
+        '-rtsp_transport', 'tcp', '-i', cam.upload_url,
         '-map', '0:v:0', '-map', '0:a:0?',
         '-c', 'copy',
         '-t', str(int(duration)),
@@ -59,21 +108,34 @@ def trigger_record(duration: int = ALERT_RECORD_SECONDS):
         part_path
     ]
 
+    t_start = time.time()
     try:
-        subprocess.run(cmd, check=True, timeout=int(duration) + 30)
-        try:
-            os.rename(part_path, final_path)
-            log(f"Triggered recording saved: {final_path}")
-        except Exception as e:
-            log(f"Error renaming {part_path}: {e}")
-    except subprocess.TimeoutExpired:
-        log("ffmpeg timeout: killing record process")
-        try:
-            if os.path.exists(part_path):
-                os.remove(part_path)
-        except Exception:
-            pass
-        time.sleep(3)
+        proc = await SupervisedFFmpeg.start(
+            f"{cam.name}/trigger",
+            cmd,
+            stall_seconds=RECORD_STALL_SECONDS,
+            max_seconds=int(duration) + 30,
+            stdin=subprocess.DEVNULL,
+        )
+        rc = await proc.wait()
+        if rc != 0 and not (proc.stalled or proc.timed_out):
+            raise subprocess.CalledProcessError(rc, cmd)
+        if proc.stalled or proc.timed_out:
+            log("ffmpeg record stopped early (stall/timeout), keeping what was recorded")
+        # после зависания/таймаута ffmpeg закрыт по SIGTERM — записанное сохраняем
+        if os.path.exists(part_path) and os.path.getsize(part_path) > 0:
+            try:
+                os.rename(part_path, final_path)
+                log(f"[{cam.name}] Triggered recording saved: {final_path}")
+                # длительность по часам: от запуска ffmpeg (включая подключение к RTSP) до его завершения
+                _observe_segment(cam, cam.video_dir, time.time() - t_start)
+                _register(cam, final_path, t_start)
+            except Exception as e:
+                log(f"Error renaming {part_path}: {e}")
+        elif os.path.exists(part_path):
+            os.remove(part_path)
+        if proc.stalled or proc.timed_out:
+            await asyncio.sleep(3)
     except Exception as e:
         log(f"ffmpeg error during record: {e}")
         try:
@@ -82,30 +144,104 @@ def trigger_record(duration: int = ALERT_RECORD_SECONDS):
         except Exception:
             pass
         # небольшой бэк-офф, чтобы не спамить
-        time.sleep(3)
+        await asyncio.sleep(3)
+
+
+async def _alert_clip_loop(cam: Camera, buf: PrerollBuffer, trigger: asyncio.Event, out_dir: str):
+    while True:
+        await trigger.wait()
+        trigger.clear()
+        started = time.time()
+        # алёрты во время записи не копятся в очередь, а продлевают текущий клип
+        path = await buf.record_clip(
+            cam.alert_record_seconds,
+            out_dir,
+            retrigger=trigger,
+            max_duration=cam.alert_max_record_seconds,
+        )
+        _register(cam, path, started)
 
 
-def record_loop():
-    """Главный цикл записи.
-    - RECORD_ON_ALERT_ONLY = true: ждать алёрт -> писать ALERT_RECORD_SECONDS одной порцией.
+async def record_loop(cam: Camera):
+    """Главный цикл записи одной камеры.
+    - RECORD_ON_ALERT_ONLY = true: ждать алёрт -> писать ALERT_RECORD_SECONDS одной порцией
+      (плюс PREROLL_SECONDS до алёрта из кольцевого буфера, см. modules/preroll.py).
     - RECORD_ON_ALERT_ONLY = false: писать постоянно сегментами CONTINUOUS_SEGMENT_SECONDS,
       выравниваясь к ближайшей сетке, чтобы файлы начинались на "ровных" отметках.
+      При CONTINUOUS_SEGMENTER=true это делает один долгоживущий ffmpeg (см. modules/segmenter.py).
+    - RTSP_SUB_URL задан: оба потока пишутся параллельно (stream copy, одинаковые имена файлов);
+      sub-поток идёт в VIDEO_DIR (в Telegram), основной — в ARCHIVE_DIR.
+    Буферы, сегментаторы и клипы потоков — задачи в TaskGroup цикла: отмена или падение
+    цикла останавливает их вместе с процессами ffmpeg.
     """
-    clean_leftovers()
+    clean_leftovers(cam)
 
-    if RECORD_ON_ALERT_ONLY:
-        while True:
-            alert_event.wait()
-            alert_event.clear()
-            trigger_record(ALERT_RECORD_SECONDS)
+    # (url, staging, куда публиковать, метка) для каждого записываемого потока
+    streams = [("main", cam.rtsp_url, cam.staging_dir, cam.video_dir)]
+    if cam.dual_stream:
+        streams = [
+            ("sub", cam.rtsp_sub_url, cam.staging_dir, cam.video_dir),
+            ("main", cam.rtsp_url, cam.archive_staging_dir, cam.archive_dir),
+        ]
+
+    if cam.record_on_alert_only:
+        # Кольцевой буфер пишет поток постоянно; клип = pre-roll + живой хвост
+        while not _rtsp_ready(cam):
+            await asyncio.sleep(5)
+        async with asyncio.TaskGroup() as tg:
+            if not cam.dual_stream:
+                buf = PrerollBuffer(cam.name, cam.rtsp_url, cam.preroll_dir, cam.preroll_seconds, cam.preroll_chunk_seconds)
+                tg.create_task(buf.run(), name=f"preroll-{cam.name}")
+                await _alert_clip_loop(cam, buf, cam.alert_event, cam.video_dir)
+                return
+
+            # у каждого потока свой буфер и свой триггер: продление клипов не должно
+            # «съедаться» соседним потоком, поэтому алёрт камеры раздаём обоим
+            triggers = []
+            for label, url, _staging, out_dir in streams:
+                buf = PrerollBuffer(
+                    f"{cam.name}/{label}",
+                    url,
+                    os.path.join(cam.preroll_dir, label),
+                    cam.preroll_seconds,
+                    cam.preroll_chunk_seconds,
+                )
+                tg.create_task(buf.run(), name=f"preroll-{cam.name}-{label}")
+                trigger = asyncio.Event()
+                triggers.append(trigger)
+                tg.create_task(_alert_clip_loop(cam, buf, trigger, out_dir), name=f"clip-{cam.name}-{label}")
+            while True:
+                await cam.alert_event.wait()
+                cam.alert_event.clear()
+                for trigger in triggers:
+                    trigger.set()
+    elif cam.continuous_segmenter:
+        # Один ffmpeg на поток: одно RTSP-подключение, сегменты без разрывов,
+        # границы по той же сетке CONTINUOUS_SEGMENT_SECONDS (segment_atclocktime).
+        while not _rtsp_ready(cam):
+            await asyncio.sleep(5)
+        segmenters = [
+            Segmenter(
+                f"{cam.name}/{label}" if cam.dual_stream else f"{cam.name}/continuous",
+                url,
+                staging,
+                cam.continuous_segment_seconds,
+                lambda path, start, end, out_dir=out_dir: publish_segment(cam, out_dir, path, start, end),
+            )
+            for label, url, staging, out_dir in streams
+        ]
+        async with asyncio.TaskGroup() as tg:
+            for seg in segmenters:
+                tg.create_task(seg.run(), name=f"segmenter-{seg.name}")
     else:
         # Непрерывная запись: сегменты выравниваем по сетке CONTINUOUS_SEGMENT_SECONDS
-        seg = max(1, int(CONTINUOUS_SEGMENT_SECONDS))
+        # (старый режим: пишется только поток для Telegram)
+        seg = max(1, int(cam.continuous_segment_seconds))
         while True:
-            if not _rtsp_ready():
-                time.sleep(5)
+            if not _rtsp_ready(cam):
+                await asyncio.sleep(5)
                 continue
             now_ts = time.time()
             next_stop = ((int(now_ts) // seg) + 1) * seg
             duration = max(1, int(next_stop - now_ts))
-            trigger_record(duration)
\ No newline at end of file
+            await trigger_record(cam, duration)
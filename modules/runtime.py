@@ -0,0 +1,122 @@
+"""asyncio-ядро процесса: все циклы камер — корутины одного event loop'а.
+
+Запись и подготовка — дочерние процессы ffmpeg под asyncio (create_subprocess_exec или
+wait_process ниже), отправка в Telegram и снимки — httpx.AsyncClient (modules/http_pool.py),
+inotify — add_reader на дескрипторе. В отдельных потоках выполняются только вызовы onvif-zeep
+(у него нет асинхронного API; Worker — один поток на камеру) и обход диска менеджером места
+(storage_loop, asyncio.to_thread).
+
+supervise() перезапускает упавший цикл: циклы держат свои дочерние задачи в TaskGroup,
+поэтому вместе с циклом отменяются и они — повторный запуск ничего не дублирует.
+"""
+import os
+import resource
+import queue
+import asyncio
+import threading
+import traceback
+
+from modules.logger import log
+
+
+class Worker:
+    """Один daemon-поток для последовательных блокирующих вызовов (onvif-zeep одной камеры).
+
+    Поток живёт столько же, сколько подписка камеры, а не создаётся на каждый PullMessages.
+    В отличие от пула asyncio.to_thread, который asyncio.run ждёт при завершении, поток, застрявший
+    в сетевом таймауте zeep, не задерживает выход процесса.
+    """
+
+    def __init__(self, name: str):
+        self._jobs: queue.SimpleQueue = queue.SimpleQueue()
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            loop, fut, fn, args = job
+            try:
+                result = fn(*args)
+            except BaseException as e:  # noqa: BLE001 — передаём в loop как есть
+                loop.call_soon_threadsafe(_resolve, fut, fut.set_exception, e)
+            else:
+                loop.call_soon_threadsafe(_resolve, fut, fut.set_result, result)
+
+    def call(self, fn, *args) -> asyncio.Future:
+        """Выполнить fn(*args) в потоке воркера; результат — в future текущего loop'а."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._jobs.put((loop, fut, fn, args))
+        return fut
+
+    def close(self):
+        """Поток завершится после текущего вызова."""
+        self._jobs.put(None)
+
+
+def _resolve(fut: asyncio.Future, setter, value):
+    # ожидающая корутина могла быть отменена, пока вызов шёл в потоке
+    if not fut.done():
+        setter(value)
+
+
+async def wait_process(pid: int) -> tuple[int, resource.struct_rusage]:
+    """Дождаться завершения дочернего процесса: (код возврата, rusage именно этого процесса).
+
+    asyncio.create_subprocess_exec забирает код возврата через waitpid и теряет rusage, поэтому
+    для процессов, чей CPU идёт в метрики, — pidfd в цикле событий и os.wait4 по готовности.
+    Без pidfd (старое ядро) — опрос wait4(WNOHANG).
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        pidfd = None
+
+    try:
+        while True:
+            wpid, status, usage = os.wait4(pid, os.WNOHANG)
+            if wpid:
+                return os.waitstatus_to_exitcode(status), usage
+            if pidfd is None:
+                await asyncio.sleep(0.1)
+                continue
+            ready = loop.create_future()
+            loop.add_reader(pidfd, lambda: ready.done() or ready.set_result(None))
+            try:
+                await ready
+            finally:
+                loop.remove_reader(pidfd)
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
+
+
+async def supervise(name: str, coro_fn, *args, restart_delay: float = 5.0):
+    """Выполнять цикл coro_fn(*args); после исключения — перезапуск через restart_delay.
+
+    Обычный возврат (например, ONVIF выключен для камеры) означает, что цикл не нужен.
+    """
+    while True:
+        try:
+            await coro_fn(*args)
+            log(f"ℹ️ {name}: цикл завершился")
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log(f"⚠️ {name}: цикл упал: {type(e).__name__}: {e}")
+            log(traceback.format_exc())
+            await _report(f"⚠️ {name}: цикл упал ({type(e).__name__}: {e}), перезапуск через {restart_delay:.0f}s")
+            await asyncio.sleep(restart_delay)
+
+
+async def _report(text: str):
+    from modules.telegram_utils import send_telegram_message
+
+    try:
+        await asyncio.wait_for(send_telegram_message(text), timeout=30)
+    except Exception as e:
+        log(f"⚠️ Не удалось отправить в Telegram: {e}")
@@ -0,0 +1,143 @@
+"""Долгоживущий ffmpeg с segment-муксером.
+
+Один процесс ffmpeg держит одно RTSP-подключение и режет поток на файлы
+без перезапуска: новый сегмент всегда начинается с ключевого кадра,
+поэтому между файлами нет разрывов. Завершённые сегменты ffmpeg
+объявляет через segment_list (csv в stdout), после чего мы атомарно
+публикуем их переименованием.
+"""
+import os
+import time
+import asyncio
+import subprocess
+
+from modules.env_config import FFMPEG_LOGLEVEL, RECORD_STALL_SECONDS
+from modules.logger import log
+from modules.ffmpeg_progress import SupervisedFFmpeg, bump_stat
+
+
+class Segmenter:
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        staging_dir: str,
+        segment_seconds: float,
+        on_segment,
+        *,
+        clock_aligned: bool = True,
+        filename_pattern: str = "%Y.%m.%d_%H.%M.%S.mkv",
+        strftime: bool = True,
+    ):
+        """
+        name            — имя для логов.
+        staging_dir     — куда ffmpeg пишет недописанные сегменты (не сканируется sender'ом).
+        on_segment      — callback(path, start, end), вызывается для каждого завершённого сегмента.
+        clock_aligned   — резать по сетке настенных часов (как раньше делал record_loop).
+        """
+        self.name = name
+        self.url = url
+        self.staging_dir = staging_dir
+        self.segment_seconds = max(1.0, float(segment_seconds))
+        self.on_segment = on_segment
+        self.clock_aligned = clock_aligned
+        self.filename_pattern = filename_pattern
+        self.strftime = strftime
+        self.proc = None
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+    def _cmd(self) -> list[str]:
+        cmd = [
+            "ffmpeg", "-nostdin", "-hide_banner", "-y", "-loglevel", FFMPEG_LOGLEVEL,
+            "-rtsp_transport", "tcp", "-i", self.url,
+            "-map", "0:v:0", "-map", "0:a:0?",
+            "-c", "copy",
+            "-f", "segment",
+            "-segment_time", str(self.segment_seconds),
+            "-segment_format", "matroska",
+            "-reset_timestamps", "1",
+            "-segment_list", "pipe:1",
+            "-segment_list_type", "csv",
+        ]
+        if self.clock_aligned:
+            cmd += ["-segment_atclocktime", "1"]
+        if self.strftime:
+            cmd += ["-strftime", "1"]
+        cmd.append(os.path.join(self.staging_dir, self.filename_pattern))
+        return cmd
+
+    def _emit(self, path: str, start: float | None, end: float | None):
+        try:
+            if not os.path.exists(path):
+                return
+            if os.path.getsize(path) == 0:
+                os.remove(path)
+                return
+            self.on_segment(path, start, end)
+        except Exception as e:
+            log(f"⚠️ [{self.name}] Ошибка публикации сегмента {path}: {type(e).__name__}: {e!r}")
+
+    def flush_leftovers(self):
+        """Опубликовать всё, что осталось в staging после падения ffmpeg/рестарта."""
+        try:
+            names = sorted(os.listdir(self.staging_dir))
+        except FileNotFoundError:
+            return
+        for fname in names:
+            path = os.path.join(self.staging_dir, fname)
+            if os.path.isfile(path):
+                self._emit(path, None, None)
+
+    async def _run_once(self) -> int:
+        self.proc = await SupervisedFFmpeg.start(
+            self.name,
+            self._cmd(),
+            stall_seconds=RECORD_STALL_SECONDS,
+            stdout=subprocess.PIPE,
+            stdin=subprocess.DEVNULL,
+        )
+        log(f"🎬 [{self.name}] Сегментатор запущен (pid={self.proc.proc.pid}, сегмент {self.segment_seconds:g}s)")
+        try:
+            async for raw in self.proc.proc.stdout:
+                self._on_list_line(raw.decode("utf-8", "replace"))
+        except BaseException:
+            # отмена цикла записи: ffmpeg не должен его пережить; wait() забирает процесс
+            # и гасит задачи чтения -progress и сторожа
+            await asyncio.shield(self.proc.stop())
+            await asyncio.shield(self.proc.wait())
+            raise
+        return await self.proc.wait()
+
+    def _on_list_line(self, line: str):
+        line = line.strip()
+        if not line:
+            return
+        # csv: filename,start_time,end_time
+        fields = line.rsplit(",", 2)
+        fname = fields[0].strip('"')
+        try:
+            start = float(fields[1])
+            end = float(fields[2])
+        except (IndexError, ValueError):
+            start = end = None
+        self._emit(os.path.join(self.staging_dir, os.path.basename(fname)), start, end)
+
+    async def run(self):
+        """Бесконечный цикл: держим ffmpeg живым, при падении/зависании перезапускаем с бэк-оффом."""
+        backoff = 1.0
+        self.flush_leftovers()
+        while True:
+            t0 = time.time()
+            try:
+                rc = await self._run_once()
+                log(f"⚠️ [{self.name}] ffmpeg сегментатора завершился rc={rc}")
+            except Exception as e:
+                log(f"⚠️ [{self.name}] Ошибка сегментатора: {type(e).__name__}: {e!r}")
+            bump_stat(self.name, "restarts")
+            # последний (недописанный или прерванный сторожем) сегмент ffmpeg не объявляет — публикуем сами
+            self.flush_leftovers()
+            # если процесс прожил долго — это не «флаппинг», сбрасываем бэк-офф
+            if time.time() - t0 > 60:
+                backoff = 1.0
+            await asyncio.sleep(backoff)
+            backoff = min(60.0, backoff * 2)
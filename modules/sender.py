@@ -1,20 +1,40 @@
 import os
+import resource
 import time
+import signal
+import shutil
+import asyncio
+import tempfile
 import subprocess
 from glob import glob
 from os import listdir
 from os.path import join, exists, getsize, splitext
 
 from modules.env_config import (
-    VIDEO_DIR,
-    SEND_ORIGINAL_MKV,
-    TRIM_START_SECONDS,
     FFMPEG_LOGLEVEL,
     TG_MAX_FILE_MB,
     TG_SPLIT_SAFETY,
-    VIDEO_PREVIEW_ENABLED,
+    SENDER_PREPARE_WORKERS,
+    SENDER_QUEUE_SIZE,
+    SENDER_RESCAN_SEC,
+    TRANSCODE_PRESET,
+    TRANSCODE_CRF,
+    TRANSCODE_MIN_KBPS,
+    TRANSCODE_MAX_KBPS,
+    TRANSCODE_AUDIO_KBPS,
+    TRANSCODE_MAX_HEIGHT,
+    TRANSCODE_AUTO_SCALE,
+    TG_LOCAL_MODE,
+    TG_SEND_ALBUMS,
+    TG_ALBUM_STAGING_CHAT_ID,
+    TG_ALBUM_UPLOAD_WORKERS,
 )
-from modules.telegram_utils import send_preview_image, send_video_file
+from modules import manifest, media_probe, metrics, runtime, tracing, upload_scheduler
+from modules.cameras import Camera
+from modules.fswatch import open_watcher
+from modules.split_planner import plan_split, segment_times_arg
+from modules.storage import ALERT_CLIP_SUFFIX, group_key, mark_busy, release_busy
+from modules.telegram_utils import send_preview_image, send_video_file, stage_video, send_media_group
 from modules.logger import log
 from modules.telegram_utils import send_telegram_message
 
@@ -23,53 +43,125 @@ SAFETY_MARGIN = TG_SPLIT_SAFETY
 
 _LAST_FFMPEG_ALERT_TS = 0.0
 
+# Общие на процесс лимиты стадий: ffmpeg-подготовка грузит CPU, upload — общий канал в Telegram
+# (слоты SENDER_UPLOAD_WORKERS выдаёт modules/upload_scheduler.py: клипы по алёрту раньше непрерывной записи).
+# Порядок отправки внутри камеры обеспечивает её _Pipeline (одна upload-задача на камеру).
+_PREPARE_SLOTS = asyncio.BoundedSemaphore(max(1, SENDER_PREPARE_WORKERS))
 
-def make_preview_jpg(src_video_path: str, preview_jpg_path: str, *, max_width: int = 960, quality: int = 6) -> bool:
-    """
-    Дёшево по ресурсам: вытаскиваем 1 кадр, можно ресайзнуть и сжать.
-    quality: 2..10 (меньше = лучше качество/больше размер). 5-7 обычно ок.
-    """
-    try:
-        cmd = ["ffmpeg", "-y", "-loglevel", FFMPEG_LOGLEVEL]
+# Больше 10 элементов в альбоме Telegram не принимает
+ALBUM_MAX_ITEMS = 10
+# Без служебного чата загрузить части заранее некуда (кроме --local, где файлы передаются путём)
+ALBUMS_ENABLED = TG_SEND_ALBUMS and (TG_LOCAL_MODE or bool(TG_ALBUM_STAGING_CHAT_ID))
+if TG_SEND_ALBUMS and not ALBUMS_ENABLED:
+    log("⚠️ TG_SEND_ALBUMS=true, но TG_ALBUM_STAGING_CHAT_ID не задан — части отправляются по одной")
 
-        # небольшой сдвиг, чтобы не словить пустой первый кадр
-        ss = TRIM_START_SECONDS if (TRIM_START_SECONDS and TRIM_START_SECONDS > 0) else 0.2
-        cmd += ["-ss", str(ss)]
 
-        cmd += ["-i", src_video_path, "-an", "-frames:v", "1"]
+async def _upload_video(cam: Camera, path: str, multi: bool) -> int | None:
+    # Подпись: имя файла без расширения (в имени уже есть дата/время) + камера, если их несколько
+    caption = splitext(os.path.basename(path))[0]
+    if multi:
+        caption = f"{caption} [{cam.name}]"
+    async with upload_scheduler.slot():
+        return await send_video_file(path, as_document=False, caption=caption)
 
-        # ресайз по ширине (с сохранением пропорций) + явный range, т.к. вход yuvj420p/color_range=pc
-        if max_width and max_width > 0:
-            cmd += ["-vf", f"scale='min({max_width},iw)':-2:in_range=pc:out_range=pc,format=yuv420p"]
 
-        # важно: -update 1, иначе ffmpeg может ругаться и/или сделать 0-byte файл
-        cmd += ["-q:v", str(quality), "-update", "1", preview_jpg_path]
+async def _upload_preview(path: str) -> int | None:
+    async with upload_scheduler.slot():
+        return await send_preview_image(path)
 
-        subprocess.run(cmd, check=True)
 
-        ok = os.path.exists(preview_jpg_path) and os.path.getsize(preview_jpg_path) > 0
-        if not ok:
-            log(f"⚠️ Preview empty or missing: {preview_jpg_path}")
-        return ok
+def _preview_args(preview_jpg_path: str, *, max_width: int = 960, quality: int = 6) -> list[str]:
+    """Выход ffmpeg «один кадр в jpg». quality: 2..10 (меньше = лучше качество/больше размер)."""
+    args = ["-map", "0:v:0", "-an", "-frames:v", "1"]
+    # ресайз по ширине (с сохранением пропорций) + явный range, т.к. вход yuvj420p/color_range=pc
+    if max_width and max_width > 0:
+        args += ["-vf", f"scale='min({max_width},iw)':-2:in_range=pc:out_range=pc,format=yuv420p"]
+    # важно: -update 1, иначе ffmpeg может ругаться и/или сделать 0-byte файл
+    args += ["-q:v", str(quality), "-update", "1", preview_jpg_path]
+    return args
+
+
+def _preview_ok(preview_jpg_path: str | None) -> bool:
+    if not preview_jpg_path:
+        return False
+    ok = os.path.exists(preview_jpg_path) and os.path.getsize(preview_jpg_path) > 0
+    if not ok:
+        log(f"⚠️ Preview empty or missing: {preview_jpg_path}")
+    return ok
+
+
+async def make_preview_jpg(
+    src_video_path: str,
+    preview_jpg_path: str,
+    *,
+    max_width: int = 960,
+    quality: int = 6,
+    trim_start_seconds: float = 0,
+) -> bool:
+    """
+    Отдельный проход только ради превью (когда конвертации нет: режим 1, mp4 уже готов и т.п.).
+    Декодируется только первый ключевой кадр (-skip_frame nokey) — без декодирования GOP целиком.
+    """
+    try:
+        cmd = ["ffmpeg", "-y", "-loglevel", FFMPEG_LOGLEVEL, "-skip_frame:v", "nokey"]
+        if trim_start_seconds and trim_start_seconds > 0:
+            cmd += ["-ss", str(trim_start_seconds)]
+        cmd += ["-i", src_video_path] + _preview_args(preview_jpg_path, max_width=max_width, quality=quality)
+
+        rc = await _run_measured(cmd, stage="preview")
+        if rc != 0:
+            raise subprocess.CalledProcessError(rc, cmd)
+        return _preview_ok(preview_jpg_path)
 
     except Exception as e:
         log(f"Ошибка make_preview_jpg: {type(e).__name__}: {e!r}")
         return False
 
 
-def _tg_alert_ffmpeg_once_per(min_seconds: int, text: str) -> None:
+async def _tg_alert_ffmpeg_once_per(min_seconds: int, text: str) -> None:
     global _LAST_FFMPEG_ALERT_TS
     now = time.time()
     if now - _LAST_FFMPEG_ALERT_TS < float(min_seconds):
         return
     _LAST_FFMPEG_ALERT_TS = now
     try:
-        send_telegram_message(text)
+        await send_telegram_message(text)
     except Exception as e:
         log(f"⚠️ Не удалось отправить алерт в TG: {type(e).__name__}: {e!r}")
 
 
-def _run_cmd_logged(cmd, *, what: str, timeout: int | None = None):
+async def _kill(proc: subprocess.Popen) -> tuple[int, resource.struct_rusage]:
+    """Убить ffmpeg и забрать его (Popen.kill() сначала делает poll() и сам забрал бы процесс без rusage)."""
+    os.kill(proc.pid, signal.SIGKILL)
+    rc, usage = await runtime.wait_process(proc.pid)
+    proc.returncode = rc
+    return rc, usage
+
+
+async def _run_measured(cmd: list[str], *, stage: str, stdout=None, stderr=None, timeout: float | None = None) -> int:
+    """Запустить процесс и дождаться его через wait4: время и CPU именно этого ffmpeg идут в метрики стадии.
+
+    Ожидание — в event loop'е (runtime.wait_process); по таймауту или отмене задачи ffmpeg убивается.
+    """
+    t0 = time.monotonic()
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=stdout, stderr=stderr)
+    try:
+        with tracing.span(f"ffmpeg_{stage}"):
+            rc, usage = await asyncio.wait_for(runtime.wait_process(proc.pid), timeout)
+    except asyncio.TimeoutError:
+        rc, usage = await _kill(proc)
+    except BaseException:
+        await asyncio.shield(_kill(proc))
+        raise
+    proc.returncode = rc
+    metrics.PREPARE_SECONDS.observe(time.monotonic() - t0, stage=stage)
+    metrics.PREPARE_CPU.inc(usage.ru_utime + usage.ru_stime, stage=stage)
+    if proc.returncode != 0:
+        metrics.PREPARE_FAILURES.inc(stage=stage)
+    return proc.returncode
+
+
+async def _run_cmd_logged(cmd, *, what: str, stage: str, timeout: int | None = None):
     def _tail(s: str, n: int = 120) -> str:
         if not s:
             return ""
@@ -79,14 +171,14 @@ def _run_cmd_logged(cmd, *, what: str, timeout: int | None = None):
         return "\n".join(lines[-n:])
 
     log(f"▶️ {what}: {' '.join(cmd)}")
-    p = subprocess.run(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        timeout=timeout,
-        check=False
-    )
+    # вывод — во временные файлы: без каналов процесс можно дождаться через wait4 (CPU для метрик)
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        rc = await _run_measured(cmd, stage=stage, stdout=out, stderr=err, timeout=timeout)
+        out.seek(0)
+        err.seek(0)
+        p = subprocess.CompletedProcess(
+            cmd, rc, out.read().decode("utf-8", "replace"), err.read().decode("utf-8", "replace")
+        )
 
     if p.returncode != 0:
         log(f"❌ {what} failed rc={p.returncode}")
@@ -102,263 +194,753 @@ def _run_cmd_logged(cmd, *, what: str, timeout: int | None = None):
             f"cmd: {' '.join(cmd)[:900]}\n"
             f"stderr:\n{stderr_tail[:2500]}"
         )
-        _tg_alert_ffmpeg_once_per(120, msg)
+        await _tg_alert_ffmpeg_once_per(120, msg)
 
         raise RuntimeError(f"{what} failed rc={p.returncode}")
 
     return p
 
 
-def split_video(path, ext):
+async def _run_with_preview(cmd: list[str], preview_jpg: str | None, *, what: str, stage: str, keyframe_only: bool):
+    """Выполнить ffmpeg-конвертацию, дописав к ней второй выход — кадр превью.
+
+    Файл читается один раз и один процесс даёт и mp4, и jpg. keyframe_only — видео только
+    копируется (stream copy), и для превью достаточно декодировать ключевые кадры.
+    Если совместный проход не удался, конвертация повторяется без превью.
+    """
+    if not preview_jpg:
+        return await _run_cmd_logged(cmd, what=what, stage=stage)
+    full = list(cmd)
+    if keyframe_only:
+        i = full.index("-i")
+        full[i:i] = ["-skip_frame:v", "nokey"]
+    full += _preview_args(preview_jpg)
+    try:
+        return await _run_cmd_logged(full, what=f"{what} + preview", stage=stage)
+    except RuntimeError:
+        log(f"⚠️ {what}: не удалось вместе с превью, повтор без превью")
+        return await _run_cmd_logged(cmd, what=what, stage=stage)
+
+
+def _segment_args(path: str, plan, fallback_time: float) -> list[str]:
+    """Аргументы нарезки segment-муксера: по плану (точные ключевые кадры) или по оценке времени."""
+    if plan is None:
+        return ["-segment_time", f"{fallback_time:.3f}"]
+    biggest = max(plan.part_bytes)
+    if plan.provable:
+        log(f"✂️ План нарезки {os.path.basename(path)}: {plan.parts} частей, крупнейшая ~{biggest / 1048576:.1f}MB")
+    else:
+        log(
+            f"⚠️ План нарезки {os.path.basename(path)}: GOP больше лимита, "
+            f"крупнейшая часть ~{biggest / 1048576:.1f}MB"
+        )
+    return ["-segment_times", segment_times_arg(plan)]
+
+
+async def split_video(path, ext):
     size = getsize(path)
     limit = MAX_TELEGRAM_SIZE * SAFETY_MARGIN
     if size <= limit:
         return [path]
 
-    # duration probe (ffprobe)
-    try:
-        out = subprocess.check_output([
-            "ffprobe", "-v", "error",
-            "-select_streams", "v:0",
-            "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            path
-        ], stderr=subprocess.STDOUT, text=True)
-        duration = float((out or "").strip())
-        segment_time = max(1, duration * limit / size)
-    except Exception as e:
-        log(f"⚠️ ffprobe duration failed for {path}: {type(e).__name__}: {e!r}")
-        segment_time = 60
+    # точки реза — по индексу пакетов; если ffprobe не справился — по средней скорости потока
+    plan = await plan_split(path, MAX_TELEGRAM_SIZE)
+    if plan is not None and plan.parts == 1:
+        return [path]
+    segment_time = 60.0
+    if plan is None:
+        duration = await media_probe.duration(path)
+        segment_time = max(1, duration * limit / size) if duration else 60
 
     # Важно: имя частей должно быть ДЕТЕРМИНИРОВАННЫМ,
     # иначе после рестарта мы не сможем однозначно сопоставить части между собой.
     base_name, _ = splitext(os.path.basename(path))
-    pattern = os.path.join(VIDEO_DIR, f"{base_name}_part%03d{ext}")
+    out_dir = os.path.dirname(path)
+    pattern = os.path.join(out_dir, f"{base_name}_part%03d{ext}")
 
     cmd = [
         "ffmpeg", "-y", "-loglevel", FFMPEG_LOGLEVEL,
         "-i", path,
         "-c", "copy",
         "-f", "segment",
-        "-segment_time", str(segment_time),
+        *_segment_args(path, plan, segment_time),
         "-reset_timestamps", "1",
         pattern
     ]
 
     try:
-        _run_cmd_logged(cmd, what=f"ffmpeg split {os.path.basename(path)}")
-        parts = sorted(glob(os.path.join(VIDEO_DIR, f"{base_name}_part*{ext}")))
+        await _run_cmd_logged(cmd, what=f"ffmpeg split {os.path.basename(path)}", stage="split")
+        parts = sorted(glob(os.path.join(out_dir, f"{base_name}_part*{ext}")))
         return parts if parts else [path]
     except Exception as e:
         log(f"⚠️ Error splitting video {path}: {type(e).__name__}: {e!r}")
         return [path]
 
 
-def send_loop():
+class _Job:
+    """Одна запись в конвейере отправки.
+
+    kind: "mkv"   — новая запись: превью, конвертация, нарезка;
+          "mp4"   — mp4 остался после падения: только нарезка;
+          "parts" — остались только части (без базового mp4).
+    """
+
+    def __init__(self, kind: str, path: str):
+        self.kind = kind
+        self.path = path
+        self.key = group_key(path)
+        self.preview: str | None = None
+        self.to_send: str | None = None
+        self.parts: list[str] = []
+        self.ok = False
+        self.error: str | None = None  # последняя ошибка подготовки/отправки (для журнала)
+        self.prepared = asyncio.Event()
+
+
+def existing_parts(base_path: str) -> list[str]:
+    """Готовые части записи (и отправленные, и нет) — в порядке номеров, без суффикса .sent."""
+    names = {p[:-5] if p.endswith(".sent") else p for p in glob(base_path + "_part*.mp4") + glob(base_path + "_part*.mp4.sent")}
+    return sorted(names)
+
+
+async def remux_split(path: str, trim: float = 0, preview_jpg: str | None = None) -> list[str] | None:
+    """MKV -> части MP4 (faststart) за ОДИН проход ffmpeg, каждая меньше лимита Telegram.
+
+    Вместо «remux в целый mp4, затем ещё одна перезапись segment-муксером» читаем MKV один раз.
+    Части пишутся во временную папку и переносятся в VIDEO_DIR только целиком готовым набором
+    с детерминированными именами {base}_partNNN.mp4 — поэтому докачка после рестарта работает как раньше.
+    Точки реза берутся из плана по индексу пакетов (modules/split_planner.py). Если плана нет или
+    часть всё же вышла больше лимита, проход повторяется с оценкой segment_time, каждый раз меньшей.
+    None — резать не нужно или уложиться не удалось, пусть работает обычный путь.
+    preview_jpg — заодно (тем же проходом) сохранить кадр превью.
+    """
+    size = getsize(path)
+    limit = MAX_TELEGRAM_SIZE * SAFETY_MARGIN
+    out_dir = os.path.dirname(path)
+    base_name, _ = splitext(os.path.basename(path))
+    tmp_dir = join(out_dir, f".split_{base_name}")
+
+    # звук перекодируется в opus: считаем его по верхней оценке битрейта, а не по исходным пакетам
+    plan = await plan_split(path, MAX_TELEGRAM_SIZE, start=trim or 0, audio_kbps=128)
+    if plan is not None and plan.parts == 1:
+        return None
+    segment_time = 60.0
+    if plan is None:
+        duration = await media_probe.duration(path)
+        segment_time = max(1.0, duration * limit / size) if duration else 60.0
+
+    parts: list[str] = []
+    try:
+        for attempt in range(1, 4):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            cmd = ["ffmpeg", "-y", "-loglevel", FFMPEG_LOGLEVEL]
+            if trim and trim > 0:
+                cmd += ["-ss", str(trim)]
+            cmd += [
+                "-i", path,
+                "-map", "0:v:0", "-map", "0:a:0?",
+                "-c:v", "copy",
+                "-c:a", "libopus",
+                "-f", "segment",
+                *_segment_args(path, plan, segment_time),
+                "-segment_format", "mp4",
+                "-segment_format_options", "movflags=+faststart",
+                "-reset_timestamps", "1",
+                join(tmp_dir, f"{base_name}_part%03d.mp4"),
+            ]
+            await _run_with_preview(
+                cmd,
+                preview_jpg if attempt == 1 else None,
+                what=f"ffmpeg remux+split {os.path.basename(path)} (attempt {attempt})",
+                stage="remux_split",
+                keyframe_only=True,
+            )
+
+            parts = sorted(glob(join(tmp_dir, f"{base_name}_part*.mp4")))
+            biggest = max((getsize(p) for p in parts), default=0)
+            if parts and biggest <= MAX_TELEGRAM_SIZE:
+                break
+            log(
+                f"⚠️ remux+split {os.path.basename(path)}: часть {biggest / 1048576:.1f}MB > "
+                f"{MAX_TELEGRAM_SIZE / 1048576:.0f}MB, повтор с меньшим segment_time"
+            )
+            if plan is not None:
+                # план не сработал — дальше по оценке от средней длины частей
+                segment_time = max(1.0, (await media_probe.duration(path) or 60.0 * len(parts)) / max(1, len(parts)))
+                plan = None
+            segment_time = max(1.0, segment_time * limit / max(1, biggest))
+        else:
+            return None
+
+        final = []
+        for p in parts:
+            dst = join(out_dir, os.path.basename(p))
+            os.rename(p, dst)
+            final.append(dst)
+        return final
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+# Автоуменьшение кадра в режиме 4: (видео kbps не меньше, высота кадра; 0 = как есть)
+_SCALE_LADDER = ((2500, 0), (1200, 720), (600, 480), (0, 360))
+
+
+def _size_plan(duration: float) -> tuple[int, float, int]:
+    """(число частей, длина части в секундах, потолок битрейта видео в kbps) для клипа."""
+    # ~3% на контейнер mp4
+    limit_bits = MAX_TELEGRAM_SIZE * SAFETY_MARGIN * 8 * 0.97
+    audio_bps = TRANSCODE_AUDIO_KBPS * 1000
+    n = 1
     while True:
-        # Обрабатываем в стабильном порядке (старые файлы первыми)
-        for fname in sorted(listdir(VIDEO_DIR)):
-            if not fname.endswith(".mkv"):
-                continue
+        part = duration / n
+        # VBV с bufsize = maxrate: видео части не больше maxrate × (длина + 1 с)
+        kbps = (limit_bits - audio_bps * part) / (part + 1) / 1000
+        if kbps >= TRANSCODE_MIN_KBPS or n >= 999:
+            return n, part, int(min(kbps, TRANSCODE_MAX_KBPS))
+        n += 1
+
+
+async def transcode_to_size(path: str, trim: float = 0, preview_jpg: str | None = None) -> list[str] | None:
+    """Режим 4: перекодировать MKV так, чтобы клип (или каждая часть) уложился в один upload.
+
+    Потолок битрейта считается из длительности и TG_MAX_FILE_MB × TG_SPLIT_SAFETY; кодируем
+    CRF с этим потолком (maxrate/bufsize), поэтому статичная сцена выходит заметно меньше лимита,
+    а сложная — упирается в потолок, но не выходит за него. Если на весь клип битрейт получается
+    ниже TRANSCODE_MIN_KBPS, клип режется на равные по времени части (ключевой кадр на каждой
+    границе). Результат: [{base}.mp4] или [{base}_partNNN.mp4, ...]; None — длительность неизвестна.
+    """
+    duration = await media_probe.duration(path)
+    if not duration:
+        return None
+    duration = max(1.0, duration - (trim if trim and trim > 0 else 0))
+    n, part_seconds, kbps = _size_plan(duration)
+
+    height = TRANSCODE_MAX_HEIGHT
+    if TRANSCODE_AUTO_SCALE:
+        auto = next(h for min_kbps, h in _SCALE_LADDER if kbps >= min_kbps)
+        if auto and (not height or auto < height):
+            height = auto
+
+    out_dir = os.path.dirname(path)
+    base_name, _ = splitext(os.path.basename(path))
+    tmp_dir = join(out_dir, f".transcode_{base_name}")
 
-            path = join(VIDEO_DIR, fname)
-            preview_jpg = path.replace(".mkv", ".jpg")
-            mp4_file = path.replace(".mkv", ".mp4")
-            sent = False
+    cmd = ["ffmpeg", "-y", "-loglevel", FFMPEG_LOGLEVEL]
+    if trim and trim > 0:
+        cmd += ["-ss", str(trim)]
+    cmd += [
+        "-i", path,
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-c:v", "libx264",
+        "-preset", TRANSCODE_PRESET,
+        "-crf", str(TRANSCODE_CRF),
+        "-maxrate", f"{kbps}k",
+        "-bufsize", f"{kbps}k",
+    ]
+    if height:
+        cmd += ["-vf", f"scale=-2:'min({height},ih)'"]
+    cmd += ["-c:a", "libopus", "-b:a", f"{TRANSCODE_AUDIO_KBPS}k"]
+    if n == 1:
+        cmd += ["-f", "mp4", "-movflags", "+faststart", join(tmp_dir, f"{base_name}.mp4")]
+    else:
+        cmd += [
+            "-force_key_frames", f"expr:gte(t,n_forced*{part_seconds:.3f})",
+            "-f", "segment",
+            "-segment_time", f"{part_seconds:.3f}",
+            "-segment_format", "mp4",
+            "-segment_format_options", "movflags=+faststart",
+            "-reset_timestamps", "1",
+            join(tmp_dir, f"{base_name}_part%03d.mp4"),
+        ]
 
-            # Если mp4 уже существует (например, конвертация успела пройти до падения),
-            # не конвертим заново.
-            mp4_ready = exists(mp4_file)
+    try:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        await _run_with_preview(
+            cmd,
+            preview_jpg,
+            what=f"ffmpeg transcode-to-size {os.path.basename(path)} ({n}x{part_seconds:.0f}s @ {kbps}kbps)",
+            stage="transcode_to_size",
+            keyframe_only=False,
+        )
 
-            # превью (опционально)
-            if VIDEO_PREVIEW_ENABLED:
-                try:
-                    if make_preview_jpg(path, preview_jpg, max_width=960, quality=6):
-                        send_preview_image(preview_jpg)
-                except Exception as e:
-                    log(f"Ошибка генерации/отправки превью: {e}")
-                finally:
-                    try:
-                        if exists(preview_jpg):
-                            os.remove(preview_jpg)
-                    except Exception:
-                        pass
+        target = MAX_TELEGRAM_SIZE * SAFETY_MARGIN
+        final = []
+        for p in sorted(glob(join(tmp_dir, "*.mp4"))):
+            size = getsize(p)
+            log(
+                f"🎯 transcode {os.path.basename(p)}: {size / 1048576:.1f}MB при цели "
+                f"{target / 1048576:.1f}MB ({size / target:.0%}), потолок {kbps}kbps"
+                + (f", ≤{height}p" if height else "")
+            )
+            dst = join(out_dir, os.path.basename(p))
+            os.rename(p, dst)
+            final.append(dst)
+        return final
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+async def _convert_mkv(cam: Camera, path: str, mp4_file: str, preview_jpg: str | None = None) -> bool:
+    """MKV -> MP4 по SEND_ORIGINAL_MKV (и кадр превью тем же проходом). False — неизвестный режим."""
+    mode = cam.send_original_mkv
+    trim = cam.trim_start_seconds
+    # 4 сюда попадает, только если длительность клипа неизвестна (нечем рассчитать битрейт)
+    if mode in (2, 4):
+        conversion_args = [
+            "ffmpeg", "-y", "-loglevel", FFMPEG_LOGLEVEL,
+        ]
+        if trim and trim > 0:
+            conversion_args += ["-ss", str(trim)]
+        conversion_args += [
+            "-i", path,
+            "-map", "0:v:0", "-map", "0:a:0?",
+            "-c:v", "libx264",
+            "-preset", "fast",
+            "-crf", "28",
+            # если нужен AAC: "-c:a", "aac", "-b:a", "128k"
+            "-c:a", "libopus",
+            "-b:a", "128k",
+            "-f", "mp4", "-movflags", "+faststart", mp4_file
+        ]
+        # видео всё равно декодируется целиком — превью берёт первый же кадр
+        await _run_with_preview(
+            conversion_args,
+            preview_jpg,
+            what=f"ffmpeg transcode {os.path.basename(path)} -> {os.path.basename(mp4_file)}",
+            stage="transcode",
+            keyframe_only=False,
+        )
+        return True
+
+    if mode == 3:
+        conversion_args = [
+            "ffmpeg", "-y", "-loglevel", FFMPEG_LOGLEVEL,
+        ]
+        if trim and trim > 0:
+            conversion_args += ["-ss", str(trim)]
+        conversion_args += [
+            "-i", path,
+            "-map", "0:v:0", "-map", "0:a:0?",
+            "-c:v", "copy",
+            "-c:a", "libopus",
+            "-f", "mp4", "-movflags", "+faststart", mp4_file
+        ]
+        await _run_with_preview(
+            conversion_args,
+            preview_jpg,
+            what=f"ffmpeg remux(copy v) {os.path.basename(path)} -> {os.path.basename(mp4_file)}",
+            stage="remux",
+            keyframe_only=True,
+        )
+        return True
 
-            try:
-                # 1) Получаем mp4 (если надо)
-                if SEND_ORIGINAL_MKV == 1:
-                    # отправляем mkv как есть
-                    to_send = path
-
-                else:
-                    to_send = mp4_file
-
-                    if not mp4_ready:
-                        if SEND_ORIGINAL_MKV == 2:
-                            conversion_args = [
-                                "ffmpeg", "-y", "-loglevel", FFMPEG_LOGLEVEL,
-                            ]
-                            if TRIM_START_SECONDS and TRIM_START_SECONDS > 0:
-                                conversion_args += ["-ss", str(TRIM_START_SECONDS)]
-                            conversion_args += [
-                                "-i", path,
-                                "-map", "0:v:0", "-map", "0:a:0?",
-                                "-c:v", "libx264",
-                                "-preset", "fast",
-                                "-crf", "28",
-                                # если нужен AAC: "-c:a", "aac", "-b:a", "128k"
-                                "-c:a", "libopus",
-                                "-b:a", "128k",
-                                "-f", "mp4", "-movflags", "+faststart", mp4_file
-                            ]
-                            _run_cmd_logged(conversion_args, what=f"ffmpeg transcode {os.path.basename(path)} -> {os.path.basename(mp4_file)}")
-
-                        elif SEND_ORIGINAL_MKV == 3:
-                            conversion_args = [
-                                "ffmpeg", "-y", "-loglevel", FFMPEG_LOGLEVEL,
-                            ]
-                            if TRIM_START_SECONDS and TRIM_START_SECONDS > 0:
-                                conversion_args += ["-ss", str(TRIM_START_SECONDS)]
-                            conversion_args += [
-                                "-i", path,
-                                "-map", "0:v:0", "-map", "0:a:0?",
-                                "-c:v", "copy",
-                                "-c:a", "libopus",
-                                "-f", "mp4", "-movflags", "+faststart", mp4_file
-                            ]
-                            _run_cmd_logged(
-                                conversion_args,
-                                what=f"ffmpeg remux(copy v) {os.path.basename(path)} -> {os.path.basename(mp4_file)}"
-                            )
-
-                        else:
-                            # неизвестный режим — не трогаем файл
-                            log(f"⚠️ Unknown SEND_ORIGINAL_MKV={SEND_ORIGINAL_MKV}, skip: {path}")
-                            continue
-
-                # 2) Отправляем (с поддержкой докачки частей после рестарта)
-                parts = split_video(to_send, ".mp4") if to_send.endswith(".mp4") else [to_send]
-                log(f"Отправка видеофайла: {to_send}")
-
-                for p in parts:
-                    if p.endswith(".mp4.sent"):
-                        continue
-                    # если уже помечен как отправленный
-                    if exists(p + ".sent"):
-                        continue
-
-                    # MP4 отправляем как video (режим 3)
-                    send_video_file(p, as_document=False)
-
-                    # помечаем отправленную часть, чтобы можно было продолжить после рестарта
-                    if p.endswith(".mp4") and "_part" in os.path.basename(p):
-                        try:
-                            os.rename(p, p + ".sent")
-                        except Exception:
-                            pass
-
-                sent = True
-
-            except Exception as e:
-                # ничего не удаляем — пусть повторит позже
-                log(f"Ошибка отправки видео ({path}): {e}")
-
-            if sent:
-                try:
-                    # удаляем исходник только ПОСЛЕ успешной отправки
-                    if exists(path) and path.endswith(".mkv"):
-                        os.remove(path)
-
-                    # удаляем mp4 (если это не оригинальный mkv)
-                    if (to_send != path) and exists(mp4_file) and mp4_file.endswith(".mp4"):
-                        os.remove(mp4_file)
-
-                    base, _ = splitext(os.path.basename(to_send))
-                    # чистим сегменты (включая помеченные .sent)
-                    for seg in glob(join(VIDEO_DIR, f"{base}_part*.mp4")) + glob(join(VIDEO_DIR, f"{base}_part*.mp4.sent")):
-                        try:
-                            os.remove(seg)
-                        except Exception:
-                            pass
+    return False
 
-                except Exception as e:
-                    log(f"Ошибка очистки после отправки: {e}")
 
-        # ---- Досылка зависших mp4/частей после падения ----
+async def _prepare(cam: Camera, job: _Job):
+    """Стадия подготовки: превью, конвертация, нарезка. Ничего не отправляет."""
+    known_parts = manifest.parts(job.key)
+    if known_parts and all(r["state"] == "uploaded" or exists(r["path"]) for r in known_parts):
+        # подготовка уже была до рестарта — набор частей берём из журнала, ничего не пересобираем
+        job.parts = [r["path"] for r in known_parts]
+        job.to_send = job.path
+        job.ok = True
+        return
 
-        # 1) цельные mp4
-        for fname in sorted(listdir(VIDEO_DIR)):
-            if not fname.endswith(".mp4"):
-                continue
-            if "_part" in fname:
-                continue
+    if job.kind != "parts" and not exists(job.path):
+        # файлы записи удалены (менеджером места или вручную) — отправлять нечего
+        log(f"⚠️ [{cam.name}] Запись {os.path.basename(job.path)} пропала с диска, снимаю с очереди")
+        manifest.evicted(job.key)
+        return
+
+    if job.kind == "parts":
+        job.parts = existing_parts(job.path)
+        job.to_send = job.path + ".mp4"
+        _prepared(job)
+        return
+
+    if job.kind == "mp4":
+        job.to_send = job.path
+        job.parts = await split_video(job.path, ".mp4")
+        _prepared(job)
+        return
+
+    path = job.path
+    preview_jpg = path.replace(".mkv", ".jpg")
+    mp4_file = path.replace(".mkv", ".mp4")
+
+    # Если mp4 уже существует (например, конвертация успела пройти до падения),
+    # не конвертим заново.
+    mp4_ready = exists(mp4_file)
+
+    # превью (опционально; если уже ушло до рестарта — второй раз не шлём).
+    # Кадр снимается тем же проходом ffmpeg, что и конвертация; отдельный проход — только если её нет.
+    rec = manifest.get(job.key)
+    want_preview = cam.video_preview_enabled and not (rec and rec["preview_message_id"] is not None)
+
+    def preview_target() -> str | None:
+        done = exists(preview_jpg) and getsize(preview_jpg) > 0
+        return preview_jpg if want_preview and not done else None
+
+    # 1) Получаем mp4 (если надо)
+    base_path = splitext(path)[0]
+    if cam.send_original_mkv == 1:
+        # отправляем mkv как есть
+        job.to_send = path
+    elif cam.send_original_mkv == 4 and not mp4_ready:
+        # части уже перекодированы до рестарта — берём их
+        job.to_send = path
+        job.parts = existing_parts(base_path)
+        if not job.parts:
+            sized = await transcode_to_size(path, cam.trim_start_seconds, preview_target())
+            if sized and len(sized) > 1:
+                job.parts = sized
+            else:
+                job.to_send = mp4_file
+                if sized is None:
+                    await _convert_mkv(cam, path, mp4_file, preview_target())
+    elif cam.send_original_mkv == 3 and not mp4_ready:
+        # части уже нарезаны до рестарта — берём их, не перекодируя заново
+        job.to_send = path
+        job.parts = existing_parts(base_path)
+        if not job.parts and getsize(path) > MAX_TELEGRAM_SIZE * SAFETY_MARGIN:
+            job.parts = await remux_split(path, cam.trim_start_seconds, preview_target()) or []
+        if not job.parts:
+            # маленький файл (или не удалось уложиться в лимит) — обычный remux в один mp4
+            job.to_send = mp4_file
+            await _convert_mkv(cam, path, mp4_file, preview_target())
+    else:
+        job.to_send = mp4_file
+        if not mp4_ready and not await _convert_mkv(cam, path, mp4_file, preview_target()):
+            # неизвестный режим — не трогаем файл
+            log(f"⚠️ Unknown SEND_ORIGINAL_MKV={cam.send_original_mkv}, skip: {path}")
+            return
+
+    if want_preview:
+        if preview_target():
+            # конвертации не было (режим 1, mp4/части уже готовы) или она прошла без превью
+            await make_preview_jpg(path, preview_jpg, max_width=960, quality=6, trim_start_seconds=cam.trim_start_seconds)
+        if _preview_ok(preview_jpg):
+            job.preview = preview_jpg
+
+    if job.parts:
+        _prepared(job)
+        return
+
+    # 2) Нарезка (с поддержкой докачки частей после рестарта)
+    job.parts = await split_video(job.to_send, ".mp4") if job.to_send.endswith(".mp4") else [job.to_send]
+    _prepared(job)
+
+
+def _prepared(job: _Job):
+    """Записать в журнал результат подготовки: набор частей и состояние записи."""
+    manifest.set_parts(job.key, job.parts)
+    manifest.set_state(job.key, "split" if len(job.parts) > 1 else "converted")
+    job.ok = True
+
+
+def _cleanup(job: _Job):
+    """Удалить запись целиком после успешной отправки."""
+    paths = {job.path, job.key + ".mkv", job.key + ".mp4", job.key + ".jpg"}
+    paths.update(r["path"] for r in manifest.parts(job.key))
+    # части и отметки .sent, оставшиеся от версий без журнала
+    paths.update(glob(job.key + "_part*.mp4") + glob(job.key + "_part*.mp4.sent"))
+    for p in sorted(paths):
+        try:
+            if exists(p):
+                os.remove(p)
+        except Exception as e:
+            log(f"Ошибка очистки после отправки ({p}): {e}")
 
-            path = join(VIDEO_DIR, fname)
-            base, _ = splitext(os.path.basename(path))
 
+async def _stage_parts(job: _Job, parts: list[str]) -> list[tuple[str, str]]:
+    """Ссылки на части альбома: загрузить в служебный чат те, что ещё не загружены.
+
+    Загрузка идёт параллельно (до TG_ALBUM_UPLOAD_WORKERS), порядок результата совпадает с parts.
+    Каждый file_id сразу пишется в журнал — после рестарта повторно грузятся только недостающие части.
+    """
+    if TG_LOCAL_MODE:
+        # локальный сервер прочитает файлы сам, загружать нечего
+        return [("video", os.path.abspath(p)) for p in parts]
+
+    refs = [manifest.staged_ref(job.key, p) for p in parts]
+    missing = [i for i, ref in enumerate(refs) if ref is None]
+    if not missing:
+        return refs
+
+    workers = asyncio.Semaphore(max(1, min(TG_ALBUM_UPLOAD_WORKERS, len(missing))))
+
+    # класс отправки и трассы — contextvars: задачи gather получают их копию
+    async def stage(i: int):
+        p = parts[i]
+        async with workers:
+            manifest.part_uploading(job.key, p)
+            ref = await stage_video(p)
+        manifest.part_staged(job.key, p, *ref)
+        refs[i] = ref
+
+    t0 = time.time()
+    # как и раньше, дожидаемся всех загрузок: удачные успевают попасть в журнал
+    errors = [r for r in await asyncio.gather(*(stage(i) for i in missing), return_exceptions=True) if r is not None]
+    if errors:
+        raise errors[0]
+    log(f"📦 Загружено частей для альбома: {len(missing)} за {time.time() - t0:.1f}s")
+    return refs
+
+
+async def _upload_albums(cam: Camera, job: _Job, multi: bool):
+    """Отправить части альбомами по ALBUM_MAX_ITEMS.
+
+    Разбиение на альбомы зависит только от списка частей, поэтому после рестарта те же
+    альбомы собираются заново, а уже отправленные пропускаются.
+    """
+    caption = os.path.basename(job.key)
+    if multi:
+        caption = f"{caption} [{cam.name}]"
+    for start in range(0, len(job.parts), ALBUM_MAX_ITEMS):
+        chunk = job.parts[start:start + ALBUM_MAX_ITEMS]
+        if all(manifest.part_uploaded(job.key, p) for p in chunk):
+            continue
+        if len(chunk) == 1:
+            # хвост из одной части — альбом из одного элемента Telegram не примет
+            manifest.part_uploading(job.key, chunk[0])
+            with tracing.span("part_upload", part=os.path.basename(chunk[0])):
+                manifest.part_done(job.key, chunk[0], await _upload_video(cam, chunk[0], multi))
+            continue
+        async with upload_scheduler.slot():
+            with tracing.span("album_upload", part=f"{start + 1}-{start + len(chunk)}"):
+                refs = await _stage_parts(job, chunk)
+                message_ids = await send_media_group(refs, caption=caption)
+        message_ids += [None] * (len(chunk) - len(message_ids))
+        manifest.parts_done(job.key, list(zip(chunk, message_ids)))
+
+
+async def _upload(cam: Camera, job: _Job, multi: bool):
+    """Стадия отправки: превью, затем части по порядку (или альбомами), затем очистка.
+
+    Каждая отправленная часть сразу фиксируется в журнале вместе с message_id,
+    поэтому после рестарта отправка продолжается со следующей части.
+    """
+    if job.preview:
+        try:
+            with tracing.span("preview_upload"):
+                manifest.set_preview_sent(job.key, await _upload_preview(job.preview))
+        except Exception as e:
+            log(f"Ошибка отправки превью: {e}")
+        finally:
             try:
-                parts = split_video(path, ".mp4")
-                log(f"♻️ Повторная отправка видео: {path}")
-
-                for p in parts:
-                    if exists(p + ".sent"):
-                        continue
-                    send_video_file(p, as_document=False)
-                    if "_part" in os.path.basename(p):
-                        try:
-                            os.rename(p, p + ".sent")
-                        except Exception:
-                            pass
-
-                # всё ушло — чистим
-                if exists(path):
-                    os.remove(path)
-                for seg in glob(join(VIDEO_DIR, f"{base}_part*.mp4")) + glob(join(VIDEO_DIR, f"{base}_part*.mp4.sent")):
-                    try:
-                        os.remove(seg)
-                    except Exception:
-                        pass
-
-            except Exception as e:
-                log(f"⚠️ Ошибка повторной отправки ({path}): {e}")
-
-        # 2) если остались ТОЛЬКО части (без базового mp4)
-        part_candidates = sorted(glob(join(VIDEO_DIR, "*_part*.mp4")))
-        groups: dict[str, list[str]] = {}
-        for p in part_candidates:
-            if p.endswith(".sent"):
+                if exists(job.preview):
+                    os.remove(job.preview)
+            except Exception:
+                pass
+
+    if job.kind == "mkv":
+        log(f"Отправка видеофайла: {job.to_send}")
+    elif job.kind == "mp4":
+        log(f"♻️ Повторная отправка видео: {job.to_send}")
+    else:
+        log(f"♻️ Досылка набором частей: {job.path} ({len(job.parts)} частей)")
+
+    if ALBUMS_ENABLED and len(job.parts) > 1:
+        await _upload_albums(cam, job, multi)
+    else:
+        for p in job.parts:
+            if manifest.part_uploaded(job.key, p):
                 continue
-            prefix = p.rsplit("_part", 1)[0]
-            groups.setdefault(prefix, []).append(p)
+            manifest.part_uploading(job.key, p)
+            with tracing.span("part_upload", part=os.path.basename(p)):
+                manifest.part_done(job.key, p, await _upload_video(cam, p, multi))
 
-        for prefix, parts in groups.items():
-            base_mp4 = prefix + ".mp4"
-            if exists(base_mp4):
-                continue  # обработает блок (1)
+    manifest.set_state(job.key, "uploaded")
+    tracing.mark("delivered")
+    _cleanup(job)
+    manifest.set_state(job.key, "cleaned")
 
-            pending = [p for p in sorted(parts) if exists(p)]
-            if not pending:
-                continue
 
+_PIPELINES: dict[str, "_Pipeline"] = {}
+
+
+@metrics.on_scrape
+def _queue_metrics():
+    for name, p in list(_PIPELINES.items()):
+        metrics.SEND_QUEUE.set(p.prepare_q.qsize(), camera=name, stage="prepare")
+        metrics.SEND_QUEUE.set(p.upload_q.qsize(), camera=name, stage="upload")
+        metrics.SEND_BACKLOG.set(len(manifest.pending(name, due_only=False)), camera=name)
+
+
+class _Pipeline:
+    """Конвейер отправки одной камеры: подготовка и отправка идут одновременно.
+
+    Записи берутся из журнала (modules/manifest.py) в порядке записи и ставятся в две
+    очереди в одном порядке: в очередь подготовки (её разбирают SENDER_PREPARE_WORKERS
+    задач) и в очередь отправки (одна задача, поэтому порядок отправки строго совпадает
+    с порядком записей). Пока идёт upload текущей записи, следующая уже конвертируется.
+    Очередь отправки ограничена SENDER_QUEUE_SIZE — дальше вперёд сканер не забегает.
+    Неудачную запись задача отправки повторяет сама (пауза manifest.retry_delay), не беря
+    следующих, пока запись не уйдёт или не будет снята с отправки (MANIFEST_MAX_ATTEMPTS).
+    """
+
+    def __init__(self, cam: Camera, multi: bool):
+        self.cam = cam
+        self.multi = multi
+        self.prepare_q: asyncio.Queue[_Job] = asyncio.Queue()
+        self.upload_q: asyncio.Queue[_Job] = asyncio.Queue(maxsize=max(1, SENDER_QUEUE_SIZE))
+        self.in_flight: set[str] = set()
+        _PIPELINES[cam.name] = self
+
+    def start(self, tg: asyncio.TaskGroup):
+        for i in range(max(1, SENDER_PREPARE_WORKERS)):
+            tg.create_task(self._prepare_worker(), name=f"prepare-{self.cam.name}-{i}")
+        tg.create_task(self._upload_worker(), name=f"upload-{self.cam.name}")
+
+    async def submit(self, kind: str, path: str):
+        job = _Job(kind, path)
+        if job.key in self.in_flight:
+            return
+        self.in_flight.add(job.key)
+        # пока запись в работе, менеджер места её не вытесняет
+        mark_busy(path)
+        # порядок постановки = порядок отправки; put ждёт, если очередь полна
+        await self.upload_q.put(job)
+        self.prepare_q.put_nowait(job)
+
+    async def _prepare_job(self, job: _Job):
+        job.error = None
+        try:
+            with tracing.bind(tracing.for_key(job.key)), tracing.span("prepare"):
+                async with _PREPARE_SLOTS:
+                    await _prepare(self.cam, job)
+        except Exception as e:
+            # ничего не удаляем — задача отправки повторит
+            log(f"Ошибка подготовки видео ({job.path}): {e}")
+            job.error = f"prepare: {e}"
+
+    async def _prepare_worker(self):
+        while True:
+            job = await self.prepare_q.get()
+            try:
+                await self._prepare_job(job)
+            finally:
+                job.prepared.set()
+
+    async def _try_upload(self, job: _Job) -> bool:
+        """Отправить подготовленную запись. False — ошибка (в job.error), запись надо повторить."""
+        if job.error:
+            return False
+        if not job.ok:
+            # записи нет на диске — отправлять нечего
+            return True
+        # клипы по алёрту (и ручные /video) обгоняют непрерывную запись других камер
+        cls = upload_scheduler.ALERT_CLIP if job.key.endswith(ALERT_CLIP_SUFFIX) else upload_scheduler.CONTINUOUS
+        try:
+            with upload_scheduler.priority(cls), tracing.bind(tracing.for_key(job.key)), tracing.span("upload"):
+                await _upload(self.cam, job, self.multi)
+        except Exception as e:
+            # ничего не удаляем — повторим
+            log(f"Ошибка отправки видео ({job.path}): {e}")
+            job.error = f"upload: {e}"
+            return False
+        return True
+
+    async def _upload_worker(self):
+        while True:
+            job = await self.upload_q.get()
+            await job.prepared.wait()
             try:
-                log(f"♻️ Досылка набором частей: {prefix} ({len(pending)} частей)")
-                for p in pending:
-                    if exists(p + ".sent"):
-                        continue
-                    send_video_file(p, as_document=False)
-                    try:
-                        os.rename(p, p + ".sent")
-                    except Exception:
-                        pass
-
-                # если все части отправлены — чистим
-                for p in glob(prefix + "_part*.mp4") + glob(prefix + "_part*.mp4.sent"):
-                    try:
-                        os.remove(p)
-                    except Exception:
-                        pass
-
-            except Exception as e:
-                log(f"⚠️ Ошибка досылки частей ({prefix}): {e}")
-
-        time.sleep(10)
+                # неудачная запись повторяется здесь же: следующие ждут в очереди, порядок не нарушается
+                while not await self._try_upload(job):
+                    attempts = manifest.note_failure(job.key, job.error)
+                    if not attempts:
+                        break
+                    delay = manifest.retry_delay(attempts)
+                    log(f"🔁 [{self.cam.name}] Повтор {os.path.basename(job.path)} через {delay:.0f} с, следующие записи ждут")
+                    await asyncio.sleep(delay)
+                    if job.ok:
+                        job.error = None
+                    else:
+                        await self._prepare_job(job)
+            finally:
+                release_busy(job.path)
+                self.in_flight.discard(job.key)
+
+    async def scan(self):
+        """Быстрый путь: только незавершённые записи из журнала, без обхода VIDEO_DIR."""
+        for rec in manifest.pending(self.cam.name):
+            await self.submit(rec["kind"], rec["path"])
+
+    def adopt(self):
+        """Медленный путь: внести в журнал файлы VIDEO_DIR, о которых он не знает.
+
+        Это записи от версий без журнала (в том числе наполовину отправленные части с .sent),
+        записи, опубликованные перед падением, но не успевшие попасть в журнал, и файлы,
+        подложенные вручную. Запускается при старте и раз в SENDER_RESCAN_SEC.
+        """
+        video_dir = self.cam.video_dir
+        # Обрабатываем в стабильном порядке (старые файлы первыми; .mkv раньше своего .mp4)
+        for fname in sorted(listdir(video_dir)):
+            self.adopt_file(join(video_dir, fname))
+
+    def adopt_file(self, path: str):
+        """Внести в журнал один файл, если его запись там ещё не числится."""
+        fname = os.path.basename(path)
+        if "_part" in fname and (fname.endswith(".mp4") or fname.endswith(".mp4.sent")):
+            # остались только части (без базового mp4/mkv)
+            prefix = path.rsplit("_part", 1)[0]
+            if exists(prefix + ".mp4") or exists(prefix + ".mkv"):
+                return
+            kind, path = "parts", prefix
+        elif fname.endswith(".mkv"):
+            kind = "mkv"
+        elif fname.endswith(".mp4"):
+            kind = "mp4"
+        else:
+            return
+        if manifest.known(path):
+            return
+        if manifest.add_recording(self.cam.name, path, kind):
+            log(f"📥 [{self.cam.name}] Запись с диска добавлена в журнал: {os.path.basename(path)} ({kind})")
+
+
+async def send_loop(cam: Camera, multi: bool = False):
+    """Цикл отправки одной камеры. multi=True — подписывать видео именем камеры.
+
+    Просыпается по событиям inotify (новый файл в VIDEO_DIR), а без них — по таймеру:
+    раз в 10 с без inotify и раз в 60 с с ним (на случай записей, внесённых в журнал без файла-события).
+    Задачи подготовки и отправки живут в TaskGroup цикла и отменяются вместе с ним.
+    """
+    pipeline = _Pipeline(cam, multi)
+    watcher = open_watcher([cam.video_dir])
+    last_rescan = 0.0
+    try:
+        async with asyncio.TaskGroup() as tg:
+            pipeline.start(tg)
+            while True:
+                try:
+                    if time.time() - last_rescan >= SENDER_RESCAN_SEC:
+                        last_rescan = time.time()
+                        pipeline.adopt()
+                        manifest.purge()
+                    await pipeline.scan()
+                except Exception as e:
+                    log(f"⚠️ [{cam.name}] Ошибка сканирования {cam.video_dir}: {e}")
+
+                if watcher is None:
+                    await asyncio.sleep(10)
+                    continue
+                try:
+                    new_files = await watcher.wait(60)
+                    if new_files is None:
+                        # ядро потеряло часть событий — один раз обходим каталог целиком
+                        last_rescan = 0.0
+                    for path in new_files or ():
+                        pipeline.adopt_file(path)
+                except Exception as e:
+                    log(f"⚠️ [{cam.name}] Ошибка inotify, перехожу на таймер: {type(e).__name__}: {e!r}")
+                    watcher.close()
+                    watcher = None
+    finally:
+        if watcher is not None:
+            watcher.close()
@@ -0,0 +1,77 @@
+"""План нарезки по реальному индексу пакетов, а не по средней скорости потока.
+
+split_video/remux_split оценивали segment_time = duration * limit / size, то есть считали
+битрейт постоянным. На записи с движением битрейт скачет, и часть выходила больше лимита —
+upload падал уже после отправки всего файла. Здесь по индексу пакетов (размер, время и флаг
+ключевого кадра каждого пакета — один проход ffprobe без декодирования, см. modules/media_probe.py)
+жадно выбираются точки реза на ключевых кадрах так, чтобы сумма байт каждой части плюс
+накладные расходы контейнера была не больше лимита. Планировщик ничего не пишет — только
+возвращает план.
+"""
+from dataclasses import dataclass, field
+
+from modules import media_probe
+
+# Накладные расходы mp4 на часть: moov + таблицы сэмплов (stsz/stco/stts/ctts/stss)
+_MP4_FIXED_OVERHEAD = 64 * 1024
+_MP4_PER_PACKET_OVERHEAD = 16
+
+
+@dataclass
+class SplitPlan:
+    # Время начала каждой части, кроме первой (секунды от начала выходного файла)
+    cut_times: list[float] = field(default_factory=list)
+    # Оценка размера каждой части, байт (с накладными расходами)
+    part_bytes: list[int] = field(default_factory=list)
+    # False — какой-то GOP сам по себе больше лимита: уложиться на ключевых кадрах нельзя
+    provable: bool = True
+
+    @property
+    def parts(self) -> int:
+        return len(self.part_bytes)
+
+
+async def plan_split(path: str, limit_bytes: int, *, start: float = 0.0, audio_kbps: float | None = None) -> SplitPlan | None:
+    """Рассчитать точки реза по ключевым кадрам так, чтобы каждая часть была <= limit_bytes.
+
+    start      — сколько секунд с начала будет отрезано (-ss перед -i, TRIM_START_SECONDS):
+                 пакеты до него не учитываются, времена реза считаются от него.
+    audio_kbps — звук будет перекодирован: вместо размеров исходных аудио-пакетов считать
+                 этот битрейт (верхняя оценка для выходного кодека).
+    None — ffprobe не смог прочитать файл.
+    """
+    info = await media_probe.probe(path)
+    if info is None or not info.gops:
+        return None
+
+    # Группы между ключевыми кадрами: [время ключевого кадра, байт, пакетов]. При обрезке начала
+    # группа, в которую попадает start, учитывается целиком — оценка только завышается.
+    t0 = info.start_time + max(0.0, start)
+    gops: list[list] = []
+    for i, (ts, video_bytes, other_bytes, count) in enumerate(info.gops):
+        gop_end = info.gops[i + 1][0] if i + 1 < len(info.gops) else info.end_time
+        if gop_end <= t0 and i + 1 < len(info.gops):
+            continue
+        if audio_kbps is not None:
+            other_bytes = int(max(0.0, gop_end - max(ts, t0)) * audio_kbps * 1000 / 8)
+        gops.append([max(ts, t0), video_bytes + other_bytes, count])
+
+    plan = SplitPlan()
+    cur_bytes = _MP4_FIXED_OVERHEAD
+    for i, (ts, size, count) in enumerate(gops):
+        cost = size + count * _MP4_PER_PACKET_OVERHEAD
+        if i > 0 and cur_bytes + cost > limit_bytes and cur_bytes > _MP4_FIXED_OVERHEAD:
+            # этот GOP уже не влезает — новая часть начинается с его ключевого кадра
+            plan.part_bytes.append(cur_bytes)
+            plan.cut_times.append(ts - t0)
+            cur_bytes = _MP4_FIXED_OVERHEAD
+        cur_bytes += cost
+        if cur_bytes > limit_bytes:
+            plan.provable = False
+    plan.part_bytes.append(cur_bytes)
+    return plan
+
+
+def segment_times_arg(plan: SplitPlan) -> str:
+    """Значение для -segment_times: чуть раньше ключевого кадра, чтобы округление не сдвинуло рез на GOP."""
+    return ",".join(f"{max(0.001, t - 0.001):.3f}" for t in plan.cut_times)
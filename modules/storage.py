@@ -0,0 +1,291 @@
+"""Учёт места в VIDEO_DIR и вытеснение записей по квоте.
+
+Пока Telegram недоступен, send_loop ничего не удаляет, и непрерывная запись
+постепенно заполняет том. Менеджер раз в STORAGE_CHECK_INTERVAL_SEC считает
+байты по классам файлов и, если занято больше верхней отметки, удаляет записи
+(целиком: mkv + mp4 + части) в порядке STORAGE_EVICT_ORDER, старые первыми,
+пока не опустится ниже нижней отметки. Осиротевшие файлы удаляются сразу.
+"""
+import os
+import re
+import time
+import shutil
+import asyncio
+import threading
+from os.path import join
+
+from modules.env_config import (
+    STORAGE_QUOTA_MB,
+    STORAGE_HIGH_WATERMARK,
+    STORAGE_LOW_WATERMARK,
+    STORAGE_EVICT_ORDER,
+    STORAGE_CHECK_INTERVAL_SEC,
+)
+from modules import metrics
+from modules.logger import log
+
+# Метка в имени клипа по алёрту (и ручного /video): такие записи удаляются последними
+ALERT_CLIP_SUFFIX = "_alert"
+
+# Классы файлов для учёта
+CLASSES = ("continuous", "alert", "converted", "parts", "sent", "orphan", "archive", "buffer")
+
+_RE_PART = re.compile(r"_part\d{3}$")
+
+# Файлы, которые прямо сейчас обрабатывает sender: их группы не трогаем
+_BUSY: set[str] = set()
+_BUSY_LOCK = threading.Lock()
+
+_LAST_REPORT: dict = {}
+
+
+def group_key(path: str) -> str:
+    """Ключ записи: путь без расширений и без _partNNN."""
+    name = os.path.basename(path)
+    for ext in (".sent", ".mp4", ".mkv", ".jpg"):
+        if name.endswith(ext):
+            name = name[: -len(ext)]
+    name = _RE_PART.sub("", name)
+    return join(os.path.dirname(path), name)
+
+
+def mark_busy(path: str):
+    with _BUSY_LOCK:
+        _BUSY.add(group_key(path))
+
+
+def release_busy(path: str):
+    with _BUSY_LOCK:
+        _BUSY.discard(group_key(path))
+
+
+def _classify(fname: str) -> str | None:
+    if fname.endswith(".sent"):
+        return "sent"
+    if fname.endswith(".mp4"):
+        stem = fname[:-4]
+        return "parts" if _RE_PART.search(stem) else "converted"
+    if fname.endswith(".mkv"):
+        return "alert" if fname[:-4].endswith(ALERT_CLIP_SUFFIX) else "continuous"
+    if fname.endswith(".jpg"):
+        return "orphan"
+    return None
+
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+class _Group:
+    __slots__ = ("key", "files", "bytes", "mtime", "kind")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.files: list[tuple[str, str, int]] = []  # (path, class, size)
+        self.bytes = 0
+        self.mtime = float("inf")
+        self.kind = "continuous"
+
+
+def _scan(video_dirs: list[str], archive_dirs: list[str] = ()):
+    groups: dict[str, _Group] = {}
+    by_class = {c: 0 for c in CLASSES}
+
+    for d in archive_dirs:
+        # архив основного потока (dual-stream): в Telegram не уходит, только хранится
+        try:
+            names = os.listdir(d)
+        except FileNotFoundError:
+            continue
+        for fname in names:
+            path = join(d, fname)
+            if fname.startswith(".") or not fname.endswith(".mkv"):
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            g = groups.setdefault(group_key(path), _Group(group_key(path)))
+            g.files.append((path, "archive", st.st_size))
+            g.bytes += st.st_size
+            g.mtime = min(g.mtime, st.st_mtime)
+            g.kind = "archive"
+
+    for d in video_dirs:
+        try:
+            names = os.listdir(d)
+        except FileNotFoundError:
+            continue
+        for fname in names:
+            path = join(d, fname)
+            if fname.startswith("."):
+                # staging сегментатора и кольцо pre-roll: в учёт, но не в вытеснение
+                if os.path.isdir(path):
+                    by_class["buffer"] += _dir_bytes(path)
+                continue
+            cls = _classify(fname)
+            if cls is None:
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+
+            g = groups.setdefault(group_key(path), _Group(group_key(path)))
+            g.files.append((path, cls, st.st_size))
+            g.bytes += st.st_size
+            g.mtime = min(g.mtime, st.st_mtime)
+            if cls == "alert" or g.key.endswith(ALERT_CLIP_SUFFIX):
+                g.kind = "alert"
+
+    for g in groups.values():
+        classes = {cls for _p, cls, _s in g.files}
+        # всё уже отправлено (остались только .sent/.jpg) — это мусор после сбоя очистки
+        if classes <= {"sent", "orphan"}:
+            g.kind = "orphan"
+        for _p, cls, size in g.files:
+            by_class["orphan" if g.kind == "orphan" else cls] += size
+
+    return groups, by_class
+
+
+def _capacity(video_dirs: list[str], used_files: int) -> tuple[int, int]:
+    """(использовано, лимит) в байтах: по квоте или по заполнению файловой системы."""
+    if STORAGE_QUOTA_MB > 0:
+        return used_files, int(STORAGE_QUOTA_MB * 1024 * 1024)
+    du = shutil.disk_usage(video_dirs[0])
+    return du.used, du.total
+
+
+def _remove_group(g: _Group) -> int:
+    # журнал импортирует group_key отсюда, поэтому импорт — внутри функции
+    from modules import manifest
+
+    freed = 0
+    for path, _cls, size in g.files:
+        try:
+            os.remove(path)
+            freed += size
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log(f"⚠️ storage: не удалось удалить {path}: {e}")
+    manifest.evicted(g.key)
+    return freed
+
+
+def enforce(video_dirs: list[str], archive_dirs: list[str] = ()) -> dict:
+    """Один проход: удалить сирот, при превышении верхней отметки — вытеснять до нижней."""
+    groups, by_class = _scan(video_dirs, archive_dirs)
+    with _BUSY_LOCK:
+        busy = set(_BUSY)
+
+    evicted: dict[str, int] = {}
+    for g in [g for g in groups.values() if g.kind == "orphan" and g.key not in busy]:
+        freed = _remove_group(g)
+        evicted["orphan"] = evicted.get("orphan", 0) + freed
+        del groups[g.key]
+
+    used, limit = _capacity(video_dirs, sum(by_class.values()) - evicted.get("orphan", 0))
+
+    if limit > 0 and used > limit * STORAGE_HIGH_WATERMARK:
+        target = limit * STORAGE_LOW_WATERMARK
+        log(
+            f"🧹 storage: занято {used / 1048576:.0f}MB из {limit / 1048576:.0f}MB "
+            f"(> {STORAGE_HIGH_WATERMARK:.0%}), вытеснение до {STORAGE_LOW_WATERMARK:.0%}"
+        )
+        for kind in STORAGE_EVICT_ORDER:
+            candidates = sorted(
+                (g for g in groups.values() if g.kind == kind and g.key not in busy),
+                key=lambda g: g.mtime,
+            )
+            for g in candidates:
+                if used <= target:
+                    break
+                freed = _remove_group(g)
+                used -= freed
+                evicted[kind] = evicted.get(kind, 0) + freed
+                log(f"🧹 storage: удалена запись {os.path.basename(g.key)} ({kind}, {freed / 1048576:.1f}MB)")
+            if used <= target:
+                break
+        if used > target:
+            log(f"⚠️ storage: после вытеснения всё ещё занято {used / 1048576:.0f}MB (нечего удалять по политике)")
+
+    if evicted:
+        # отчёт — по состоянию после удаления
+        groups, by_class = _scan(video_dirs, archive_dirs)
+        used, limit = _capacity(video_dirs, sum(by_class.values()))
+
+    # то, что ещё ждёт отправки
+    pending = [g for g in groups.values() if g.kind not in ("orphan", "archive")]
+    report = {
+        "bytes_by_class": by_class,
+        "used": used,
+        "limit": limit,
+        "evicted": evicted,
+        "backlog_bytes": sum(g.bytes for g in pending),
+        "backlog_recordings": len(pending),
+        "backlog_oldest_age": (time.time() - min(g.mtime for g in pending)) if pending else 0.0,
+        "ts": time.time(),
+    }
+    # набор ключей всегда один и тот же: update без clear, чтобы /storage из loop'а не увидел пустой отчёт
+    _LAST_REPORT.update(report)
+    return report
+
+
+@metrics.on_scrape
+def _storage_metrics():
+    r = dict(_LAST_REPORT)
+    if not r:
+        return
+    for cls, size in r["bytes_by_class"].items():
+        metrics.STORAGE_BYTES.set(size, **{"class": cls})
+    metrics.STORAGE_LIMIT.set(r["limit"])
+
+
+def format_report() -> str:
+    r = dict(_LAST_REPORT)
+    if not r:
+        return "Учёт места ещё не выполнялся"
+    mb = lambda b: f"{b / 1048576:.1f}MB"
+    lines = [
+        f"Занято: {mb(r['used'])} из {mb(r['limit'])}"
+        + (f" ({r['used'] / r['limit']:.0%})" if r["limit"] else ""),
+        "По классам: " + ", ".join(f"{k}={mb(v)}" for k, v in r["bytes_by_class"].items() if v),
+        f"Очередь на отправку: {r['backlog_recordings']} записей, {mb(r['backlog_bytes'])}, "
+        f"старейшей {r['backlog_oldest_age'] / 3600:.1f}ч",
+    ]
+    if r["evicted"]:
+        lines.append("Удалено за последний проход: " + ", ".join(f"{k}={mb(v)}" for k, v in r["evicted"].items()))
+    return "\n".join(lines)
+
+
+async def storage_loop(video_dirs: list[str], archive_dirs: list[str] = ()):
+    """Проход enforce() раз в STORAGE_CHECK_INTERVAL_SEC.
+
+    Обход каталогов и удаление файлов — блокирующий ввод-вывод, поэтому проход идёт в потоке
+    (asyncio.to_thread) и не задерживает event loop. С loop'ом он делит только _BUSY (под
+    _BUSY_LOCK) и журнал (modules/manifest.py, под своей блокировкой).
+    """
+    last_backlog = None
+    while True:
+        try:
+            r = await asyncio.to_thread(enforce, video_dirs, archive_dirs)
+            # пишем в лог только при изменении очереди, чтобы не шуметь каждую минуту
+            backlog = (r["backlog_recordings"], r["backlog_bytes"] // 1048576)
+            if backlog != last_backlog:
+                log(
+                    f"💾 storage: очередь {r['backlog_recordings']} записей / {r['backlog_bytes'] / 1048576:.0f}MB, "
+                    f"занято {r['used'] / 1048576:.0f}MB из {r['limit'] / 1048576:.0f}MB"
+                )
+                last_backlog = backlog
+        except Exception as e:
+            log(f"⚠️ storage: ошибка прохода: {type(e).__name__}: {e!r}")
+        await asyncio.sleep(STORAGE_CHECK_INTERVAL_SEC)
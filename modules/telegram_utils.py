@@ -1,10 +1,25 @@
 import os
+import json
+import mmap
 import time
+import asyncio
 import mimetypes
 import httpx
 
-from modules.env_config import TG_TOKEN, TG_CHAT_ID, TG_SILENT_MODE, DEBUG
+from modules.env_config import (
+    TG_TOKEN,
+    TG_CHAT_ID,
+    TG_CHAT_IDS,
+    TG_SILENT_MODE,
+    TG_API_BASE_URL,
+    TG_LOCAL_MODE,
+    TG_LOCAL_VIDEO_DIR,
+    TG_ALBUM_STAGING_CHAT_ID,
+    VIDEO_DIR,
+    DEBUG,
+)
 from modules.logger import log
+from modules import http_pool, metrics, tg_ratelimit, tracing, upload_scheduler
 
 
 def _safe_url(url: str) -> str:
@@ -19,6 +34,19 @@ def _safe_url(url: str) -> str:
     return url
 
 
+def _api_url(method: str) -> str:
+    return f"{TG_API_BASE_URL}/bot{TG_TOKEN}/{method}"
+
+
+def _local_file_uri(path: str) -> str:
+    """file:// путь для сервера Bot API в режиме --local (VIDEO_DIR может быть смонтирован у него иначе)."""
+    path = os.path.abspath(path)
+    rel = os.path.relpath(path, os.path.abspath(VIDEO_DIR))
+    if not rel.startswith(".."):
+        path = os.path.join(TG_LOCAL_VIDEO_DIR, rel)
+    return "file://" + path
+
+
 def _tg_trunc(s: str, max_len: int = 2500) -> str:
     try:
         s = s if s is not None else ""
@@ -66,6 +94,9 @@ TG_RETRY_BACKOFF_SEC = _to_float(os.getenv("TG_RETRY_BACKOFF_SEC", "2"), 2.0)
 TG_UPLOAD_PROGRESS = os.getenv("TG_UPLOAD_PROGRESS", "0").strip() == "1"
 TG_UPLOAD_PROGRESS_INTERVAL_SEC = _to_float(os.getenv("TG_UPLOAD_PROGRESS_INTERVAL_SEC", "2.0"), 2.0)
 TG_UPLOAD_CHUNK_SIZE = _to_int(os.getenv("TG_UPLOAD_CHUNK_SIZE", str(256 * 1024)), 256 * 1024)
+# Подстраивать размер чанка под скорость канала (TG_UPLOAD_CHUNK_SIZE — начальный размер)
+TG_UPLOAD_CHUNK_AUTO = os.getenv("TG_UPLOAD_CHUNK_AUTO", "1").strip() == "1"
+TG_UPLOAD_CHUNK_TARGET_SEC = _to_float(os.getenv("TG_UPLOAD_CHUNK_TARGET_SEC", "0.1"), 0.1)
 
 
 def _timeout() -> httpx.Timeout:
@@ -77,9 +108,9 @@ def _timeout() -> httpx.Timeout:
     )
 
 
-def _client() -> httpx.Client:
-    # http2=False: проще диагностика и более предсказуемый upload
-    return httpx.Client(timeout=_timeout(), http2=False)
+def _client() -> httpx.AsyncClient:
+    # общий клиент с пулом соединений (modules/http_pool.py): без нового TLS-рукопожатия на каждый запрос
+    return http_pool.telegram()
 
 
 def _fmt_bytes(x: float) -> str:
@@ -98,57 +129,162 @@ def _bool_to_tg(v: bool) -> str:
     return "true" if v else "false"
 
 
-def _tg_post_simple(url: str, *, data=None, files=None, json=None) -> httpx.Response:
+def _retry_after(resp: httpx.Response) -> float:
+    """Сколько ждать по ответу 429: parameters.retry_after, иначе заголовок Retry-After."""
+    try:
+        return float(resp.json()["parameters"]["retry_after"])
+    except Exception:
+        return _to_float(resp.headers.get("retry-after", "5"), 5.0)
+
+
+async def _tg_request(url: str, send, *, chat_id, cost: int = 1, what: str = "") -> httpx.Response:
+    """Запрос к Bot API с повторами.
+
+    await send(attempt) делает один POST. Сетевые ошибки — до TG_RETRIES попыток с паузой
+    TG_RETRY_BACKOFF_SEC; ответ 429 попыткой не считается: отправка ждёт retry_after
+    (не дольше TG_FLOOD_MAX_WAIT_SEC в сумме) и повторяется.
+    """
     last_exc = None
-    for attempt in range(1, TG_RETRIES + 1):
+    attempt = 1
+    flood_wait = 0.0
+    while True:
+        await tg_ratelimit.acquire(chat_id, cost)
         try:
-            with _client() as c:
-                return c.post(url, data=data, files=files, json=json)
+            async with upload_scheduler.transfer():
+                resp = await send(attempt)
         except Exception as e:
             last_exc = e
             log(f"⚠️ TG request exception (attempt {attempt}/{TG_RETRIES}): {type(e).__name__}: {e!r}")
-            if attempt < TG_RETRIES:
-                time.sleep(TG_RETRY_BACKOFF_SEC)
+            if attempt >= TG_RETRIES:
+                break
+            metrics.UPLOAD_RETRIES.inc(reason="error")
+            attempt += 1
+            await asyncio.sleep(TG_RETRY_BACKOFF_SEC)
+            continue
+
+        if resp.status_code == 429:
+            wait = _retry_after(resp)
+            if tg_ratelimit.retry_after(chat_id, wait, flood_wait):
+                metrics.UPLOAD_RETRIES.inc(reason="flood")
+                flood_wait += wait
+                continue
+        return resp
+
     raise RuntimeError(
-        f"httpx.post failed url={_safe_url(url)} attempts={TG_RETRIES} err={type(last_exc).__name__}: {last_exc!r}"
+        f"httpx.post{what} failed url={_safe_url(url)} attempts={TG_RETRIES} err={type(last_exc).__name__}: {last_exc!r}"
     ) from last_exc
 
 
+async def _tg_post_simple(url: str, *, data=None, files=None, json=None, cost: int = 1) -> httpx.Response:
+    async def send(attempt: int) -> httpx.Response:
+        # открытый файл при повторе нужно читать сначала
+        for v in (files or {}).values():
+            f = v[1] if isinstance(v, tuple) else v
+            if hasattr(f, "seek"):
+                f.seek(0)
+        return await _client().post(url, data=data, files=files, json=json, timeout=_timeout())
+
+    chat_id = (data or json or {}).get("chat_id")
+    return await _tg_request(url, send, chat_id=chat_id, cost=cost)
+
+
+class _ChunkTuner:
+    """Размер чанка по измеренной скорости записи в сокет.
+
+    Цель — чанк примерно на TG_UPLOAD_CHUNK_TARGET_SEC: на быстром канале меньше оборотов
+    итераций event loop'а на мегабайт, на медленном — планировщик (upload_scheduler) не ждёт долго
+    конца чанка, чтобы пропустить срочную отправку.
+    """
+
+    MIN = 64 * 1024
+    MAX = 2 * 1024 * 1024
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self.rate = 0.0  # байт/с, скользящее среднее
+
+    def sent(self, nbytes: int, dt: float):
+        if not TG_UPLOAD_CHUNK_AUTO or dt <= 0:
+            return
+        rate = nbytes / dt
+        self.rate = rate if not self.rate else self.rate * 0.7 + rate * 0.3
+        target = int(self.rate * TG_UPLOAD_CHUNK_TARGET_SEC)
+        # кратно 64 KiB; меняется не более чем вдвое за шаг
+        target = max(self.MIN, min(self.MAX, target, self.size * 2)) // self.MIN * self.MIN
+        self.size = max(target, self.size // 2, self.MIN)
+
+
+def _file_chunks(file_path: str, file_size: int, tuner: _ChunkTuner):
+    """Чанки файла без копирования: срезы memoryview над mmap (размер берётся из tuner на каждом шаге)."""
+    if file_size == 0:
+        return
+    with open(file_path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), file_size, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # файл не отображается в память (не обычный файл, укоротился) — читаем как раньше
+            while True:
+                chunk = f.read(tuner.size)
+                if not chunk:
+                    return
+                yield chunk
+        try:
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        except (AttributeError, OSError):
+            pass
+        view = memoryview(mm)
+        try:
+            off = 0
+            while off < file_size:
+                chunk = view[off:off + tuner.size]
+                off += len(chunk)
+                yield chunk
+                chunk.release()
+        finally:
+            view.release()
+            try:
+                mm.close()
+            except BufferError:
+                # срез ещё у потребителя (оборванная отправка) — отображение закроет сборщик мусора
+                pass
+
+
 def _multipart_stream(*, fields: dict, file_field: str, file_path: str, boundary: str, chunk_size: int):
     """
     Ручной multipart/form-data с чанками — чтобы прогресс отражал реальную отправку.
+    Файл отдаётся срезами mmap без копирования, размер чанка подстраивается под скорость (_ChunkTuner).
     """
     filename = os.path.basename(file_path)
     file_size = os.path.getsize(file_path)
     content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
 
-    # поля
-    parts = []
+    # поля и заголовок файла — одним буфером
+    head = bytearray()
     for k, v in (fields or {}).items():
         if v is None:
             continue
-        p = (
+        head += (
             f"--{boundary}\r\n"
             f"Content-Disposition: form-data; name=\"{k}\"\r\n\r\n"
             f"{v}\r\n"
         ).encode("utf-8")
-        parts.append(p)
 
-    file_hdr = (
+    head += (
         f"--{boundary}\r\n"
         f"Content-Disposition: form-data; name=\"{file_field}\"; filename=\"{filename}\"\r\n"
         f"Content-Type: {content_type}\r\n\r\n"
     ).encode("utf-8")
+    head = bytes(head)
 
     tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
 
-    content_length = sum(len(p) for p in parts) + len(file_hdr) + file_size + len(tail)
+    content_length = len(head) + file_size + len(tail)
     headers = {
         "Content-Type": f"multipart/form-data; boundary={boundary}",
         "Content-Length": str(content_length),
     }
 
-    def gen():
+    async def gen():
         sent_total = 0
         t0 = time.time()
         t_last = t0
@@ -169,23 +305,20 @@ def _multipart_stream(*, fields: dict, file_field: str, file_path: str, boundary
             )
             t_last = now
 
-        for p in parts:
-            sent_total += len(p)
-            yield p
-            maybe_progress()
-
-        sent_total += len(file_hdr)
-        yield file_hdr
+        sent_total += len(head)
+        yield head
         maybe_progress()
 
-        with open(file_path, "rb") as f:
-            while True:
-                chunk = f.read(chunk_size)
-                if not chunk:
-                    break
-                sent_total += len(chunk)
-                yield chunk
-                maybe_progress()
+        tuner = _ChunkTuner(chunk_size)
+        for chunk in _file_chunks(file_path, file_size, tuner):
+            # между чанками — уступить канал более срочной отправке и соблюсти общий лимит скорости
+            await upload_scheduler.pace(len(chunk))
+            t_chunk = time.monotonic()
+            sent_total += len(chunk)
+            yield chunk
+            # пока генератор стоял на yield, httpx писал чанк в сокет — это и есть скорость канала
+            tuner.sent(len(chunk), time.monotonic() - t_chunk)
+            maybe_progress()
 
         sent_total += len(tail)
         yield tail
@@ -194,77 +327,122 @@ def _multipart_stream(*, fields: dict, file_field: str, file_path: str, boundary
     return headers, gen(), content_length, filename, file_size
 
 
-def _tg_post_streaming(url: str, *, fields: dict, file_field: str, file_path: str) -> httpx.Response:
-    last_exc = None
-
-    for attempt in range(1, TG_RETRIES + 1):
+async def _tg_post_streaming(url: str, *, fields: dict, file_field: str, file_path: str) -> httpx.Response:
+    async def send(attempt: int) -> httpx.Response:
         boundary = "----camera_tg_" + os.urandom(8).hex()
-        try:
-            headers, content_iter, content_length, filename, file_size = _multipart_stream(
-                fields=fields,
-                file_field=file_field,
-                file_path=file_path,
-                boundary=boundary,
-                chunk_size=TG_UPLOAD_CHUNK_SIZE,
-            )
+        headers, content_iter, content_length, filename, file_size = _multipart_stream(
+            fields=fields,
+            file_field=file_field,
+            file_path=file_path,
+            boundary=boundary,
+            chunk_size=TG_UPLOAD_CHUNK_SIZE,
+        )
 
-            log(
-                f"➡️ TG upload start: file={file_path} size={file_size} total_multipart={content_length} "
-                f"attempt={attempt}/{TG_RETRIES}"
-            )
+        log(
+            f"➡️ TG upload start: file={file_path} size={file_size} total_multipart={content_length} "
+            f"attempt={attempt}/{TG_RETRIES}"
+        )
+        t0 = time.monotonic()
+        resp = await _client().post(url, headers=headers, content=content_iter, timeout=_timeout())
+        if 200 <= resp.status_code < 300:
+            dt = max(0.001, time.monotonic() - t0)
+            metrics.UPLOAD_BYTES.inc(content_length, method=method)
+            metrics.UPLOAD_SECONDS.observe(dt, method=method)
+            metrics.UPLOAD_THROUGHPUT.observe(content_length / dt, method=method)
+        return resp
 
-            with _client() as c:
-                return c.post(url, headers=headers, content=content_iter)
+    method = url.rsplit("/", 1)[-1]
+    return await _tg_request(url, send, chat_id=fields.get("chat_id"), what="(stream)")
 
-        except Exception as e:
-            last_exc = e
-            log(f"⚠️ TG request exception (attempt {attempt}/{TG_RETRIES}): {type(e).__name__}: {e!r}")
-            if attempt < TG_RETRIES:
-                time.sleep(TG_RETRY_BACKOFF_SEC)
 
-    raise RuntimeError(
-        f"httpx.post(stream) failed url={_safe_url(url)} attempts={TG_RETRIES} err={type(last_exc).__name__}: {last_exc!r}"
-    ) from last_exc
+def _sent_file_id(message: dict) -> tuple[str, str] | None:
+    """(поле, file_id) файла из отправленного сообщения; для фото — самый большой размер."""
+    for field in ("video", "document", "animation"):
+        if message.get(field):
+            return field, message[field]["file_id"]
+    if message.get("photo"):
+        return "photo", message["photo"][-1]["file_id"]
+    return None
 
 
-def send_telegram_message(text: str):
-    payload = {
-        "chat_id": TG_CHAT_ID,
-        "text": text,
-        "disable_notification": _bool_to_tg(TG_SILENT_MODE == 0),
-        "disable_web_page_preview": _bool_to_tg(True),
-    }
-    url = f"https://api.telegram.org/bot{TG_TOKEN}/sendMessage"
+_SEND_METHOD = {"video": "sendVideo", "document": "sendDocument", "animation": "sendAnimation", "photo": "sendPhoto"}
 
-    resp = _tg_post_simple(url, data=payload)
 
-    if resp.status_code < 200 or resp.status_code >= 300:
-        log(f"⚠️ TG sendMessage HTTP error: {_tg_resp_debug(resp.status_code, dict(resp.headers), resp.text)}")
-        resp.raise_for_status()
+async def _fan_out(result: dict, fields: dict, what: str):
+    """Разослать уже загруженный в первый чат файл остальным чатам TG_CHAT_ID по file_id.
+
+    Трафик не зависит от числа получателей: байты файла уходят в Telegram один раз.
+    Ошибка одного из дополнительных чатов не считается ошибкой отправки (в основной чат файл уже дошёл).
+    """
+    if len(TG_CHAT_IDS) < 2:
+        return
+    ref = _sent_file_id(result.get("result") or {})
+    if ref is None:
+        log(f"⚠️ TG fan-out {what}: в ответе нет file_id, рассылка пропущена")
+        return
+    # Telegram мог сохранить видео как документ — тогда и рассылаем документом
+    field, file_id = ref
+    url = _api_url(_SEND_METHOD[field])
+    for chat_id in TG_CHAT_IDS[1:]:
+        data = dict(fields, chat_id=chat_id)
+        data[field] = file_id
+        try:
+            resp = await _tg_post_simple(url, data=data)
+            if resp.status_code < 200 or resp.status_code >= 300 or not resp.json().get("ok", False):
+                log(
+                    f"⚠️ TG fan-out {what} -> {chat_id}: "
+                    f"{_tg_resp_debug(resp.status_code, dict(resp.headers), resp.text)}"
+                )
+                continue
+            log(f"↪️ TG fan-out {what} -> {chat_id}")
+        except Exception as e:
+            log(f"⚠️ TG fan-out {what} -> {chat_id}: {type(e).__name__}: {e!r}")
 
-    result = resp.json()
-    if not result.get("ok", False):
-        log(f"⚠️ TG sendMessage ok=false: {result}")
-        raise Exception(result)
+
+async def send_telegram_message(text: str, chat_id: str | None = None):
+    """Текстовое сообщение во все чаты TG_CHAT_ID или только в chat_id (ответ на команду)."""
+    url = _api_url("sendMessage")
+    for chat in ([chat_id] if chat_id is not None else TG_CHAT_IDS or [TG_CHAT_ID]):
+        payload = {
+            "chat_id": chat,
+            "text": text,
+            "disable_notification": _bool_to_tg(TG_SILENT_MODE == 0),
+            "disable_web_page_preview": _bool_to_tg(True),
+        }
+
+        resp = await _tg_post_simple(url, data=payload)
+
+        if resp.status_code < 200 or resp.status_code >= 300:
+            log(f"⚠️ TG sendMessage HTTP error: {_tg_resp_debug(resp.status_code, dict(resp.headers), resp.text)}")
+            resp.raise_for_status()
+
+        result = resp.json()
+        if not result.get("ok", False):
+            log(f"⚠️ TG sendMessage ok=false: {result}")
+            raise Exception(result)
 
     log(f"Sent message: {text}")
 
 
-def send_snapshot():
-    from modules.env_config import SNAPSHOT_URL
+async def send_snapshot(snapshot_url: str | None = None, caption: str | None = None):
+    if snapshot_url is None:
+        from modules.env_config import SNAPSHOT_URL as snapshot_url
 
-    with httpx.Client(timeout=httpx.Timeout(connect=10.0, read=10.0, write=10.0, pool=10.0), http2=False) as c:
-        snap = c.get(SNAPSHOT_URL)
+    with tracing.span("snapshot_fetch"):
+        snap = await http_pool.camera().get(snapshot_url, timeout=httpx.Timeout(10.0))
         snap.raise_for_status()
 
     data = {
         "chat_id": TG_CHAT_ID,
         "disable_notification": _bool_to_tg(TG_SILENT_MODE == 0),
     }
+    if caption:
+        data["caption"] = caption
     files = {"photo": ("snapshot.jpg", snap.content, "image/jpeg")}
-    url = f"https://api.telegram.org/bot{TG_TOKEN}/sendPhoto"
+    url = _api_url("sendPhoto")
 
-    resp = _tg_post_simple(url, data=data, files=files)
+    with tracing.span("photo_upload", bytes=len(snap.content)):
+        resp = await _tg_post_simple(url, data=data, files=files)
 
     if resp.status_code < 200 or resp.status_code >= 300:
         log(f"⚠️ TG sendPhoto HTTP error: {_tg_resp_debug(resp.status_code, dict(resp.headers), resp.text)}")
@@ -276,18 +454,26 @@ def send_snapshot():
         raise Exception(result)
 
     log("Sent snapshot")
+    data.pop("chat_id")
+    with tracing.span("photo_fan_out"):
+        await _fan_out(result, data, "snapshot")
 
 
-def send_preview_image(preview_path: str):
-    url = f"https://api.telegram.org/bot{TG_TOKEN}/sendPhoto"
+async def send_preview_image(preview_path: str) -> int | None:
+    url = _api_url("sendPhoto")
     data = {
         "chat_id": TG_CHAT_ID,
         "disable_notification": _bool_to_tg(TG_SILENT_MODE == 0),
     }
 
-    with open(preview_path, "rb") as f:
-        files = {"photo": (os.path.basename(preview_path), f, "image/jpeg")}
-        resp = _tg_post_simple(url, data=data, files=files)
+    if TG_LOCAL_MODE:
+        # локальный сервер сам прочитает файл с общего тома
+        resp = await _tg_post_simple(url, data=dict(data, photo=_local_file_uri(preview_path)))
+    else:
+        # превью — десятки КБ: читаем целиком, без файлового объекта в multipart
+        with open(preview_path, "rb") as f:
+            files = {"photo": (os.path.basename(preview_path), f.read(), "image/jpeg")}
+        resp = await _tg_post_simple(url, data=data, files=files)
 
     if resp.status_code < 200 or resp.status_code >= 300:
         log(
@@ -302,29 +488,26 @@ def send_preview_image(preview_path: str):
         raise Exception(result)
 
     log(f"Sent preview image: {preview_path}")
+    data.pop("chat_id")
+    await _fan_out(result, data, f"preview {os.path.basename(preview_path)}")
+    return (result.get("result") or {}).get("message_id")
 
 
-def send_video_file(path: str, as_document: bool = False):
-    method = "sendDocument" if as_document else "sendVideo"
-    file_key = "document" if as_document else "video"
-    url = f"https://api.telegram.org/bot{TG_TOKEN}/{method}"
-
-    # Подпись к видео/документу: имя файла без расширения (в имени уже есть дата/время)
-    caption = os.path.splitext(os.path.basename(path))[0]
-
-    fields = {
-        "chat_id": TG_CHAT_ID,
-        "disable_notification": _bool_to_tg(TG_SILENT_MODE == 0),
-        "caption": caption,
-    }
+async def _post_video(path: str, method: str, file_key: str, fields: dict) -> dict:
+    """Загрузить видео/документ в fields["chat_id"]; ответ Telegram (ok=true) или исключение."""
+    url = _api_url(method)
 
     try:
         sz = os.path.getsize(path)
     except Exception:
         sz = None
-    log(f"➡️ TG {method} start: file={path} size={sz}")
+    log(f"➡️ TG {method} start: file={path} size={sz} chat={fields['chat_id']}")
 
-    resp = _tg_post_streaming(url, fields=fields, file_field=file_key, file_path=path)
+    if TG_LOCAL_MODE:
+        # локальный сервер сам прочитает файл с общего тома — байты по HTTP не передаются
+        resp = await _tg_post_simple(url, data=dict(fields, **{file_key: _local_file_uri(path)}))
+    else:
+        resp = await _tg_post_streaming(url, fields=fields, file_field=file_key, file_path=path)
 
     if resp.status_code < 200 or resp.status_code >= 300:
         log(
@@ -339,3 +522,113 @@ def send_video_file(path: str, as_document: bool = False):
         raise Exception(result)
 
     log(f"✅ TG {method} success: {path}")
+    return result
+
+
+async def send_video_file(path: str, as_document: bool = False, caption: str | None = None) -> int | None:
+    """Отправить видео/документ. Возвращает message_id сообщения в первом чате TG_CHAT_ID."""
+    method = "sendDocument" if as_document else "sendVideo"
+    file_key = "document" if as_document else "video"
+
+    # Подпись к видео/документу по умолчанию: имя файла без расширения (в имени уже есть дата/время)
+    if caption is None:
+        caption = os.path.splitext(os.path.basename(path))[0]
+
+    fields = {
+        "chat_id": TG_CHAT_ID,
+        "disable_notification": _bool_to_tg(TG_SILENT_MODE == 0),
+        "caption": caption,
+    }
+
+    result = await _post_video(path, method, file_key, fields)
+    fields.pop("chat_id")
+    await _fan_out(result, fields, os.path.basename(path))
+    return (result.get("result") or {}).get("message_id")
+
+
+async def stage_video(path: str) -> tuple[str, str]:
+    """Загрузить часть альбома в служебный чат TG_ALBUM_STAGING_CHAT_ID.
+
+    Возвращает (тип, file_id) для send_media_group: "video" или "document", если Telegram
+    не принял файл как видео.
+    """
+    fields = {
+        "chat_id": TG_ALBUM_STAGING_CHAT_ID,
+        "disable_notification": _bool_to_tg(True),
+        "caption": os.path.splitext(os.path.basename(path))[0],
+        "supports_streaming": _bool_to_tg(True),
+    }
+    result = await _post_video(path, "sendVideo", "video", fields)
+    ref = _sent_file_id(result.get("result") or {})
+    if ref is None:
+        raise Exception(f"no file_id in sendVideo result: {result}")
+    return ref
+
+
+def _media_by_file_id(media: list[dict], messages: list[dict]) -> list[dict]:
+    """Элементы альбома со ссылками на уже загруженные файлы (file_id из отправленных сообщений)."""
+    sent = [_sent_file_id(m) for m in messages]
+    if len(sent) != len(media) or None in sent:
+        return media
+    out = []
+    for item, (field, file_id) in zip(media, sent):
+        item = dict(item, media=file_id)
+        if field in ("video", "document", "photo"):
+            item["type"] = field
+        out.append(item)
+    return out
+
+
+async def send_media_group(items: list[tuple[str, str]], caption: str | None = None) -> list[int]:
+    """Отправить альбом (2..10 элементов) во все чаты TG_CHAT_ID.
+
+    items   — (тип, ссылка): тип "video"/"document", ссылка — file_id, а в TG_LOCAL_MODE можно
+              путь к файлу (сервер прочитает его сам).
+    caption — подпись альбома (Telegram показывает подпись первого элемента).
+    Файлы передаются по ссылке, поэтому рассылка по нескольким чатам трафика не добавляет.
+    Остальным чатам альбом уходит по file_id из ответа первого: локальный сервер не читает файлы
+    повторно, а file:// ссылки не рассылаются.
+    Возвращает message_id элементов альбома в первом чате; ошибки дополнительных чатов только логируются.
+    """
+    media = []
+    for i, (kind, ref) in enumerate(items):
+        if TG_LOCAL_MODE and os.path.isabs(ref):
+            ref = _local_file_uri(ref)
+        item = {"type": kind, "media": ref}
+        if kind == "video":
+            item["supports_streaming"] = True
+        if i == 0 and caption:
+            item["caption"] = caption
+        media.append(item)
+
+    url = _api_url("sendMediaGroup")
+    message_ids: list[int] = []
+    for n, chat in enumerate(TG_CHAT_IDS or [TG_CHAT_ID]):
+        data = {
+            "chat_id": chat,
+            "media": json.dumps(media, ensure_ascii=False),
+            "disable_notification": _bool_to_tg(TG_SILENT_MODE == 0),
+        }
+        try:
+            resp = await _tg_post_simple(url, data=data, cost=len(media))
+            if resp.status_code < 200 or resp.status_code >= 300:
+                log(
+                    f"⚠️ TG sendMediaGroup HTTP error -> {chat}: "
+                    f"{_tg_resp_debug(resp.status_code, dict(resp.headers), resp.text)}"
+                )
+                resp.raise_for_status()
+            result = resp.json()
+            if not result.get("ok", False):
+                log(f"⚠️ TG sendMediaGroup ok=false -> {chat}: {result}")
+                raise Exception(result)
+        except Exception as e:
+            if n == 0:
+                raise
+            log(f"⚠️ TG fan-out album -> {chat}: {type(e).__name__}: {e!r}")
+            continue
+        if n == 0:
+            messages = result.get("result") or []
+            message_ids = [m.get("message_id") for m in messages]
+            media = _media_by_file_id(media, messages)
+        log(f"✅ TG sendMediaGroup success -> {chat}: {len(media)} items")
+    return message_ids
@@ -0,0 +1,124 @@
+"""Ограничение частоты запросов к Bot API под лимиты Telegram и обработка 429.
+
+Ответ 429 раньше обрабатывался как любая ошибка: raise_for_status падал, и запись заново
+готовилась на следующем проходе send_loop. Теперь перед каждой отправкой берётся место в
+токен-бакетах (общий — TG_RATE_GLOBAL_PER_SEC сообщений в секунду на бота; на чат —
+TG_RATE_CHAT_PER_SEC в секунду, для групп и каналов дополнительно TG_RATE_GROUP_PER_MIN
+в минуту), а на 429 чат блокируется на retry_after и отправка ждёт своей очереди.
+
+Все отправки — задачи одного event loop'а, поэтому бакеты без блокировок: между await
+состояние не меняется.
+
+Время ожидания копится по чатам — format_report() показывает, упираемся ли мы в лимиты.
+"""
+import time
+import asyncio
+
+from modules.env_config import (
+    TG_RATE_GLOBAL_PER_SEC,
+    TG_RATE_CHAT_PER_SEC,
+    TG_RATE_GROUP_PER_MIN,
+    TG_FLOOD_MAX_WAIT_SEC,
+)
+from modules.logger import log
+
+
+class _Bucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    def wait_for(self, cost: float, now: float) -> float:
+        """Сколько ждать до cost токенов (0 — уже есть). Пополняет запас.
+
+        Запрос дороже ёмкости (альбом из 10 видео при лимите 1/с на чат) ждёт полного
+        бакета и уходит в долг: запас становится отрицательным, и следующие отправки
+        ждут, пока долг не погасится.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        need = min(cost, self.capacity)
+        return 0.0 if self.tokens >= need else (need - self.tokens) / self.rate
+
+
+class _ChatState:
+    def __init__(self, chat_id: str):
+        group = str(chat_id).startswith("-")
+        self.buckets = [_Bucket(TG_RATE_CHAT_PER_SEC, max(1.0, TG_RATE_CHAT_PER_SEC))]
+        if group:
+            self.buckets.append(_Bucket(TG_RATE_GROUP_PER_MIN / 60.0, TG_RATE_GROUP_PER_MIN))
+        self.blocked_until = 0.0
+        self.throttled_sec = 0.0
+        self.hits_429 = 0
+
+
+_global = _Bucket(TG_RATE_GLOBAL_PER_SEC, TG_RATE_GLOBAL_PER_SEC)
+_global_blocked_until = 0.0
+_chats: dict[str, _ChatState] = {}
+
+
+def _chat(chat_id) -> _ChatState:
+    key = str(chat_id)
+    st = _chats.get(key)
+    if st is None:
+        st = _chats[key] = _ChatState(key)
+    return st
+
+
+async def acquire(chat_id, cost: int = 1):
+    """Дождаться места для отправки cost сообщений в chat_id (None — запрос не к чату)."""
+    waited = 0.0
+    while True:
+        now = time.monotonic()
+        buckets = [_global]
+        wait = max(0.0, _global_blocked_until - now)
+        st = None
+        if chat_id is not None:
+            st = _chat(chat_id)
+            buckets += st.buckets
+            wait = max(wait, st.blocked_until - now)
+        wait = max([wait] + [b.wait_for(cost, now) for b in buckets])
+        if wait <= 0:
+            for b in buckets:
+                b.tokens -= cost
+            if st is not None:
+                st.throttled_sec += waited
+            if waited >= 1.0:
+                log(f"⏳ TG rate limit: chat={chat_id} ждал {waited:.1f}s")
+            return
+        await asyncio.sleep(wait)
+        waited += wait
+
+
+def retry_after(chat_id, seconds: float, waited_total: float) -> bool:
+    """Telegram ответил 429: заблокировать чат на seconds.
+
+    Возвращает False, если суммарное ожидание этой отправки превысит TG_FLOOD_MAX_WAIT_SEC —
+    тогда ответ 429 возвращается вызывающему как ошибка.
+    """
+    global _global_blocked_until
+    seconds = max(1.0, seconds)
+    until = time.monotonic() + seconds
+    if chat_id is None:
+        _global_blocked_until = max(_global_blocked_until, until)
+    else:
+        st = _chat(chat_id)
+        st.hits_429 += 1
+        st.blocked_until = max(st.blocked_until, until)
+    if waited_total + seconds > TG_FLOOD_MAX_WAIT_SEC:
+        log(f"⚠️ TG 429: chat={chat_id} retry_after={seconds:.0f}s — дольше TG_FLOOD_MAX_WAIT_SEC, отказ")
+        return False
+    log(f"⏳ TG 429: chat={chat_id} retry_after={seconds:.0f}s, отправка подождёт")
+    return True
+
+
+def format_report() -> str:
+    rows = [(k, st.throttled_sec, st.hits_429) for k, st in _chats.items()]
+    if not rows:
+        return "🚦 Лимиты Telegram: отправок ещё не было"
+    lines = ["🚦 Лимиты Telegram (ожидание по чатам):"]
+    for chat_id, sec, hits in sorted(rows):
+        lines.append(f"{chat_id}: ждали {sec:.0f}s, ответов 429: {hits}")
+    return "\n".join(lines)
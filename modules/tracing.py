@@ -0,0 +1,201 @@
+"""Сквозная трассировка алёрта: от события ONVIF до последней отправленной части клипа.
+
+Трасса заводится, когда ONVIF-событие приводит к фото (прошло ALERT_TIMEOUT), и её id идёт
+дальше по конвейеру:
+- фото: bind(...) в цикле ONVIF — спаны snapshot_fetch и photo_upload внутри send_snapshot;
+- запись: ближайшая записанная после события запись камеры забирает все ожидающие трассы
+  (claim) и получает спан record;
+- отправка: sender по ключу записи находит трассы (for_key) — спаны prepare, preview_upload,
+  part_upload, затем отметка delivered.
+
+Каждый завершённый спан пишется строкой в TRACE_LOG_PATH (JSONL), последние трассы хранятся
+в памяти для команды /trace. Цель по умолчанию: фото за TRACE_PHOTO_TARGET_SEC (2 с),
+клип — за TRACE_CLIP_TARGET_SEC (60 с) от события.
+"""
+import os
+import json
+import time
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from modules.env_config import TRACE_LOG_PATH, TRACE_PHOTO_TARGET_SEC, TRACE_CLIP_TARGET_SEC
+from modules.logger import log
+from modules import metrics
+
+_MAX_TRACES = 200
+# при превышении файл переименовывается в .1 (одна предыдущая копия)
+_LOG_MAX_BYTES = 10 * 1024 * 1024
+
+_lock = threading.Lock()
+_traces: "OrderedDict[str, dict]" = OrderedDict()
+# камера -> трассы, ещё не привязанные к записи
+_pending: dict[str, list[str]] = {}
+# ключ записи (storage.group_key) -> трассы
+_by_key: dict[str, list[str]] = {}
+# трассы текущей задачи asyncio (наследуются дочерними задачами)
+_current_tids: contextvars.ContextVar[tuple[str, ...]] = contextvars.ContextVar("trace_ids", default=())
+
+
+def _write(record: dict):
+    if not TRACE_LOG_PATH:
+        return
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    try:
+        with _lock:
+            if os.path.exists(TRACE_LOG_PATH) and os.path.getsize(TRACE_LOG_PATH) > _LOG_MAX_BYTES:
+                os.replace(TRACE_LOG_PATH, TRACE_LOG_PATH + ".1")
+            with open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(line)
+    except OSError as e:
+        log(f"⚠️ trace: не удалось записать {TRACE_LOG_PATH}: {e}")
+
+
+def start(camera: str, kind: str, ts: float | None = None) -> str:
+    """Новая трасса по ONVIF-событию (ts — время его получения); до привязки к записи она ждёт в очереди камеры."""
+    tid = os.urandom(4).hex()
+    now = ts or time.time()
+    with _lock:
+        _traces[tid] = {"id": tid, "camera": camera, "kind": kind, "start": now, "spans": [], "marks": {}}
+        while len(_traces) > _MAX_TRACES:
+            old, _ = _traces.popitem(last=False)
+            for key, lst in list(_by_key.items()):
+                if old in lst:
+                    lst.remove(old)
+                if not lst:
+                    del _by_key[key]
+        _pending.setdefault(camera, []).append(tid)
+    _write({"trace": tid, "camera": camera, "event": "start", "kind": kind, "ts": now})
+    return tid
+
+
+@contextmanager
+def bind(tids):
+    """Привязать трассы (id или список id) к текущей задаче: span()/mark() пишут в них."""
+    if isinstance(tids, str):
+        tids = [tids]
+    token = _current_tids.set(tuple(tids or ()))
+    try:
+        yield
+    finally:
+        _current_tids.reset(token)
+
+
+def _current() -> list[str]:
+    return list(_current_tids.get())
+
+
+def _add_span(tids: list[str], name: str, t0: float, t1: float, attrs: dict):
+    for tid in tids:
+        with _lock:
+            tr = _traces.get(tid)
+            if tr is None:
+                continue
+            tr["spans"].append({"name": name, "start": t0, "end": t1, **attrs})
+            camera = tr["camera"]
+        _write({"trace": tid, "camera": camera, "span": name, "start": t0, "end": t1,
+                "dur": round(t1 - t0, 3), **attrs})
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Спан в трассах текущей задачи (без трасс — ничего не делает)."""
+    tids = _current()
+    if not tids:
+        yield
+        return
+    t0 = time.time()
+    ok = True
+    try:
+        yield
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        _add_span(tids, name, t0, time.time(), dict(attrs, ok=ok))
+
+
+def mark(name: str, **attrs):
+    """Отметка-момент (photo_sent, delivered) в трассах текущей задачи."""
+    now = time.time()
+    for tid in _current():
+        with _lock:
+            tr = _traces.get(tid)
+            if tr is None:
+                continue
+            tr["marks"][name] = now
+            camera, t_start = tr["camera"], tr["start"]
+        _write({"trace": tid, "camera": camera, "event": name, "ts": now,
+                "since_start": round(now - t_start, 3), **attrs})
+        if name == "delivered":
+            metrics.ALERT_CLIP_LATENCY.observe(now - t_start, camera=camera)
+
+
+def claim(camera: str, key: str, record_start: float | None = None, record_end: float | None = None):
+    """Запись камеры сохранена: все ожидающие трассы камеры относятся к ней."""
+    with _lock:
+        tids = _pending.pop(camera, [])
+        if tids:
+            _by_key.setdefault(key, []).extend(tids)
+    if tids and record_start is not None:
+        _add_span(tids, "record", record_start, record_end or time.time(), {"file": os.path.basename(key)})
+    elif tids:
+        with bind(tids):
+            mark("recorded", file=os.path.basename(key))
+
+
+def for_key(key: str) -> list[str]:
+    with _lock:
+        return list(_by_key.get(key, ()))
+
+
+def _latencies(tr: dict) -> tuple[float | None, float | None]:
+    photo = tr["marks"].get("photo_sent")
+    clip = tr["marks"].get("delivered")
+    return (photo - tr["start"] if photo else None, clip - tr["start"] if clip else None)
+
+
+def _fmt(v: float | None, target: float) -> str:
+    if v is None:
+        return "—"
+    return f"{v:.1f}s{'' if v <= target else ' ⚠️'}"
+
+
+def format_report(trace_id: str | None = None) -> str:
+    with _lock:
+        traces = [dict(t, spans=list(t["spans"]), marks=dict(t["marks"])) for t in _traces.values()]
+    if trace_id:
+        tr = next((t for t in traces if t["id"] == trace_id), None)
+        if tr is None:
+            return f"❌ Трасса {trace_id} не найдена"
+        lines = [f"🧭 {tr['id']} [{tr['camera']}] {tr['kind']} {time.strftime('%H:%M:%S', time.localtime(tr['start']))}"]
+        for s in sorted(tr["spans"], key=lambda s: s["start"]):
+            extra = f" {s['part']}" if s.get("part") else ""
+            lines.append(
+                f"+{s['start'] - tr['start']:.2f}s {s['name']}{extra}: {s['end'] - s['start']:.2f}s"
+                + ("" if s.get("ok", True) else " ❌")
+            )
+        for name, ts in sorted(tr["marks"].items(), key=lambda kv: kv[1]):
+            lines.append(f"+{ts - tr['start']:.2f}s {name}")
+        return "\n".join(lines)
+
+    if not traces:
+        return "Трасс алёртов ещё нет"
+    photo = [p for p, _ in map(_latencies, traces) if p is not None]
+    clip = [c for _, c in map(_latencies, traces) if c is not None]
+    lines = ["🧭 Алёрты: от события до фото / до клипа"]
+    if photo:
+        ok = sum(1 for p in photo if p <= TRACE_PHOTO_TARGET_SEC)
+        lines.append(f"Фото ≤{TRACE_PHOTO_TARGET_SEC:g}s: {ok}/{len(photo)} ({ok / len(photo):.0%})")
+    if clip:
+        ok = sum(1 for c in clip if c <= TRACE_CLIP_TARGET_SEC)
+        lines.append(f"Клип ≤{TRACE_CLIP_TARGET_SEC:g}s: {ok}/{len(clip)} ({ok / len(clip):.0%})")
+    for tr in traces[-10:]:
+        p, c = _latencies(tr)
+        lines.append(
+            f"{tr['id']} [{tr['camera']}] {time.strftime('%H:%M:%S', time.localtime(tr['start']))}: "
+            f"фото {_fmt(p, TRACE_PHOTO_TARGET_SEC)}, клип {_fmt(c, TRACE_CLIP_TARGET_SEC)}"
+        )
+    lines.append("Подробно: /trace <id>")
+    return "\n".join(lines)
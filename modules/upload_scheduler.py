@@ -0,0 +1,143 @@
+"""Общий планировщик отправки в Telegram: классы срочности и общий лимит канала.
+
+Фото по алёрту, ответы на команды и многосотмегабайтные сегменты шли в один канал без
+согласования: снимок алёрта мог ждать, пока уйдёт 10-минутное видео. Здесь у каждой отправки
+есть класс (по убыванию срочности): ALERT_PHOTO > COMMAND > ALERT_CLIP > CONTINUOUS.
+
+- Класс задаётся для задачи asyncio (contextvar, наследуется дочерними задачами):
+  `with priority(ALERT_PHOTO): await send_snapshot(...)`. Без явного класса — CONTINUOUS.
+- Слоты upload'а sender'а (SENDER_UPLOAD_WORKERS) выдаются по классу: свободный слот получает
+  самый срочный ожидающий; если все слоты заняты менее срочными, срочный берёт слот сверх лимита.
+- Потоковая загрузка (_multipart_stream) между чанками уступает канал, пока идёт более срочная
+  отправка (не дольше TG_UPLOAD_YIELD_MAX_SEC подряд — иначе сервер оборвёт простаивающее соединение).
+- TG_UPLOAD_MAX_KBPS — общий лимит скорости потоковых загрузок (0 — без лимита).
+
+Согласование только внутри процесса: все камеры и обработчики — задачи одного event loop'а (main.py).
+"""
+import time
+import asyncio
+import contextvars
+from contextlib import contextmanager, asynccontextmanager
+
+from modules.env_config import SENDER_UPLOAD_WORKERS, TG_UPLOAD_MAX_KBPS, TG_UPLOAD_YIELD_MAX_SEC
+from modules.logger import log
+
+ALERT_PHOTO, COMMAND, ALERT_CLIP, CONTINUOUS = range(4)
+CLASS_NAMES = ("alert_photo", "command", "alert_clip", "continuous")
+
+# без явного класса — самый низкий: уведомления о сбоях ffmpeg, о падении циклов, о старте
+# и остановке не должны обгонять фото алёрта и ответы на команды (COMMAND — только у
+# commands_handler._handle_and_reply)
+_class: contextvars.ContextVar[int] = contextvars.ContextVar("upload_class", default=CONTINUOUS)
+
+
+def current() -> int:
+    """Класс отправки текущей задачи."""
+    return _class.get()
+
+
+@contextmanager
+def priority(cls: int):
+    """Назначить класс отправкам, сделанным внутри блока (и в задачах, созданных в нём)."""
+    token = _class.set(cls)
+    try:
+        yield
+    finally:
+        _class.reset(token)
+
+
+class _Scheduler:
+    def __init__(self, slots: int, max_kbps: float, yield_max_sec: float):
+        self._cond: asyncio.Condition | None = None
+        self._cond_loop = None
+        self._slots = max(1, slots)
+        self._holders: list[int] = []
+        self._waiting = [0] * len(CLASS_NAMES)
+        self._active = [0] * len(CLASS_NAMES)
+        self._rate = max(0.0, max_kbps) * 1000 / 8  # байт/с
+        self._tokens = self._rate
+        self._refilled = time.monotonic()
+        self._yield_max = max(0.0, yield_max_sec)
+
+    @property
+    def cond(self) -> asyncio.Condition:
+        # Condition привязывается к loop'у при первом ожидании; новый asyncio.run — новый Condition
+        loop = asyncio.get_running_loop()
+        if self._cond_loop is not loop:
+            self._cond, self._cond_loop = asyncio.Condition(), loop
+        return self._cond
+
+    def _can_take(self, cls: int) -> bool:
+        if any(self._waiting[:cls]):
+            return False
+        if len(self._holders) < self._slots:
+            return True
+        # все слоты у менее срочных: берём сверх лимита, они уступят канал между чанками
+        return min(self._holders) > cls
+
+    @asynccontextmanager
+    async def slot(self):
+        """Слот upload'а sender'а (вместо семафора на SENDER_UPLOAD_WORKERS)."""
+        cls = current()
+        cond = self.cond
+        async with cond:
+            self._waiting[cls] += 1
+            try:
+                await cond.wait_for(lambda: self._can_take(cls))
+            finally:
+                self._waiting[cls] -= 1
+            self._holders.append(cls)
+        try:
+            yield
+        finally:
+            async with cond:
+                self._holders.remove(cls)
+                cond.notify_all()
+
+    @asynccontextmanager
+    async def transfer(self):
+        """Отметить идущую отправку текущего класса (менее срочные потоковые загрузки ей уступают)."""
+        cls = current()
+        cond = self.cond
+        self._active[cls] += 1
+        try:
+            yield
+        finally:
+            self._active[cls] -= 1
+            async with cond:
+                cond.notify_all()
+
+    async def pace(self, nbytes: int):
+        """Вызывается перед каждым чанком потоковой загрузки: уступить срочным и соблюсти лимит скорости."""
+        cls = current()
+        t0 = time.monotonic()
+        if any(self._active[:cls]) and self._yield_max:
+            cond = self.cond
+            try:
+                async with cond:
+                    await asyncio.wait_for(cond.wait_for(lambda: not any(self._active[:cls])), self._yield_max)
+            except asyncio.TimeoutError:
+                pass
+        waited = time.monotonic() - t0
+        if waited >= 0.5:
+            log(f"⏸ upload ({CLASS_NAMES[cls]}) уступил канал срочной отправке на {waited:.1f}s")
+
+        if not self._rate:
+            return
+        while True:
+            now = time.monotonic()
+            # запас не больше секунды трафика (но чанк целиком должен помещаться)
+            cap = max(self._rate, nbytes)
+            self._tokens = min(cap, self._tokens + (now - self._refilled) * self._rate)
+            self._refilled = now
+            if self._tokens >= nbytes:
+                self._tokens -= nbytes
+                return
+            await asyncio.sleep((nbytes - self._tokens) / self._rate)
+
+
+_scheduler = _Scheduler(SENDER_UPLOAD_WORKERS, TG_UPLOAD_MAX_KBPS, TG_UPLOAD_YIELD_MAX_SEC)
+
+slot = _scheduler.slot
+transfer = _scheduler.transfer
+pace = _scheduler.pace
@@ -0,0 +1,161 @@
+"""TG_LOCAL_MODE: отправка путями file:// на локальный сервер Bot API (заглушка на http.server)."""
+import asyncio
+import importlib
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+import pytest
+
+
+class _BotApiStub(BaseHTTPRequestHandler):
+    """Записывает запросы и отвечает ok=true с message_id и file_id, как Bot API."""
+
+    requests: list[dict] = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        method = self.path.rsplit("/", 1)[-1]
+        self.requests.append({
+            "method": method,
+            "content_type": self.headers.get("Content-Type", ""),
+            "body": body,
+        })
+        result = {"message_id": len(self.requests)}
+        if method == "sendVideo":
+            result["video"] = {"file_id": "video-id"}
+        elif method == "sendPhoto":
+            result["photo"] = [{"file_id": "photo-id"}]
+        elif method == "sendMediaGroup":
+            media = json.loads(parse_qs(body.decode())["media"][0])
+            result = [
+                {"message_id": 100 + i, item["type"]: {"file_id": f"{item['type']}-id-{i}"}}
+                for i, item in enumerate(media)
+            ]
+        payload = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def bot_api():
+    _BotApiStub.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _BotApiStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def local_mode(bot_api, tmp_path, monkeypatch):
+    """env_config и telegram_utils, перечитанные с TG_LOCAL_MODE=true и адресом заглушки."""
+    video_dir = tmp_path / "videos"
+    video_dir.mkdir()
+    monkeypatch.setenv("TG_LOCAL_MODE", "true")
+    monkeypatch.setenv("TG_API_BASE_URL", f"http://127.0.0.1:{bot_api.server_port}")
+    monkeypatch.setenv("TG_TOKEN", "123:test")
+    monkeypatch.setenv("TG_CHAT_ID", "1001")
+    monkeypatch.setenv("VIDEO_DIR", str(video_dir))
+    monkeypatch.setenv("TG_LOCAL_VIDEO_DIR", "/srv/bot-api/videos")
+    monkeypatch.delenv("TG_MAX_FILE_MB", raising=False)
+
+    from modules import env_config, telegram_utils
+
+    importlib.reload(env_config)
+    importlib.reload(telegram_utils)
+    yield env_config, telegram_utils, video_dir
+
+    monkeypatch.undo()
+    importlib.reload(env_config)
+    importlib.reload(telegram_utils)
+
+
+def _form(request: dict) -> dict:
+    return {k: v[0] for k, v in parse_qs(request["body"].decode()).items()}
+
+
+def test_max_file_defaults_to_2000_mb(local_mode):
+    env_config, _, _ = local_mode
+    assert env_config.TG_LOCAL_MODE is True
+    assert env_config.TG_MAX_FILE_MB == 2000
+
+
+def test_send_video_posts_file_uri(local_mode):
+    _, telegram_utils, video_dir = local_mode
+    clip = video_dir / "2026.01.01_10.00.00.mp4"
+    clip.write_bytes(b"\0" * (1024 * 1024))
+
+    assert asyncio.run(telegram_utils.send_video_file(str(clip))) == 1
+
+    (req,) = _BotApiStub.requests
+    assert req["method"] == "sendVideo"
+    # поля формой, а не multipart: байты файла по HTTP не передаются
+    assert req["content_type"].startswith("application/x-www-form-urlencoded")
+    assert len(req["body"]) < 1024
+    form = _form(req)
+    assert form["video"] == "file:///srv/bot-api/videos/2026.01.01_10.00.00.mp4"
+    assert form["chat_id"] == "1001"
+
+
+def test_send_preview_posts_file_uri(local_mode):
+    _, telegram_utils, video_dir = local_mode
+    sub = video_dir / "cam2"
+    sub.mkdir()
+    preview = sub / "2026.01.01_10.00.00.jpg"
+    preview.write_bytes(b"\xff\xd8" + b"\0" * 4096)
+
+    assert asyncio.run(telegram_utils.send_preview_image(str(preview))) == 1
+
+    (req,) = _BotApiStub.requests
+    assert req["method"] == "sendPhoto"
+    assert req["content_type"].startswith("application/x-www-form-urlencoded")
+    assert _form(req)["photo"] == "file:///srv/bot-api/videos/cam2/2026.01.01_10.00.00.jpg"
+
+
+def test_file_outside_video_dir_is_not_remapped(local_mode, tmp_path):
+    _, telegram_utils, _ = local_mode
+    other = tmp_path / "elsewhere.mp4"
+    assert telegram_utils._local_file_uri(str(other)) == f"file://{other}"
+
+
+def test_streaming_upload_not_used(local_mode, monkeypatch):
+    _, telegram_utils, video_dir = local_mode
+    clip = video_dir / "clip.mp4"
+    clip.write_bytes(b"\0" * 1024)
+
+    def no_stream(*args, **kwargs):
+        raise AssertionError("multipart stream in TG_LOCAL_MODE")
+
+    monkeypatch.setattr(telegram_utils, "_multipart_stream", no_stream)
+    asyncio.run(telegram_utils.send_video_file(str(clip)))
+    assert [r["method"] for r in _BotApiStub.requests] == ["sendVideo"]
+
+
+def test_album_fans_out_by_file_id(local_mode, monkeypatch):
+    env_config, telegram_utils, video_dir = local_mode
+    monkeypatch.setenv("TG_CHAT_ID", "1001,1002")
+    importlib.reload(env_config)
+    importlib.reload(telegram_utils)
+    parts = [video_dir / f"clip_part{i:03d}.mp4" for i in range(2)]
+    for p in parts:
+        p.write_bytes(b"\0" * 1024)
+
+    items = [("video", str(p)) for p in parts]
+    assert asyncio.run(telegram_utils.send_media_group(items, caption="clip")) == [100, 101]
+
+    reqs = [r for r in _BotApiStub.requests if r["method"] == "sendMediaGroup"]
+    assert [_form(r)["chat_id"] for r in reqs] == ["1001", "1002"]
+    first, second = (json.loads(_form(r)["media"]) for r in reqs)
+    # file:// только в первом запросе: второму чату — file_id из ответа
+    assert [m["media"] for m in first] == [f"file:///srv/bot-api/videos/{p.name}" for p in parts]
+    assert [m["media"] for m in second] == ["video-id-0", "video-id-1"]
+    assert second[0]["caption"] == "clip"
+    assert sum("file://" in _form(r)["media"] for r in reqs) == 1
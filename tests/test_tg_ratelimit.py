@@ -0,0 +1,30 @@
+"""Токен-бакеты Bot API: запросы дороже ёмкости бакета (альбомы) не должны зависать."""
+import asyncio
+import time
+
+from modules import tg_ratelimit
+
+
+def _acquire_within(chat_id, cost: int, timeout: float) -> bool:
+    try:
+        asyncio.run(asyncio.wait_for(tg_ratelimit.acquire(chat_id, cost), timeout))
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+
+def test_album_cost_above_chat_capacity_returns():
+    assert _acquire_within("ratelimit-1", 10, timeout=5)
+
+
+def test_album_cost_above_group_capacity_returns():
+    # группа: 1/с на чат и TG_RATE_GROUP_PER_MIN в минуту
+    assert _acquire_within("-100777", tg_ratelimit.TG_RATE_GROUP_PER_MIN + 5, timeout=5)
+
+
+def test_overdraw_delays_next_send():
+    assert _acquire_within("ratelimit-2", 3, timeout=5)
+    t0 = time.monotonic()
+    assert _acquire_within("ratelimit-2", 1, timeout=10)
+    # долг в 2 токена при 1/с (TG_RATE_CHAT_PER_SEC по умолчанию) гасится ~3 с
+    assert time.monotonic() - t0 >= 2.0 / tg_ratelimit.TG_RATE_CHAT_PER_SEC
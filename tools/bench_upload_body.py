@@ -0,0 +1,196 @@
+"""Микробенчмарк тела upload'а: прежний генератор (f.read на каждый чанк) против mmap/memoryview.
+
+Запуск (из корня проекта):
+    python -m tools.bench_upload_body [размер_МБ] [повторов]
+
+Сравнение legacy/mmap — при одинаковом, закреплённом размере чанка (CHUNK) и без
+upload_scheduler.pace: различается только способ чтения файла.
+  null   — тело только перебирается (чистая цена цикла и выделений памяти);
+  socket — тело отправляется POST'ом httpx.AsyncClient на локальный HTTP-сервер, который его выбрасывает.
+
+Отдельно — подстройка чанка (_ChunkTuner): боевое тело telegram_utils._multipart_stream (с pace)
+с включённой подстройкой и с чанком, закреплённым на CHUNK. На localhost и на приёмнике,
+ограниченном SLOW_MBPS (там файл не больше SLOW_MAX_MB).
+
+Все варианты — асинхронные генераторы, как тело в telegram_utils._tg_post_streaming.
+CPU — process_time всего процесса (в режиме socket сюда входит и поток сервера, одинаковый для всех вариантов).
+"""
+import os
+import sys
+import asyncio
+import time
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import httpx
+
+from modules import telegram_utils
+
+CHUNK = 256 * 1024
+SLOW_MBPS = 8
+SLOW_MAX_MB = 32
+
+
+class _PinnedTuner(telegram_utils._ChunkTuner):
+    """Размер чанка не меняется — как при TG_UPLOAD_CHUNK_AUTO=0."""
+
+    def sent(self, nbytes: int, dt: float):
+        pass
+
+
+def _parts(file_path: str, boundary: str):
+    filename = os.path.basename(file_path)
+    head = [
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"chat_id\"\r\n\r\n1\r\n".encode(),
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"video\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: video/mp4\r\n\r\n".encode(),
+    ]
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    return head, tail, sum(len(p) for p in head) + os.path.getsize(file_path) + len(tail)
+
+
+def _legacy_body(file_path: str, boundary: str):
+    """Тело как до перехода на mmap: отдельные bytes на каждое поле и f.read на каждый чанк."""
+    head, tail, length = _parts(file_path, boundary)
+
+    async def gen():
+        for part in head:
+            yield part
+        with open(file_path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK)
+                if not chunk:
+                    break
+                yield chunk
+        yield tail
+
+    return length, gen()
+
+
+def _mmap_body(file_path: str, boundary: str):
+    """Те же поля, файл — срезами mmap (telegram_utils._file_chunks) с закреплённым чанком."""
+    head, tail, length = _parts(file_path, boundary)
+
+    async def gen():
+        for part in head:
+            yield part
+        for chunk in telegram_utils._file_chunks(file_path, os.path.getsize(file_path), _PinnedTuner(CHUNK)):
+            yield chunk
+        yield tail
+
+    return length, gen()
+
+
+def _stream_body(auto: bool):
+    """Боевое тело _multipart_stream; auto=False — подстройка чанка выключена."""
+
+    def make(file_path: str, boundary: str):
+        telegram_utils.TG_UPLOAD_CHUNK_AUTO = auto
+        _headers, body, length, _name, _size = telegram_utils._multipart_stream(
+            fields={"chat_id": "1"}, file_field="video", file_path=file_path, boundary=boundary, chunk_size=CHUNK
+        )
+        return length, body
+
+    return make
+
+
+class _Sink(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    rate = 0  # байт/с, 0 — без ограничения
+
+    def do_POST(self):
+        left = int(self.headers.get("Content-Length", 0))
+        t0, got = time.monotonic(), 0
+        while left > 0:
+            n = len(self.rfile.read(min(left, 1024 * 1024)))
+            left -= n
+            got += n
+            if self.rate:
+                time.sleep(max(0.0, got / self.rate - (time.monotonic() - t0)))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class _SlowSink(_Sink):
+    rate = SLOW_MBPS * 1024 * 1024
+
+
+async def _run(make_body, file_path: str, url: str | None) -> tuple[float, float, int]:
+    """(сек, CPU сек, число отданных кусков тела)."""
+    length, body = make_body(file_path, "bench")
+    chunks = 0
+
+    async def counted():
+        nonlocal chunks
+        async for chunk in body:
+            chunks += 1
+            yield chunk
+
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    if url is None:
+        async for chunk in counted():
+            len(chunk)
+    else:
+        async with httpx.AsyncClient() as client:
+            await client.post(url, content=counted(), headers={"Content-Length": str(length)}, timeout=600.0)
+    return time.perf_counter() - wall0, time.process_time() - cpu0, chunks
+
+
+def _serve(handler) -> tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/"
+
+
+def _file(size_mb: int):
+    tmp = tempfile.NamedTemporaryFile(suffix=".mp4")
+    block = os.urandom(1024 * 1024)
+    for _ in range(size_mb):
+        tmp.write(block)
+    tmp.flush()
+    return tmp
+
+
+def _row(mode: str, name: str, size_mb: int, make_body, path: str, url: str | None, repeats: int):
+    wall, cpu, chunks = min(asyncio.run(_run(make_body, path, url)) for _ in range(repeats))
+    print(f"{mode:<10}{name:<10}{size_mb / wall:>10.0f}{cpu * 1000 / size_mb:>12.2f}{chunks:>10}")
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    auto = telegram_utils.TG_UPLOAD_CHUNK_AUTO
+    fast, fast_url = _serve(_Sink)
+    slow, slow_url = _serve(_SlowSink)
+    slow_mb = min(size_mb, SLOW_MAX_MB)
+    header = f"{'режим':<10}{'вариант':<10}{'МБ/с':>10}{'CPU мс/МБ':>12}{'чанков':>10}"
+
+    try:
+        with _file(size_mb) as tmp:
+            print(f"Файл {size_mb} МБ, лучший из {repeats} прогонов, чанк {CHUNK // 1024} KiB (закреплён)")
+            print(header)
+            for mode, url in (("null", None), ("socket", fast_url)):
+                for name, make_body in (("legacy", _legacy_body), ("mmap", _mmap_body)):
+                    _row(mode, name, size_mb, make_body, tmp.name, url, repeats)
+
+            print(f"\nПодстройка чанка (_multipart_stream, начальный чанк {CHUNK // 1024} KiB)")
+            print(header)
+            for name, make_body in (("fixed", _stream_body(False)), ("tuner", _stream_body(True))):
+                _row("socket", name, size_mb, make_body, tmp.name, fast_url, repeats)
+
+        with _file(slow_mb) as tmp:
+            for name, make_body in (("fixed", _stream_body(False)), ("tuner", _stream_body(True))):
+                _row(f"{SLOW_MBPS}МБ/с", name, slow_mb, make_body, tmp.name, slow_url, 1)
+    finally:
+        telegram_utils.TG_UPLOAD_CHUNK_AUTO = auto
+        fast.shutdown()
+        slow.shutdown()
+
+
+if __name__ == "__main__":
+    main()